@@ -2,11 +2,21 @@
 Download CSVs from provided URLs, preprocess them, and load into Postgres (Supabase).
 Requires env: POSTGRES_URL_NON_POOLING
 Outputs: scripts/output/interaction_log_processed.csv, movies_processed.csv, links_processed.csv
+
+DB load modes (--load):
+- copy (default): stream each frame through COPY ... FROM STDIN into a TEMP
+  staging table (private to the session, so concurrent runs do not collide),
+  then merge with one INSERT ... SELECT ... ON CONFLICT per table
+- values: the original multi-row INSERTs via execute_values
+A (user_id, movie_id) repeated in ratings.csv keeps its latest-ts row (the later
+row on a tie) in the processed CSV and in both load paths; a repeated movie or
+link keeps its last row.
 """
 
 import os
 import io
 import sys
+import argparse
 import time
 import json
 import math
@@ -54,7 +64,12 @@ def preprocess():
     ratings = ratings.dropna(subset=["user_id","movie_id","value","timestamp"])
     ratings["ts"] = to_timestamptz(ratings["timestamp"])
     ratings = ratings.drop(columns=["timestamp"])
-    ratings = ratings.sort_values("ts").reset_index(drop=True)
+    # Stable, so equal timestamps keep source order and the later row wins the dedup below; a missing ts loses
+    ratings = ratings.sort_values("ts", kind="stable", na_position="first")
+    n = len(ratings)
+    ratings = ratings.drop_duplicates(subset=["user_id","movie_id"], keep="last").reset_index(drop=True)
+    if n > len(ratings):
+        print(f"[v0] ratings: removed {n - len(ratings)} duplicate (user_id, movie_id) rows, kept latest ts")
 
     movies["movie_id"] = pd.to_numeric(movies["movie_id"], errors="coerce").astype("Int64")
     links["movie_id"]  = pd.to_numeric(links["movie_id"], errors="coerce").astype("Int64")
@@ -72,7 +87,89 @@ def preprocess():
     print(f"[v0] Saved processed: {ratings_out}, {movies_out}, {links_out}")
     return ratings, movies, links
 
-def load_to_db(ratings: pd.DataFrame, movies: pd.DataFrame, links: pd.DataFrame):
+COPY_CHUNK_ROWS = int(os.getenv("COPY_CHUNK_ROWS") or 500_000)
+
+# (target table, columns, key, winner order, conflict clause): the same semantics as the execute_values path.
+# Staging rows are de-duplicated on the key so DO UPDATE never touches a target row twice in one statement;
+# the winner order picks which duplicate is kept (latest ts for ratings, else the last row copied, by _ord).
+MERGES = [
+    ("processed_interactions", ["user_id","movie_id","value","ts"], ["user_id","movie_id"], "ts DESC NULLS LAST, _ord DESC",
+     "ON CONFLICT DO NOTHING"),
+    ("processed_movies", ["movie_id","title","genres"], ["movie_id"], "_ord DESC",
+     "ON CONFLICT (movie_id) DO UPDATE SET title = EXCLUDED.title, genres = EXCLUDED.genres"),
+    ("processed_links", ["movie_id","imdb_id","tmdb_id"], ["movie_id"], "_ord DESC",
+     "ON CONFLICT (movie_id) DO UPDATE SET imdb_id = EXCLUDED.imdb_id, tmdb_id = EXCLUDED.tmdb_id"),
+]
+
+def _copy_frame(cur, table: str, df: pd.DataFrame, columns):
+    # Serialize in chunks so the CSV buffer stays bounded; empty fields load as NULL.
+    cols = ", ".join(columns)
+    for start in range(0, len(df), COPY_CHUNK_ROWS):
+        buf = io.StringIO()
+        df.iloc[start:start + COPY_CHUNK_ROWS][columns].to_csv(buf, index=False, header=False, na_rep="")
+        buf.seek(0)
+        cur.copy_expert(f"COPY {table} ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
+
+def _load_copy(cur, ratings: pd.DataFrame, movies: pd.DataFrame, links: pd.DataFrame):
+    links = links.assign(tmdb_id=links["tmdb_id"].astype("Int64"))  # 862.0 -> 862 for BIGINT
+    frames = {"processed_interactions": ratings, "processed_movies": movies, "processed_links": links}
+    for table, columns, key, winner, conflict in MERGES:
+        stage = f"_stage_{table}"
+        t0 = time.time()
+        # _ord numbers the staged rows in COPY order, so duplicate keys resolve deterministically
+        cur.execute(f"CREATE TEMP TABLE {stage} (LIKE public.{table} INCLUDING DEFAULTS, _ord bigserial)")
+        print(f"[v0] COPY {len(frames[table])} rows -> {stage}")
+        _copy_frame(cur, stage, frames[table], columns)
+        cols, keys = ", ".join(columns), ", ".join(key)
+        cur.execute(f"""
+            INSERT INTO public.{table} ({cols})
+            SELECT DISTINCT ON ({keys}) {cols} FROM {stage} WHERE {" AND ".join(f"{k} IS NOT NULL" for k in key)}
+            ORDER BY {keys}, {winner}
+            {conflict}
+        """)
+        print(f"[v0] Merged {cur.rowcount} rows into {table} ({time.time() - t0:.1f}s)")
+        cur.execute(f"DROP TABLE {stage}")
+
+def _load_values(cur, ratings: pd.DataFrame, movies: pd.DataFrame, links: pd.DataFrame):
+    # Upsert processed tables
+    print("[v0] Inserting processed_interactions...")
+    execute_values(
+        cur,
+        """
+        INSERT INTO public.processed_interactions (user_id, movie_id, value, ts)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        """,
+        list(ratings[["user_id","movie_id","value","ts"]].itertuples(index=False, name=None))
+    )
+
+    print("[v0] Upserting processed_movies...")
+    execute_values(
+        cur,
+        """
+        INSERT INTO public.processed_movies (movie_id, title, genres)
+        VALUES %s
+        ON CONFLICT (movie_id) DO UPDATE SET
+          title = EXCLUDED.title,
+          genres = EXCLUDED.genres
+        """,
+        list(movies[["movie_id","title","genres"]].itertuples(index=False, name=None))
+    )
+
+    print("[v0] Upserting processed_links...")
+    execute_values(
+        cur,
+        """
+        INSERT INTO public.processed_links (movie_id, imdb_id, tmdb_id)
+        VALUES %s
+        ON CONFLICT (movie_id) DO UPDATE SET
+          imdb_id = EXCLUDED.imdb_id,
+          tmdb_id = EXCLUDED.tmdb_id
+        """,
+        list(links[["movie_id","imdb_id","tmdb_id"]].itertuples(index=False, name=None))
+    )
+
+def load_to_db(ratings: pd.DataFrame, movies: pd.DataFrame, links: pd.DataFrame, mode: str = "copy"):
     dsn = os.getenv("POSTGRES_URL_NON_POOLING") or os.getenv("POSTGRES_URL")
     if not dsn:
         print("[v0] No POSTGRES_URL provided; skipping DB upload.")
@@ -87,50 +184,26 @@ def load_to_db(ratings: pd.DataFrame, movies: pd.DataFrame, links: pd.DataFrame)
                 cur.execute(open(sql_path,"r",encoding="utf-8").read())
                 conn.commit()
 
-            # Upsert processed tables
-            print("[v0] Inserting processed_interactions...")
-            execute_values(
-                cur,
-                """
-                INSERT INTO public.processed_interactions (user_id, movie_id, value, ts)
-                VALUES %s
-                ON CONFLICT DO NOTHING
-                """,
-                list(ratings[["user_id","movie_id","value","ts"]].itertuples(index=False, name=None))
-            )
-
-            print("[v0] Upserting processed_movies...")
-            execute_values(
-                cur,
-                """
-                INSERT INTO public.processed_movies (movie_id, title, genres)
-                VALUES %s
-                ON CONFLICT (movie_id) DO UPDATE SET
-                  title = EXCLUDED.title,
-                  genres = EXCLUDED.genres
-                """,
-                list(movies[["movie_id","title","genres"]].itertuples(index=False, name=None))
-            )
-
-            print("[v0] Upserting processed_links...")
-            execute_values(
-                cur,
-                """
-                INSERT INTO public.processed_links (movie_id, imdb_id, tmdb_id)
-                VALUES %s
-                ON CONFLICT (movie_id) DO UPDATE SET
-                  imdb_id = EXCLUDED.imdb_id,
-                  tmdb_id = EXCLUDED.tmdb_id
-                """,
-                list(links[["movie_id","imdb_id","tmdb_id"]].itertuples(index=False, name=None))
-            )
+            if mode == "copy":
+                try:
+                    _load_copy(cur, ratings, movies, links)
+                except psycopg2.Error as e:
+                    # e.g. no CREATE privilege for the staging tables; the row-based path still works
+                    print(f"[v0] COPY load failed ({str(e).strip()}); falling back to execute_values")
+                    conn.rollback()
+                    _load_values(cur, ratings, movies, links)
+            else:
+                _load_values(cur, ratings, movies, links)
         conn.commit()
     print("[v0] DB upload complete.")
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--load", choices=["copy", "values"], default="copy", help="DB load path (default: COPY via staging tables)")
+    args = ap.parse_args()
     try:
         ratings, movies, links = preprocess()
-        load_to_db(ratings, movies, links)
+        load_to_db(ratings, movies, links, mode=args.load)
         print("[v0] Preprocess and DB load finished.")
     except Exception as e:
         print("[v0] Error:", str(e))
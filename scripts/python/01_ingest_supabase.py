@@ -1,8 +1,10 @@
 # Reads CSVs from provided URLs, writes to scripts/output, and upserts into movies, ratings, links.
 
-import os, io, csv, time, json, math
+import os, io, csv, time, math
 from typing import List, Dict
-import requests
+
+import sb_rest
+import source_cache
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SERVICE_ROLE = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
@@ -23,9 +25,7 @@ def _must_env(name: str) -> str:
 
 def fetch_csv(url: str) -> List[Dict[str, str]]:
     print(f"[v0] Fetching CSV: {url}")
-    r = requests.get(url, timeout=60)
-    r.raise_for_status()
-    text = r.text
+    text = source_cache.cached_text(url, timeout=60)
     reader = csv.DictReader(io.StringIO(text))
     rows = [dict(row) for row in reader]
     print(f"[v0] Loaded {len(rows)} rows from {url}")
@@ -58,18 +58,20 @@ def supabase_upsert(table: str, rows: List[Dict], conflict: str = None, chunk_si
     for i in range(0, total, chunk_size):
         chunk = rows[i:i+chunk_size]
         print(f"[v0] Upserting {len(chunk)} rows into {table} [{i}/{total}]")
-        resp = requests.post(url, headers=headers, data=json.dumps(chunk))
-        if resp.status_code >= 400:
-            print(f"[v0] Error upserting into {table}: {resp.status_code} {resp.text}")
-            raise RuntimeError(resp.text)
+        try:
+            sb_rest.client().request("POST", url, body=chunk, headers=headers)
+        except sb_rest.RestError as e:
+            print(f"[v0] Error upserting into {table}: {e.code} {e.body}")
+            raise RuntimeError(e.body or str(e))
 
 def main():
     _must_env("SUPABASE_URL")
     _must_env("SUPABASE_SERVICE_ROLE_KEY")
 
+    # Download all three concurrently; movies/links are upserted while ratings is still arriving
+    source_cache.prefetch([MOVIES_URL, LINKS_URL, RATINGS_URL])
     movies = fetch_csv(MOVIES_URL)     # movieId, title, genres
     links = fetch_csv(LINKS_URL)       # movieId, imdbId, tmdbId
-    ratings = fetch_csv(RATINGS_URL)   # userId, movieId, rating, timestamp
 
     # Normalize keys to match DB schema
     movies_rows = [
@@ -82,6 +84,13 @@ def main():
         for l in links if l.get("movieId")
     ]
 
+    # Upsert in DB
+    # 1) movies first (conflict on movie_id)
+    supabase_upsert("movies", movies_rows, conflict="movie_id", chunk_size=1000)
+    # 2) links second (conflict on movie_id)
+    supabase_upsert("links", links_rows, conflict="movie_id", chunk_size=1000)
+
+    ratings = fetch_csv(RATINGS_URL)   # userId, movieId, rating, timestamp
     ratings_rows = []
     for r in ratings:
         if not r.get("userId") or not r.get("movieId") or not r.get("rating"):
@@ -110,11 +119,6 @@ def main():
         fieldnames=["user_id", "movie_id", "rating", "ts"]
     )
 
-    # Upsert in DB
-    # 1) movies first (conflict on movie_id)
-    supabase_upsert("movies", movies_rows, conflict="movie_id", chunk_size=1000)
-    # 2) links second (conflict on movie_id)
-    supabase_upsert("links", links_rows, conflict="movie_id", chunk_size=1000)
     # 3) ratings (conflict on composite key user_id,movie_id NOT supported directly by on_conflict param; we use merge-duplicates with both keys present)
     supabase_upsert("ratings", ratings_rows, conflict="user_id,movie_id", chunk_size=1000)
 
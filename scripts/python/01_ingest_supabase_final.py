@@ -5,13 +5,15 @@
 import os
 import sys
 import csv
-import json
 import math
-from urllib import request, parse
+from urllib import parse
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Dict
 
+import sb_rest
+import source_cache
+
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SERVICE_ROLE = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 
@@ -34,28 +36,21 @@ def http_post_json(path: str, rows: List[Dict], on_conflict: str = ""):
     if on_conflict:
         sep = "&" if "?" in url else "?"
         url = f"{url}{sep}on_conflict={parse.quote(on_conflict)}"
-    payload = json.dumps(rows).encode("utf-8")
     headers = {
-        "apikey": SERVICE_ROLE,
-        "Authorization": f"Bearer {SERVICE_ROLE}",
-        "Content-Type": "application/json",
         "Prefer": "resolution=merge-duplicates,return=representation",
     }
-    req = request.Request(url, data=payload, headers=headers, method="POST")
     try:
-        with request.urlopen(req, timeout=120) as resp:
-            _ = resp.read()
-            # 201 or 200 expected for upsert
-            if resp.status not in (200, 201, 204):
-                fail(f"Upsert to {path} returned status {resp.status}")
+        resp = sb_rest.client().request("POST", url, body=rows, headers=headers, timeout=120)
+        # 201 or 200 expected for upsert
+        if resp.status not in (200, 201, 204):
+            fail(f"Upsert to {path} returned status {resp.status}")
     except Exception as e:
         fail(f"HTTP error upserting to {path}: {e}")
 
 def download_csv(url: str) -> List[Dict]:
     print(f"[v0] Downloading {url} ...")
     try:
-        with request.urlopen(url, timeout=120) as resp:
-            raw = resp.read()
+        raw = source_cache.cached_fetch(url, timeout=120).read_bytes()
     except Exception as e:
         fail(f"Failed to download {url}: {e}")
     # Best effort decode
@@ -85,9 +80,9 @@ def chunked(rows: List[Dict], size: int):
 
 def main():
     print("[v0] Starting ingestion...")
+    # Fetch all sources concurrently; each table is upserted as soon as its CSV is in
+    source_cache.prefetch([MOVIES_CSV, LINKS_CSV, RATINGS_CSV])
     movies = download_csv(MOVIES_CSV)
-    links = download_csv(LINKS_CSV)
-    ratings = download_csv(RATINGS_CSV)
 
     # Prepare raw_movies
     movies_payload = []
@@ -105,6 +100,7 @@ def main():
         http_post_json("raw_movies", batch, on_conflict="movie_id")
 
     # Prepare raw_links
+    links = download_csv(LINKS_CSV)
     links_payload = []
     for r in links:
         movie_id = to_int_or_none(r.get("movieId", "").strip())
@@ -122,6 +118,7 @@ def main():
         http_post_json("raw_links", batch, on_conflict="movie_id")
 
     # Prepare processed_interactions from ratings: epoch -> ISO UTC
+    ratings = download_csv(RATINGS_CSV)
     processed_payload = []
     out_dir = Path("scripts/output")
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
-import os, csv, json, time
-from urllib import request, parse, error
+import os, csv, time, argparse
 from datetime import datetime, timezone
 from pathlib import Path
 
+import sb_rest
+import source_cache
+import upsert_pool
+import ingest_checkpoint
+import interactions_cache
+import rating_dedup
+import derive_processed
+
 MOVIES_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/movies-QFbRyA2vveCs7siryKfN7JeU3KMxLc.csv"
 LINKS_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/links-m0RXllpAEUKtKYQc8gPNYV1ldCL0iE.csv"
 RATINGS_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/ratings-IiLogJYWPkkZnWuBdi1fdTeSyBNBts.csv"
@@ -22,34 +29,12 @@ def _check_env():
   print("[v0] Env OK")
 
 def _http(method, path, body=None, params=None, headers=None, timeout=120):
-  url = f"{SUPABASE_URL}{path}"
-  if params:
-    q = parse.urlencode(params, doseq=True); url = f"{url}?{q}"
-  data = json.dumps(body).encode("utf-8") if body is not None else None
-  req = request.Request(url, method=method, data=data)
-  req.add_header("apikey", SUPABASE_SERVICE_ROLE_KEY)
-  req.add_header("Authorization", f"Bearer {SUPABASE_SERVICE_ROLE_KEY}")
-  if body is not None: req.add_header("Content-Type", "application/json")
-  if headers:
-    for k, v in headers.items(): req.add_header(k, v)
-  try:
-    with request.urlopen(req, timeout=timeout) as resp:
-      raw = resp.read()
-      txt = raw.decode("utf-8") if raw else ""
-      if txt:
-        try: return json.loads(txt)
-        except json.JSONDecodeError: return txt
-      return None
-  except error.HTTPError as e:
-    msg = e.read().decode("utf-8", errors="ignore")
-    raise RuntimeError(f"[v0] HTTP {e.code} {e.reason} {url} :: {msg}")
-  except error.URLError as e:
-    raise RuntimeError(f"[v0] URL error {url} :: {e}")
-
-def _download(url: str, dest: Path):
-  print(f"[v0] Downloading {url}")
-  with request.urlopen(url, timeout=300) as resp, open(dest, "wb") as f:
-    f.write(resp.read())
+  # Pooled keep-alive connection; RestError (a RuntimeError) keeps the old "[v0] HTTP <code> ..." message.
+  return sb_rest.client().json(method, path, body=body, params=params, headers=headers, timeout=timeout)
+
+def _download(url: str) -> Path:
+  print(f"[v0] Fetching {url}")
+  return source_cache.cached_fetch(url, timeout=300)
 
 def _read_csv_rows(path: Path):
   with open(path, "r", newline="", encoding="utf-8") as f:
@@ -70,76 +55,197 @@ def _to_int_or_none(v):
   try: return int(s)
   except Exception: return None
 
-def _insert_rows(table: str, rows: list, prefer="return=minimal", initial_batch=1000):
-  total, batch_size = 0, max(1, initial_batch)
-  i = 0
-  while i < len(rows):
-    batch = rows[i:i+batch_size]
-    try:
-      _http("POST", f"/rest/v1/{table}", body=batch, headers={"Prefer": prefer})
-      total += len(batch); i += len(batch)
-    except RuntimeError as e:
-      msg = str(e)
-      if "HTTP 413" in msg or "Payload too large" in msg or "Request body too large" in msg or "row is too large" in msg or "HTTP 400" in msg:
-        if batch_size == 1:
-          raise
-        old = batch_size; batch_size = max(1, batch_size // 2)
-        print(f"[v0] {table} reduce batch {old} → {batch_size} due to: {msg[:140]}...")
-      else:
-        raise
-  print(f"[v0] {table} inserted: {total}")
-
-def ingest():
-  _check_env()
-  tmp = Path("scripts/tmp"); tmp.mkdir(parents=True, exist_ok=True)
-  movies_csv, links_csv, ratings_csv = tmp/"movies.csv", tmp/"links.csv", tmp/"ratings.csv"
-
-  _download(MOVIES_URL, movies_csv)
-  _download(LINKS_URL, links_csv)
-  _download(RATINGS_URL, ratings_csv)
-
-  # raw_movies
-  movies_rows = []
-  for r in _read_csv_rows(movies_csv):
+# Concurrent upserts: batches for one table may be in flight together; ratings tables get the most slots.
+TABLE_CONCURRENCY = {"raw_movies": 2, "raw_links": 2}
+
+# Unique keys from 013_add_unique_indexes.sql; upserting on them keeps replayed batches idempotent.
+ON_CONFLICT = {"raw_movies": "movie_id", "raw_links": "movie_id",
+               "raw_ratings": "user_id,movie_id", "processed_interactions": "user_id,movie_id"}
+
+CHECKPOINT_NAME = "01_ingest_supabase_resilient"
+
+def _too_large(e):
+  msg = str(e)
+  if "42P10" in msg: return False  # no unique index matching on_conflict; splitting will not help
+  return upsert_pool.is_payload_too_large(e) or "HTTP 400" in msg
+
+def _pool(prefer="return=minimal", initial_batch=1000, ckpt=None):
+  # Adaptive: each table's batch size follows a byte budget (AIMD) starting from initial_batch rows.
+  # on_commit fires in submission order per table, so the checkpoint offset never skips a batch.
+  # Every table written here has an ON_CONFLICT key, so a batch may be resent after a 5xx (idempotent).
+  def post(table, batch):
+    params = {"on_conflict": ON_CONFLICT[table]} if table in ON_CONFLICT else None
+    hdr = f"resolution=merge-duplicates,{prefer}" if params else prefer
+    _http("POST", f"/rest/v1/{table}", body=batch, params=params, headers={"Prefer": hdr})
+  return upsert_pool.UpsertPool(post, table_limits=TABLE_CONCURRENCY, is_too_large=_too_large,
+                                adaptive=True, initial_rows=max(1, initial_batch), idempotent=True,
+                                on_commit=ckpt.on_commit if ckpt else None)
+
+def _insert_rows(table: str, rows, prefer="return=minimal", initial_batch=1000, quiet=False, pool=None, ckpt=None):
+  # With a shared pool the batches are only queued; the caller's drain() surfaces failures.
+  own = pool is None
+  if own: pool = _pool(prefer, initial_batch, ckpt)
+  n = pool.feed(table, rows)
+  if own:
+    pool.drain()
+    if ckpt: ckpt.finish(table)
+    if not quiet: print(f"[v0] {table} inserted: {pool.committed.get(table, 0)}")
+  return n
+
+def _batched(rows, n):
+  # n is a fixed row count, or a callable returning the current adaptive size.
+  size = n() if callable(n) else n
+  batch = []
+  for row in rows:
+    batch.append(row)
+    if len(batch) >= size:
+      yield batch; batch = []
+      size = n() if callable(n) else n
+  if batch: yield batch
+
+def _insert_stream(table: str, rows, batch_size: int, ckpt=None):
+  # At most max_in_flight batches are alive at a time; peak memory tracks batch size, not the dataset.
+  with _pool(initial_batch=batch_size, ckpt=ckpt) as pool:
+    pool.feed(table, rows)
+  if ckpt: ckpt.finish(table)
+  print(f"[v0] {table} inserted: {pool.committed.get(table, 0)}")
+  return pool.committed.get(table, 0)
+
+def _derive_step(ckpt, user_min, user_max):
+  if ckpt.state["tables"].get("processed_interactions", {}).get("done"):
+    print("[v0] processed_interactions: already derived")
+    return
+  ckpt.start("processed_interactions", RATINGS_URL)
+  derive_processed.derive(user_min, user_max)
+  ckpt.finish("processed_interactions")
+
+def _movie_rows(src):
+  for r in src:
     mid = _to_int_or_none(r.get("movieId"))
     if mid is None: continue
-    movies_rows.append({"movie_id": mid, "title": (r.get("title") or "").strip(), "genres": (r.get("genres") or "").strip()})
-  print(f"[v0] raw_movies rows prepared: {len(movies_rows)}")
-  _insert_rows("raw_movies", movies_rows)
+    yield {"movie_id": mid, "title": (r.get("title") or "").strip(), "genres": (r.get("genres") or "").strip()}
 
-  # raw_links
-  links_rows = []
-  for r in _read_csv_rows(links_csv):
+def _link_rows(src):
+  for r in src:
     mid = _to_int_or_none(r.get("movieId"))
     if mid is None: continue
     imdb_id = (r.get("imdbId") or "").strip() or None
     tmdb_id = _to_int_or_none(r.get("tmdbId"))
-    links_rows.append({"movie_id": mid, "imdb_id": imdb_id, "tmdb_id": tmdb_id})
+    yield {"movie_id": mid, "imdb_id": imdb_id, "tmdb_id": tmdb_id}
+
+def _rating_tuples(src):
+  # (user_id, movie_id, rating, ts_iso)
+  for r in src:
+    uid = _to_int_or_none(r.get("userId")); mid = _to_int_or_none(r.get("movieId"))
+    if uid is None or mid is None: continue
+    try: rating = float(r.get("rating"))
+    except Exception: continue
+    yield uid, mid, rating, _epoch_to_iso(r.get("timestamp"))
+
+def ingest(resume=False, derive=False):
+  _check_env()
+  # All three downloads run concurrently; each table starts as soon as its own file lands.
+  source_cache.prefetch([MOVIES_URL, LINKS_URL, RATINGS_URL])
+  ckpt = ingest_checkpoint.Checkpoint(CHECKPOINT_NAME, resume=resume)
+
+  # raw_movies
+  movies_csv = _download(MOVIES_URL)
+  movies_rows = list(_movie_rows(_read_csv_rows(movies_csv)))
+  print(f"[v0] raw_movies rows prepared: {len(movies_rows)}")
+  _insert_rows("raw_movies", ckpt.skip("raw_movies", MOVIES_URL, movies_rows), ckpt=ckpt)
+
+  # raw_links
+  links_csv = _download(LINKS_URL)
+  links_rows = list(_link_rows(_read_csv_rows(links_csv)))
   print(f"[v0] raw_links rows prepared: {len(links_rows)}")
-  _insert_rows("raw_links", links_rows)
+  _insert_rows("raw_links", ckpt.skip("raw_links", LINKS_URL, links_rows), ckpt=ckpt)
 
   # raw_ratings + processed_interactions
+  ratings_csv = _download(RATINGS_URL)
+  # Repeated (user_id, movie_id) keys keep only their latest ts, in the CSV as well as the upserts
+  tuples, _ = rating_dedup.dedup_tuples(list(_rating_tuples(_read_csv_rows(ratings_csv))), label="ratings")
   raw_rows, proc_rows = [], []
-  with open(PROCESSED_INTERACTIONS_CSV, "w", newline="", encoding="utf-8") as f:
+  uids = set()
+  with interactions_cache.ColumnWriter(PROCESSED_INTERACTIONS_CSV) as cols, open(PROCESSED_INTERACTIONS_CSV, "w", newline="", encoding="utf-8") as f:
     w = csv.writer(f); w.writerow(["user_id","movie_id","value","ts"])
-    for r in _read_csv_rows(ratings_csv):
-      uid = _to_int_or_none(r.get("userId")); mid = _to_int_or_none(r.get("movieId"))
-      if uid is None or mid is None: continue
-      try: rating = float(r.get("rating"))
-      except Exception: continue
-      ts_iso = _epoch_to_iso(r.get("timestamp"))
+    for uid, mid, rating, ts_iso in tuples:
+      w.writerow([uid, mid, rating, ts_iso]); cols.append(uid, mid, rating, ts_iso)
       raw_rows.append({"user_id": uid, "movie_id": mid, "rating": rating, "ts": ts_iso})
-      proc_rows.append({"user_id": uid, "movie_id": mid, "value": rating, "ts": ts_iso})
-      w.writerow([uid, mid, rating, ts_iso])
+      if derive: uids.add(uid)
+      else: proc_rows.append({"user_id": uid, "movie_id": mid, "value": rating, "ts": ts_iso})
   print(f"[v0] raw_ratings rows prepared: {len(raw_rows)} | processed_interactions rows prepared: {len(proc_rows)}")
-  _insert_rows("raw_ratings", raw_rows)
-  _insert_rows("processed_interactions", proc_rows)
+  _insert_rows("raw_ratings", ckpt.skip("raw_ratings", RATINGS_URL, raw_rows), ckpt=ckpt)
+  if derive:
+    _derive_step(ckpt, min(uids, default=None), max(uids, default=None))
+  else:
+    _insert_rows("processed_interactions", ckpt.skip("processed_interactions", RATINGS_URL, proc_rows), ckpt=ckpt)
+  print(f"[v0] Wrote {PROCESSED_INTERACTIONS_CSV}")
+  print("[v0] Ingestion complete.")
+
+def ingest_stream(batch_size=1000, resume=False, derive=False):
+  # Rows go response -> csv.reader -> generator -> bounded batch -> POST; nothing is materialized.
+  _check_env()
+  print(f"[v0] Streaming ingest (batch {batch_size})")
+  # All three download in the background; the checkpoint waits for each source (and its fresh sha256)
+  # before deciding where that table resumes, then rows are parsed from the cached file as they are fed.
+  source_cache.prefetch([MOVIES_URL, LINKS_URL, RATINGS_URL])
+  ckpt = ingest_checkpoint.Checkpoint(CHECKPOINT_NAME, resume=resume)
+  _insert_stream("raw_movies", ckpt.skip("raw_movies", MOVIES_URL, _movie_rows(source_cache.iter_csv_rows(MOVIES_URL))), batch_size, ckpt)
+  _insert_stream("raw_links", ckpt.skip("raw_links", LINKS_URL, _link_rows(source_cache.iter_csv_rows(LINKS_URL))), batch_size, ckpt)
+
+  # The two tables can stop at different offsets; the CSV is always rewritten in full, and each
+  # table only receives the part of every batch past its own offset.
+  skip_raw = ckpt.start("raw_ratings", RATINGS_URL)
+  skip_proc = 0 if derive else ckpt.start("processed_interactions", RATINGS_URL)
+  if skip_raw or skip_proc:
+    print(f"[v0] Resuming raw_ratings after {skip_raw} rows, processed_interactions after {skip_proc} rows")
+  pos = 0
+  uid_min = uid_max = None
+  latest = rating_dedup.StreamDedup()
+  with interactions_cache.ColumnWriter(PROCESSED_INTERACTIONS_CSV) as cols, \
+       open(PROCESSED_INTERACTIONS_CSV, "w", newline="", encoding="utf-8") as f, _pool(initial_batch=batch_size, ckpt=ckpt) as pool:
+    w = csv.writer(f); w.writerow(["user_id","movie_id","value","ts"])
+    # Both tables get the same rows, so raw_ratings' sizer decides the cut for the pair.
+    for batch in _batched(_rating_tuples(source_cache.iter_csv_rows(RATINGS_URL)), lambda: pool.sizer("raw_ratings").rows):
+      # Latest ts wins per (user_id, movie_id) across the whole stream: rows older than one already kept are
+      # dropped. The whole batch is tracked, even the part a resume skips, so offsets stay in source rows.
+      keep, superseding = latest.keep(batch)
+      if superseding:
+        # This batch replaces rows that may still be in flight; let them land first so the newer ts wins.
+        pool.wait()
+      for row, k in zip(batch, keep):
+        if k: w.writerow(row); cols.append(*row)
+      raw_part = [t for i, (t, k) in enumerate(zip(batch, keep), pos) if k and i >= skip_raw]
+      pool.submit("raw_ratings", [{"user_id": u, "movie_id": m, "rating": v, "ts": t} for u, m, v, t in raw_part])
+      if derive:
+        lo, hi = min(b[0] for b in batch), max(b[0] for b in batch)
+        uid_min = lo if uid_min is None else min(uid_min, lo); uid_max = hi if uid_max is None else max(uid_max, hi)
+      else:
+        proc_part = [t for i, (t, k) in enumerate(zip(batch, keep), pos) if k and i >= skip_proc]
+        pool.submit("processed_interactions", [{"user_id": u, "movie_id": m, "value": v, "ts": t} for u, m, v, t in proc_part])
+      pos += len(batch)
+  if latest.superseded:
+    rating_dedup.dedup_csv(PROCESSED_INTERACTIONS_CSV, label="ratings")
+  ckpt.finish("raw_ratings")
+  if latest.removed: print(f"[v0] ratings: removed {latest.removed} duplicate (user_id, movie_id) rows, kept latest ts")
+  if derive: _derive_step(ckpt, uid_min, uid_max)
+  else: ckpt.finish("processed_interactions")
+  print(f"[v0] raw_ratings inserted: {pool.committed.get('raw_ratings', 0)} | processed_interactions inserted: {pool.committed.get('processed_interactions', 0)}")
   print(f"[v0] Wrote {PROCESSED_INTERACTIONS_CSV}")
   print("[v0] Ingestion complete.")
 
 if __name__ == "__main__":
+  ap = argparse.ArgumentParser(description="Ingest MovieLens CSVs into Supabase raw_* and processed_interactions.")
+  ap.add_argument("--stream", action="store_true", help="parse sources incrementally and upsert fixed-size batches (bounded memory)")
+  ap.add_argument("--batch-size", type=int, default=1000, help="initial rows per batch; adapts to UPSERT_TARGET_BYTES")
+  ap.add_argument("--resume", action="store_true", help="skip rows already committed according to scripts/tmp/checkpoints")
+  ap.add_argument("--derive-processed", action="store_true",
+                  help="upload raw_ratings only and derive processed_interactions via RPC (needs scripts/sql/014)")
+  args = ap.parse_args()
   try:
-    ingest()
+    if args.stream: ingest_stream(batch_size=args.batch_size, resume=args.resume, derive=args.derive_processed)
+    else: ingest(resume=args.resume, derive=args.derive_processed)
   except Exception as e:
     print(f"[v0] ERROR: {e}")
+    if "42P10" in str(e): print("[v0] HINT: run scripts/sql/013_add_unique_indexes.sql, then re-run with --resume")
     raise
@@ -3,10 +3,14 @@
 # Output: Populates processed_interactions, raw_movies, raw_links
 
 import os
-import json
 import csv
 import time
-from urllib import request, parse, error
+from urllib import parse
+
+import sb_rest
+import source_cache
+import upsert_pool
+import rating_dedup
 
 RATINGS_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/ratings-IiLogJYWPkkZnWuBdi1fdTeSyBNBts.csv"
 MOVIES_URL  = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/movies-QFbRyA2vveCs7siryKfN7JeU3KMxLc.csv"
@@ -21,8 +25,7 @@ def _check_env():
 
 def fetch_csv(url: str):
     print(f"[v0] Downloading CSV: {url}")
-    with request.urlopen(url) as resp:
-        text = resp.read().decode("utf-8", errors="replace")
+    text = source_cache.cached_text(url)
     rows = list(csv.DictReader(text.splitlines()))
     print(f"[v0] Loaded {len(rows)} rows from {url}")
     return rows
@@ -39,60 +42,36 @@ def _headers(prefer: str = "resolution=merge-duplicates") -> dict:
         "Prefer": prefer,
     }
 
-def batched(iterable, n=1000):
-    batch = []
-    for item in iterable:
-        batch.append(item)
-        if len(batch) >= n:
-            yield batch
-            batch = []
-    if batch:
-        yield batch
-
 def upsert(table: str, rows: list, on_conflict: str):
     if not rows:
         return 0
     url = _rest_url(table, {"on_conflict": on_conflict})
-    data = json.dumps(rows).encode("utf-8")
-    req = request.Request(url, data=data, headers=_headers())
     try:
-        with request.urlopen(req) as resp:
-            # Prefer: resolution=merge-duplicates returns 201/204; body can be empty
-            status = resp.status
-            print(f"[v0] Upserted {len(rows)} rows into {table} (HTTP {status})")
-            return len(rows)
-    except error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace")
-        print(f"[v0] ERROR upserting into {table}: HTTP {e.code} {e.reason}\n{body}")
+        resp = sb_rest.client().request("POST", url, body=rows, headers=_headers())
+        # Prefer: resolution=merge-duplicates returns 201/204; body can be empty
+        print(f"[v0] Upserted {len(rows)} rows into {table} (HTTP {resp.status})")
+        return len(rows)
+    except sb_rest.RestError as e:
+        print(f"[v0] ERROR upserting into {table}: HTTP {e.code} {e.reason}\n{e.body}")
         raise
 
+def upsert_all(table: str, rows: list, on_conflict: str, chunk: int = 2000) -> int:
+    # Several batches in flight at once, sized by byte budget starting at `chunk` rows;
+    # an HTTP 413 splits the batch in half and retries.
+    post = lambda tbl, batch: upsert(tbl, batch, on_conflict)
+    with upsert_pool.UpsertPool(post, adaptive=True, initial_rows=chunk, idempotent=True) as pool:
+        pool.feed(table, rows)
+    return pool.committed.get(table, 0)
+
 def main():
     _check_env()
     t0 = time.time()
 
-    ratings = fetch_csv(RATINGS_URL)
+    # Download concurrently; raw_movies/raw_links are upserted while ratings.csv is still arriving
+    source_cache.prefetch([MOVIES_URL, LINKS_URL, RATINGS_URL])
     movies  = fetch_csv(MOVIES_URL)
     links   = fetch_csv(LINKS_URL)
 
-    # Normalize ratings -> processed_interactions
-    proc_rows = []
-    for r in ratings:
-        try:
-            user_id  = int(r.get("userId") or 0)
-            movie_id = int(r.get("movieId") or 0)
-            value    = float(r.get("rating") or 0)
-            ts_epoch = int(r.get("timestamp") or 0)
-            ts_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts_epoch)) if ts_epoch else None
-        except Exception:
-            continue
-        if user_id and movie_id:
-            proc_rows.append({
-                "user_id": user_id,
-                "movie_id": movie_id,
-                "value": value,
-                "ts": ts_iso,
-            })
-
     # Normalize movies -> raw_movies
     movie_rows = []
     for m in movies:
@@ -124,23 +103,42 @@ def main():
                 "tmdb_id": tmdb_id,
             })
 
-    print(f"[v0] Prepared rows -> processed_interactions: {len(proc_rows)}, raw_movies: {len(movie_rows)}, raw_links: {len(link_rows)}")
-
-    total = 0
-    for batch in batched(proc_rows, 2000):
-        total += upsert("processed_interactions", batch, "user_id,movie_id")
-    print(f"[v0] Upserted processed_interactions total: {total}")
+    print(f"[v0] Prepared rows -> raw_movies: {len(movie_rows)}, raw_links: {len(link_rows)}")
 
-    total = 0
-    for batch in batched(movie_rows, 2000):
-        total += upsert("raw_movies", batch, "movie_id")
+    total = upsert_all("raw_movies", movie_rows, "movie_id")
     print(f"[v0] Upserted raw_movies total: {total}")
 
-    total = 0
-    for batch in batched(link_rows, 2000):
-        total += upsert("raw_links", batch, "movie_id")
+    total = upsert_all("raw_links", link_rows, "movie_id")
     print(f"[v0] Upserted raw_links total: {total}")
 
+    ratings = fetch_csv(RATINGS_URL)
+
+    # Normalize ratings -> processed_interactions
+    proc_rows = []
+    for r in ratings:
+        try:
+            user_id  = int(r.get("userId") or 0)
+            movie_id = int(r.get("movieId") or 0)
+            value    = float(r.get("rating") or 0)
+            ts_epoch = int(r.get("timestamp") or 0)
+            ts_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts_epoch)) if ts_epoch else None
+        except Exception:
+            continue
+        if user_id and movie_id:
+            proc_rows.append({
+                "user_id": user_id,
+                "movie_id": movie_id,
+                "value": value,
+                "ts": ts_iso,
+            })
+
+    # Repeated (user_id, movie_id) keys would fail the on_conflict upsert; keep the latest ts
+    proc_rows, _ = rating_dedup.dedup_rows(proc_rows, label="processed_interactions")
+    print(f"[v0] Prepared rows -> processed_interactions: {len(proc_rows)}")
+
+    total = upsert_all("processed_interactions", proc_rows, "user_id,movie_id")
+    print(f"[v0] Upserted processed_interactions total: {total}")
+
     print(f"[v0] Ingestion complete in {time.time()-t0:.1f}s")
 
 if __name__ == "__main__":
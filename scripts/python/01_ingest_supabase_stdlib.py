@@ -1,18 +1,19 @@
 # Fetches CSVs from your provided URLs
 # Upserts into Supabase via REST API using SUPABASE_SERVICE_ROLE_KEY
 # Writes a processed CSV to scripts/output/interaction_log_processed.csv for downstream compatibility
+import argparse
 import csv
 import io
-import json
 import os
 import sys
-import time
-import urllib.request
 import urllib.error
-import urllib.parse  # added
 from typing import List, Dict, Any
 from datetime import datetime, timezone
 
+import sb_rest
+import source_cache
+import rating_dedup
+
 RATINGS_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/ratings-IiLogJYWPkkZnWuBdi1fdTeSyBNBts.csv"
 MOVIES_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/movies-QFbRyA2vveCs7siryKfN7JeU3KMxLc.csv"
 LINKS_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/links-m0RXllpAEUKtKYQc8gPNYV1ldCL0iE.csv"
@@ -30,15 +31,32 @@ def fail(msg: str) -> None:
 def fetch_text(url: str) -> str:
     print(f"[v0] Downloading: {url}")
     try:
-        with urllib.request.urlopen(url) as resp:
-            charset = resp.headers.get_content_charset() or "utf-8"
-            data = resp.read()
-            return data.decode(charset, errors="replace")
+        return source_cache.cached_text(url, encoding="utf-8", errors="replace")
+    except urllib.error.HTTPError as e:
+        fail(f"HTTPError fetching {url}: {e.code} {e.reason}")
+    except urllib.error.URLError as e:
+        fail(f"URLError fetching {url}: {e.reason}")
+
+def stream_rows(url: str):
+    # Incremental counterpart of fetch_text + read_csv_from_text: one row in memory at a time.
+    print(f"[v0] Streaming: {url}")
+    try:
+        yield from source_cache.iter_csv_rows(url)
     except urllib.error.HTTPError as e:
         fail(f"HTTPError fetching {url}: {e.code} {e.reason}")
     except urllib.error.URLError as e:
         fail(f"URLError fetching {url}: {e.reason}")
 
+def batched(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 def read_csv_from_text(text: str) -> List[Dict[str, str]]:
     f = io.StringIO(text)
     reader = csv.DictReader(f)
@@ -53,26 +71,16 @@ def supabase_upsert(table: str, rows: List[Dict[str, Any]], on_conflict: str) ->
     if not rows:
         return
     assert SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY, "Missing Supabase env vars"
-    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}?on_conflict={urllib.parse.quote(on_conflict)}"
-    headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "resolution=merge-duplicates"
-    }
-    body = json.dumps(rows).encode("utf-8")
-    req = urllib.request.Request(url, data=body, headers=headers, method="POST")
     try:
-        with urllib.request.urlopen(req) as resp:
-            status = resp.getcode()
-            if status not in (200, 201, 204):
-                text = resp.read().decode("utf-8", errors="replace")
-                fail(f"Upsert to {table} failed with status {status}: {text}")
-    except urllib.error.HTTPError as e:
-        error_text = e.read().decode("utf-8", errors="replace")
-        fail(f"HTTPError upserting into {table}: {e.code} {e.reason} - {error_text}")
-    except urllib.error.URLError as e:
-        fail(f"URLError upserting into {table}: {e.reason}")
+        resp = sb_rest.client().request("POST", f"/rest/v1/{table}", body=rows, params={"on_conflict": on_conflict},
+                                        headers={"Prefer": "resolution=merge-duplicates"})
+        status = resp.getcode()
+        if status not in (200, 201, 204):
+            fail(f"Upsert to {table} failed with status {status}: {resp.text()}")
+    except sb_rest.RestError as e:
+        if e.code is None:
+            fail(f"URLError upserting into {table}: {e}")
+        fail(f"HTTPError upserting into {table}: {e.code} {e.reason} - {e.body}")
 
 def ensure_output_dir() -> None:
     if not os.path.isdir(OUTPUT_DIR):
@@ -155,55 +163,93 @@ def main() -> None:
     if not SUPABASE_SERVICE_ROLE_KEY:
         fail("SUPABASE_SERVICE_ROLE_KEY is not set (required for REST upserts)")
 
-    # Download CSVs
-    movies_csv = fetch_text(MOVIES_URL)
-    links_csv = fetch_text(LINKS_URL)
-    ratings_csv = fetch_text(RATINGS_URL)
-
-    # Parse
-    movies_rows = read_csv_from_text(movies_csv)
-    links_rows = read_csv_from_text(links_csv)
-    ratings_rows = read_csv_from_text(ratings_csv)
-
-    # Map to DB payloads
-    movies_payload = map_movies(movies_rows)
-    links_payload = map_links(links_rows)
-    ratings_payload = map_ratings(ratings_rows)
-
-    print(f"[v0] Movies: {len(movies_payload)}, Links: {len(links_payload)}, Ratings: {len(ratings_payload)}")
+    # Download CSVs concurrently; each table is upserted as soon as its file is in
+    source_cache.prefetch([MOVIES_URL, LINKS_URL, RATINGS_URL])
 
     # Upsert in chunks (keep payload well under 10MB)
     BATCH = 500
     # raw_movies
+    movies_payload = map_movies(read_csv_from_text(fetch_text(MOVIES_URL)))
+    print(f"[v0] Movies: {len(movies_payload)}")
     for i, batch in enumerate(chunk(movies_payload, BATCH), start=1):
         print(f"[v0] Upserting raw_movies batch {i} ({len(batch)})")
         supabase_upsert("raw_movies", batch, on_conflict="movie_id")
-        time.sleep(0.05)
     # raw_links
+    links_payload = map_links(read_csv_from_text(fetch_text(LINKS_URL)))
+    print(f"[v0] Links: {len(links_payload)}")
     for i, batch in enumerate(chunk(links_payload, BATCH), start=1):
         print(f"[v0] Upserting raw_links batch {i} ({len(batch)})")
         supabase_upsert("raw_links", batch, on_conflict="movie_id")
-        time.sleep(0.05)
     # raw_ratings (note: uses user_id,movie_id for conflict)
+    ratings_payload = map_ratings(read_csv_from_text(fetch_text(RATINGS_URL)))
+    # Repeated (user_id, movie_id) keys would fail the on_conflict upsert; keep the latest ts
+    ratings_payload, _ = rating_dedup.dedup_rows(ratings_payload, label="ratings")
+    print(f"[v0] Ratings: {len(ratings_payload)}")
     raw_ratings_payload = [{"user_id": r["user_id"], "movie_id": r["movie_id"], "rating": r["rating"], "ts": r["ts"]} for r in ratings_payload]
     for i, batch in enumerate(chunk(raw_ratings_payload, BATCH), start=1):
         print(f"[v0] Upserting raw_ratings batch {i} ({len(batch)})")
         supabase_upsert("raw_ratings", batch, on_conflict="user_id,movie_id")
-        time.sleep(0.05)
     # processed_interactions mirrors ratings with (user_id,movie_id,value,ts)
     processed_payload = [{"user_id": r["user_id"], "movie_id": r["movie_id"], "value": r["value"], "ts": r["ts"]} for r in ratings_payload]
     for i, batch in enumerate(chunk(processed_payload, BATCH), start=1):
         print(f"[v0] Upserting processed_interactions batch {i} ({len(batch)})")
         supabase_upsert("processed_interactions", batch, on_conflict="user_id,movie_id")
-        time.sleep(0.05)
 
     # Write processed CSV for compatibility with any existing scripts
     write_processed_interactions_csv(processed_payload)
 
     print("[v0] Ingestion complete")
 
+def main_stream(batch_size: int = 500) -> None:
+    print(f"[v0] Starting Supabase ingestion (stdlib, streaming, batch {batch_size})")
+
+    if not SUPABASE_URL:
+        fail("SUPABASE_URL or NEXT_PUBLIC_SUPABASE_URL is not set")
+    if not SUPABASE_SERVICE_ROLE_KEY:
+        fail("SUPABASE_SERVICE_ROLE_KEY is not set (required for REST upserts)")
+
+    source_cache.prefetch([LINKS_URL, RATINGS_URL])
+    for i, batch in enumerate(batched(stream_rows(MOVIES_URL), batch_size), start=1):
+        print(f"[v0] Upserting raw_movies batch {i} ({len(batch)})")
+        supabase_upsert("raw_movies", map_movies(batch), on_conflict="movie_id")
+    for i, batch in enumerate(batched(stream_rows(LINKS_URL), batch_size), start=1):
+        print(f"[v0] Upserting raw_links batch {i} ({len(batch)})")
+        supabase_upsert("raw_links", map_links(batch), on_conflict="movie_id")
+
+    ensure_output_dir()
+    total = 0
+    # Latest ts wins per (user_id, movie_id) across batches; batches are sent in order, so a row that
+    # supersedes an earlier batch's row simply lands after it.
+    latest = rating_dedup.StreamDedup()
+    with open(PROCESSED_INTERACTIONS_CSV, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["user_id", "movie_id", "value", "ts"])
+        for i, batch in enumerate(batched(stream_rows(RATINGS_URL), batch_size), start=1):
+            ratings_payload = map_ratings(batch)
+            keep, _ = latest.keep([(r["user_id"], r["movie_id"], r["value"], r["ts"]) for r in ratings_payload])
+            ratings_payload = [r for r, k in zip(ratings_payload, keep) if k]
+            print(f"[v0] Upserting raw_ratings + processed_interactions batch {i} ({len(ratings_payload)})")
+            supabase_upsert("raw_ratings", [{"user_id": r["user_id"], "movie_id": r["movie_id"], "rating": r["rating"], "ts": r["ts"]} for r in ratings_payload], on_conflict="user_id,movie_id")
+            supabase_upsert("processed_interactions", [{"user_id": r["user_id"], "movie_id": r["movie_id"], "value": r["value"], "ts": r["ts"]} for r in ratings_payload], on_conflict="user_id,movie_id")
+            writer.writerows([r["user_id"], r["movie_id"], r["value"], r["ts"]] for r in ratings_payload)
+            total += len(ratings_payload)
+    if latest.removed:
+        print(f"[v0] ratings: removed {latest.removed} duplicate (user_id, movie_id) rows, kept latest ts")
+    if latest.superseded:
+        total -= rating_dedup.dedup_csv(PROCESSED_INTERACTIONS_CSV, label="ratings")
+    print(f"[v0] Wrote {total} rows to {PROCESSED_INTERACTIONS_CSV}")
+
+    print("[v0] Ingestion complete")
+
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Ingest MovieLens CSVs into Supabase via REST (stdlib only).")
+    ap.add_argument("--stream", action="store_true", help="parse sources incrementally; memory bounded by batch size")
+    ap.add_argument("--batch-size", type=int, default=500)
+    args = ap.parse_args()
     try:
-        main()
+        if args.stream:
+            main_stream(batch_size=args.batch_size)
+        else:
+            main()
     except Exception as e:
         fail(f"Unhandled exception: {e}")
@@ -4,13 +4,21 @@
 # - Upserts raw_movies/raw_links on movie_id, processed_interactions on (user_id, movie_id)
 # - Adapts batch size on 413 Payload Too Large
 # - Prints table counts to verify upload
+# - --delta: only upsert rows that are new or changed since the last successful run (see delta_store.py)
 #
 # Env required: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY
 # CSV sources: set below or pass CLI args if you prefer.
 
-import os, sys, json, time, csv, math
+import os, sys, time, csv, math, argparse
 from datetime import datetime, timezone
-from urllib import request, parse, error
+from urllib import parse
+
+import sb_rest
+import delta_store
+import interactions_cache
+import rating_dedup
+import source_cache
+import upsert_pool
 
 MOVIES_CSV = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/movies-QFbRyA2vveCs7siryKfN7JeU3KMxLc.csv"
 LINKS_CSV  = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/links-m0RXllpAEUKtKYQc8gPNYV1ldCL0iE.csv"
@@ -24,8 +32,7 @@ def log(msg):
 
 def fetch_csv(url):
     log(f"Downloading {url}")
-    with request.urlopen(url) as resp:
-        data = resp.read().decode("utf-8", errors="replace")
+    data = source_cache.cached_text(url)
     reader = csv.DictReader(data.splitlines())
     rows = list(reader)
     log(f"Fetched {len(rows)} rows from {url}")
@@ -39,17 +46,9 @@ def iso_from_epoch(sec):
         return None
 
 def http_json(method, url, payload=None, headers=None):
-    data = None if payload is None else json.dumps(payload).encode("utf-8")
-    req = request.Request(url=url, data=data, method=method)
-    for k, v in (headers or {}).items():
-        req.add_header(k, v)
-    try:
-        with request.urlopen(req) as resp:
-            body = resp.read().decode("utf-8", errors="replace")
-            return resp.getcode(), resp.headers, body
-    except error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace")
-        raise RuntimeError(f"[v0] HTTP {e.code} {url} :: {body}")
+    # Shared keep-alive client; HTTP errors surface as RuntimeError("[v0] HTTP <code> ...").
+    resp = sb_rest.client().request(method, url, body=payload, headers=headers)
+    return resp.getcode(), resp.headers, resp.text()
 
 def supabase_insert(table, rows, on_conflict=None, batch_size=1000):
     # Use upsert via Prefer: resolution=merge-duplicates + on_conflict
@@ -66,28 +65,35 @@ def supabase_insert(table, rows, on_conflict=None, batch_size=1000):
         "Content-Type": "application/json",
         "Prefer": "resolution=merge-duplicates,return=representation",
     }
-    total = 0
-    bs = max(100, batch_size)
-    i = 0
-    while i < len(rows):
-        chunk = rows[i:i+bs]
+    def post(tbl, chunk):
         try:
-            code, hdrs, body = http_json("POST", url, chunk, headers)
-            total += len(chunk)
-            i += bs
+            http_json("POST", url, chunk, headers)
         except RuntimeError as e:
             msg = str(e)
-            if "413" in msg and bs > 100:
-                bs = max(100, bs // 2)
-                log(f"Payload too large; reducing batch size to {bs} and retrying …")
-                continue
-            elif "409" in msg:
+            if "409" in msg:
                 # 409 with upsert almost always means on_conflict mismatch;
                 # surface a clear hint.
                 raise RuntimeError(f"[v0] Upsert conflict on {table}. Ensure unique index matches on_conflict={on_conflict}. Error: {msg}")
-            else:
-                raise
-    return total
+            raise
+
+    # Batches go out concurrently, sized by a byte budget that grows while the server keeps up;
+    # a 413 halves the batch (down to 100 rows) and retries.
+    bs = max(100, batch_size)
+    with upsert_pool.UpsertPool(post, is_too_large=lambda e: "413" in str(e), min_rows=100,
+                                adaptive=True, initial_rows=bs) as pool:
+        pool.feed(table, rows)
+    return pool.committed.get(table, 0)
+
+def upsert_changed(table, rows, key_fields, delta=False, reset=False, **kw):
+    # Delta mode skips rows whose content hash matches the last run; hashes are saved only after the upsert succeeds.
+    if not delta:
+        return supabase_insert(table, rows, **kw)
+    store = delta_store.DeltaStore(table, key_fields, reset=reset)
+    changed = list(store.filter(rows))
+    store.log_counts()
+    n = supabase_insert(table, changed, **kw)
+    store.commit()
+    return n
 
 def supabase_count(table):
     url = f"{SUPABASE_URL}/rest/v1/{table}?select=*&limit=1"
@@ -106,15 +112,16 @@ def supabase_count(table):
     # Fallback: try RPC count if available (optional)
     return -1
 
-def main():
+def main(delta=False, delta_reset=False):
     if not SUPABASE_URL or not SERVICE_ROLE:
         log("ERROR: Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
         sys.exit(1)
     log("Env OK: using SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY")
 
+    # Download concurrently; raw_movies/raw_links go up while ratings.csv is still arriving
+    source_cache.prefetch([MOVIES_CSV, LINKS_CSV, RATINGS_CSV])
     movies = fetch_csv(MOVIES_CSV)
     links  = fetch_csv(LINKS_CSV)
-    ratings= fetch_csv(RATINGS_CSV)
 
     # Prepare rows
     movies_rows = []
@@ -152,50 +159,56 @@ def main():
             links_rows.append(row)
     log(f"raw_links rows prepared: {len(links_rows)}")
 
-    interactions_rows = []
-    out_dir = "scripts/output"
-    os.makedirs(out_dir, exist_ok=True)
-    out_csv = os.path.join(out_dir, "interaction_log_processed.csv")
-    with open(out_csv, "w", newline="", encoding="utf-8") as f:
-        wr = csv.writer(f)
-        wr.writerow(["user_id", "movie_id", "value", "ts"])
-        for r in ratings:
-            try:
-                uid = int(r.get("userId") or r.get("user_id") or 0)
-                mid = int(r.get("movieId") or r.get("movie_id") or 0)
-                val_raw = r.get("rating") or r.get("value") or "0"
-                val = float(val_raw)
-                ts_raw = r.get("timestamp") or r.get("ts") or ""
-                ts_iso = iso_from_epoch(ts_raw) if ts_raw else None
-            except Exception:
-                continue
-            if uid and mid:
-                row = {"user_id": uid, "movie_id": mid, "value": val}
-                if ts_iso:
-                    row["ts"] = ts_iso
-                interactions_rows.append(row)
-                wr.writerow([uid, mid, val, ts_iso or ""])
-    log(f"processed_interactions rows prepared: {len(interactions_rows)}")
-    log(f"Wrote {out_csv}")
-
     # Upsert in batches
     try:
-        inserted_movies = supabase_insert("raw_movies", movies_rows, on_conflict="movie_id", batch_size=1000)
+        inserted_movies = upsert_changed("raw_movies", movies_rows, ("movie_id",), delta, delta_reset, on_conflict="movie_id", batch_size=1000)
         log(f"Upserted into raw_movies: {inserted_movies}")
     except RuntimeError as e:
         log(f"ERROR while upserting raw_movies: {e}")
         raise
 
     try:
-        inserted_links = supabase_insert("raw_links", links_rows, on_conflict="movie_id", batch_size=1000)
+        inserted_links = upsert_changed("raw_links", links_rows, ("movie_id",), delta, delta_reset, on_conflict="movie_id", batch_size=1000)
         log(f"Upserted into raw_links: {inserted_links}")
     except RuntimeError as e:
         log(f"ERROR while upserting raw_links: {e}")
         raise
 
+    ratings= fetch_csv(RATINGS_CSV)
+    interactions_rows = []
+    out_dir = "scripts/output"
+    os.makedirs(out_dir, exist_ok=True)
+    out_csv = os.path.join(out_dir, "interaction_log_processed.csv")
+    for r in ratings:
+        try:
+            uid = int(r.get("userId") or r.get("user_id") or 0)
+            mid = int(r.get("movieId") or r.get("movie_id") or 0)
+            val_raw = r.get("rating") or r.get("value") or "0"
+            val = float(val_raw)
+            ts_raw = r.get("timestamp") or r.get("ts") or ""
+            ts_iso = iso_from_epoch(ts_raw) if ts_raw else None
+        except Exception:
+            continue
+        if uid and mid:
+            row = {"user_id": uid, "movie_id": mid, "value": val}
+            if ts_iso:
+                row["ts"] = ts_iso
+            interactions_rows.append(row)
+    # A repeated (user_id, movie_id) in one batch fails the on_conflict upsert; keep the latest ts per key
+    interactions_rows, _ = rating_dedup.dedup_rows(interactions_rows, label="processed_interactions")
+    with interactions_cache.ColumnWriter(out_csv) as cols, open(out_csv, "w", newline="", encoding="utf-8") as f:
+        wr = csv.writer(f)
+        wr.writerow(["user_id", "movie_id", "value", "ts"])
+        for row in interactions_rows:
+            wr.writerow([row["user_id"], row["movie_id"], row["value"], row.get("ts") or ""])
+            cols.append(row["user_id"], row["movie_id"], row["value"], row.get("ts"))
+    log(f"processed_interactions rows prepared: {len(interactions_rows)}")
+    log(f"Wrote {out_csv}")
+
     # For processed_interactions we require a unique index (user_id, movie_id)
     try:
-        inserted_inter = supabase_insert("processed_interactions", interactions_rows, on_conflict="user_id,movie_id", batch_size=2000)
+        inserted_inter = upsert_changed("processed_interactions", interactions_rows, ("user_id", "movie_id"), delta, delta_reset,
+                                        on_conflict="user_id,movie_id", batch_size=2000)
         log(f"Upserted into processed_interactions: {inserted_inter}")
     except RuntimeError as e:
         log(f"ERROR while upserting processed_interactions: {e}")
@@ -210,8 +223,12 @@ def main():
     log("Ingestion complete.")
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--delta", action="store_true", help="Upsert only rows that are new or changed since the last run")
+    ap.add_argument("--delta-reset", action="store_true", help="With --delta, ignore saved hashes and resend everything")
+    args = ap.parse_args()
     try:
-        main()
+        main(delta=args.delta, delta_reset=args.delta_reset)
     except Exception as e:
         log(f"FAILED: {e}")
         sys.exit(1)
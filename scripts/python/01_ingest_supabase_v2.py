@@ -1,15 +1,23 @@
 """
 Fetch CSVs from remote URLs and ingest into Supabase processed_* tables via REST.
 Also writes scripts/output/interaction_log_processed.csv for downstream steps.
+With --delta, only rows that are new or changed since the last successful run are sent.
 
 Env:
 - SUPABASE_URL
 - SUPABASE_SERVICE_ROLE_KEY
 """
 
-import os, io, csv, json, time, requests
+import os, io, csv, time, argparse
 from typing import List, Dict
 
+import sb_rest
+import delta_store
+import interactions_cache
+import rating_dedup
+import source_cache
+import upsert_pool
+
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SERVICE_ROLE = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 
@@ -28,9 +36,7 @@ def _must_env(name: str) -> str:
 
 def fetch_csv(url: str) -> List[Dict[str, str]]:
     print(f"[v0] Fetching CSV: {url}")
-    r = requests.get(url, timeout=120)
-    r.raise_for_status()
-    reader = csv.DictReader(io.StringIO(r.text))
+    reader = csv.DictReader(io.StringIO(source_cache.cached_text(url, timeout=120)))
     rows = [dict(row) for row in reader]
     print(f"[v0] Loaded {len(rows)} rows")
     return rows
@@ -49,21 +55,39 @@ def upsert(table: str, rows: List[Dict], conflict: str | None, chunk: int = 2000
         url += f"?on_conflict={conflict}"
         headers["Prefer"] = "resolution=merge-duplicates,return=minimal"
 
-    total = len(rows)
-    for i in range(0, total, chunk):
-        batch = rows[i:i+chunk]
-        print(f"[v0] Upserting {len(batch)} rows into {table} [{i}/{total}]")
-        resp = requests.post(url, headers=headers, data=json.dumps(batch))
-        if resp.status_code >= 400:
-            print(resp.text[:1000])
-            raise RuntimeError(f"Upsert failed for {table}: {resp.status_code}")
-
-def main():
+    def post(tbl, batch):
+        try:
+            sb_rest.client().request("POST", url, body=batch, headers=headers)
+        except sb_rest.RestError as e:
+            print((e.body or str(e))[:1000])
+            # Keep the status code: upsert_pool backs off on 5xx and splits on 413
+            raise sb_rest.RestError(f"Upsert failed for {tbl}: HTTP {e.code}", code=e.code, reason=e.reason,
+                                    url=e.url, body=e.body) from e
+
+    # Up to UPSERT_CONCURRENCY batches in flight, sized by byte budget starting at `chunk` rows;
+    # HTTP 413 splits a batch and retries the halves, as does a 5xx when on_conflict makes resending safe.
+    print(f"[v0] Upserting {len(rows)} rows into {table}")
+    with upsert_pool.UpsertPool(post, adaptive=True, initial_rows=chunk, idempotent=bool(conflict)) as pool:
+        pool.feed(table, rows)
+
+def upsert_changed(table: str, rows: List[Dict], keys: tuple, conflict: str | None, chunk: int = 2000,
+                   delta: bool = False, reset: bool = False):
+    if not delta:
+        return upsert(table, rows, conflict, chunk=chunk)
+    # Hashes are committed only after the upsert succeeds, so a failed run is retried in full
+    store = delta_store.DeltaStore(table, keys, reset=reset)
+    changed = list(store.filter(rows))
+    store.log_counts()
+    upsert(table, changed, conflict, chunk=chunk)
+    store.commit()
+
+def main(delta: bool = False, delta_reset: bool = False):
     _must_env("SUPABASE_URL"); _must_env("SUPABASE_SERVICE_ROLE_KEY")
 
+    # Download concurrently; the catalog tables go up while ratings.csv is still arriving
+    source_cache.prefetch([MOVIES_URL, LINKS_URL, RATINGS_URL])
     movies = fetch_csv(MOVIES_URL)     # movieId,title,genres
     links  = fetch_csv(LINKS_URL)      # movieId,imdbId,tmdbId
-    ratings= fetch_csv(RATINGS_URL)    # userId,movieId,rating,timestamp
 
     processed_movies = [
         {"movie_id": int(m["movieId"]), "title": m.get("title") or "", "genres": m.get("genres") or ""}
@@ -74,6 +98,10 @@ def main():
         for l in links if l.get("movieId")
     ]
 
+    upsert_changed("processed_movies", processed_movies, ("movie_id",), conflict="movie_id", chunk=4000, delta=delta, reset=delta_reset)
+    upsert_changed("processed_links",  processed_links,  ("movie_id",), conflict="movie_id", chunk=4000, delta=delta, reset=delta_reset)
+
+    ratings= fetch_csv(RATINGS_URL)    # userId,movieId,rating,timestamp
     processed_interactions = []
     for r in ratings:
         if not r.get("userId") or not r.get("movieId") or not r.get("rating"):
@@ -89,22 +117,28 @@ def main():
             except:
                 ts_iso = None
         processed_interactions.append({"user_id": user_id, "movie_id": movie_id, "value": val, "ts": ts_iso})
+    # Last write wins for repeated (user_id, movie_id) keys, so no upsert batch carries a key twice
+    processed_interactions, _ = rating_dedup.dedup_rows(processed_interactions, label="processed_interactions")
 
     # Write local CSV for downstream steps
     out_csv = os.path.join(OUTPUT_DIR, "interaction_log_processed.csv")
-    with open(out_csv, "w", newline="", encoding="utf-8") as f:
+    with interactions_cache.ColumnWriter(out_csv) as cols, open(out_csv, "w", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=["user_id","movie_id","value","ts"])
         w.writeheader()
         for row in processed_interactions:
             w.writerow(row)
+            cols.append(row["user_id"], row["movie_id"], row["value"], row["ts"])
     print(f"[v0] Wrote {len(processed_interactions)} interactions -> {out_csv}")
 
     # Upsert processed tables (requires unique index for processed_interactions to truly upsert)
-    upsert("processed_movies", processed_movies, conflict="movie_id", chunk=4000)
-    upsert("processed_links",  processed_links,  conflict="movie_id", chunk=4000)
-    upsert("processed_interactions", processed_interactions, conflict="user_id,movie_id", chunk=4000)
+    upsert_changed("processed_interactions", processed_interactions, ("user_id", "movie_id"),
+                   conflict="user_id,movie_id", chunk=4000, delta=delta, reset=delta_reset)
 
     print("[v0] Ingestion to processed_* complete.")
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--delta", action="store_true", help="Upsert only rows that are new or changed since the last run")
+    ap.add_argument("--delta-reset", action="store_true", help="With --delta, ignore saved hashes and resend everything")
+    args = ap.parse_args()
+    main(delta=args.delta, delta_reset=args.delta_reset)
@@ -1,8 +1,12 @@
-import os, csv, json, time, math
-from urllib import request, parse, error
+import os, csv, time, math, argparse
 from datetime import datetime, timezone
 from pathlib import Path
 
+import sb_rest
+import source_cache
+import rating_dedup
+import derive_processed
+
 MOVIES_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/movies-QFbRyA2vveCs7siryKfN7JeU3KMxLc.csv"
 LINKS_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/links-m0RXllpAEUKtKYQc8gPNYV1ldCL0iE.csv"
 RATINGS_URL = "https://hebbkx1anhila5yf.public.blob.vercel-storage.com/ratings-IiLogJYWPkkZnWuBdi1fdTeSyBNBts.csv"
@@ -24,42 +28,19 @@ def _check_env():
   print("[v0] Env OK: using SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY")
 
 def _http(method, path, body=None, params=None, headers=None):
-  url = f"{SUPABASE_URL}{path}"
-  if params:
-    q = parse.urlencode(params, doseq=True)
-    sep = "&" if "?" in url else "?"
-    url = f"{url}{sep}{q}"
-  data = None
-  if body is not None:
-    data = json.dumps(body).encode("utf-8")
-  req = request.Request(url, method=method, data=data)
-  req.add_header("apikey", SUPABASE_SERVICE_ROLE_KEY)
-  req.add_header("Authorization", f"Bearer {SUPABASE_SERVICE_ROLE_KEY}")
-  if body is not None:
-    req.add_header("Content-Type", "application/json")
-  if headers:
-    for k, v in headers.items():
-      req.add_header(k, v)
-  try:
-    with request.urlopen(req, timeout=120) as resp:
-      content = resp.read()
-      txt = content.decode("utf-8") if content else ""
-      if txt:
-        try:
-          return json.loads(txt)
-        except json.JSONDecodeError:
-          return txt
-      return None
-  except error.HTTPError as e:
-    msg = e.read().decode("utf-8", errors="ignore")
-    raise RuntimeError(f"[v0] HTTP {e.code} {e.reason} at {url} :: {msg}")
-  except error.URLError as e:
-    raise RuntimeError(f"[v0] URL error at {url} :: {e}")
-
-def _download(url, dest: Path):
-  print(f"[v0] Downloading {url}")
-  with request.urlopen(url, timeout=300) as resp, open(dest, "wb") as f:
-    f.write(resp.read())
+  # Pooled keep-alive connection; RestError (a RuntimeError) keeps the old "[v0] HTTP <code> ..." message.
+  return sb_rest.client().json(method, path, body=body, params=params, headers=headers)
+
+# Unique keys from 013_add_unique_indexes.sql; upserting the ratings tables on them lets --derive-processed re-run.
+ON_CONFLICT = {"raw_ratings": "user_id,movie_id", "processed_interactions": "user_id,movie_id"}
+
+def _upsert(table, batch):
+  _http("POST", f"/rest/v1/{table}", body=batch, params={"on_conflict": ON_CONFLICT[table]},
+        headers={"Prefer": "resolution=merge-duplicates,return=minimal"})
+
+def _download(url) -> Path:
+  print(f"[v0] Fetching {url}")
+  return source_cache.cached_fetch(url, timeout=300)
 
 def _read_csv_rows(path: Path):
   with open(path, "r", newline="", encoding="utf-8") as f:
@@ -121,59 +102,71 @@ def upsert_links(links_rows):
     total += len(batch)
   print(f"[v0] raw_links inserted: {total}")
 
-def upsert_ratings_and_processed(ratings_rows):
-  print("[v0] Inserting into raw_ratings + processed_interactions… (no upsert)")
+def upsert_ratings_and_processed(ratings_rows, derive=False):
+  # derive=True uploads raw_ratings only and fills processed_interactions server-side afterwards
+  print(f"[v0] Upserting into raw_ratings{'' if derive else ' + processed_interactions'}…")
   batch_raw = []
   batch_proc = []
   total_proc = 0
+  total_raw = 0
+  uid_min = uid_max = None
+  tuples = []
+  for r in ratings_rows:
+    user_id = _to_int_or_none(r.get("userId"))
+    movie_id = _to_int_or_none(r.get("movieId"))
+    if user_id is None or movie_id is None: continue
+    try:
+      rating = float(r.get("rating"))
+    except Exception:
+      continue
+    tuples.append((user_id, movie_id, rating, _epoch_to_iso(r.get("timestamp"))))
+  # Repeated (user_id, movie_id) keys keep only their latest ts, in the CSV as well as the upserts
+  tuples, _ = rating_dedup.dedup_tuples(tuples, label="ratings")
   with open(PROCESSED_INTERACTIONS_CSV, "w", newline="", encoding="utf-8") as f:
     writer = csv.writer(f); writer.writerow(["user_id","movie_id","value","ts"])
-    for r in ratings_rows:
-      user_id = _to_int_or_none(r.get("userId"))
-      movie_id = _to_int_or_none(r.get("movieId"))
-      if user_id is None or movie_id is None: continue
-      try:
-        rating = float(r.get("rating"))
-      except Exception:
-        continue
-      ts_iso = _epoch_to_iso(r.get("timestamp"))
+    for user_id, movie_id, rating, ts_iso in tuples:
       # raw_ratings uses 'rating'
       batch_raw.append({"user_id": user_id, "movie_id": movie_id, "rating": rating, "ts": ts_iso})
+      uid_min = user_id if uid_min is None else min(uid_min, user_id)
+      uid_max = user_id if uid_max is None else max(uid_max, user_id)
       # processed_interactions uses 'value'
-      proc_obj = {"user_id": user_id, "movie_id": movie_id, "value": rating, "ts": ts_iso}
-      batch_proc.append(proc_obj)
+      if not derive:
+        batch_proc.append({"user_id": user_id, "movie_id": movie_id, "value": rating, "ts": ts_iso})
       writer.writerow([user_id, movie_id, rating, ts_iso])
       if len(batch_raw) >= BATCH:
-        _http("POST", "/rest/v1/raw_ratings", body=batch_raw, headers={"Prefer":"return=minimal"})
-        _http("POST", "/rest/v1/processed_interactions", body=batch_proc, headers={"Prefer":"return=minimal"})
-        total_proc += len(batch_proc); batch_raw = []; batch_proc = []
+        _upsert("raw_ratings", batch_raw)
+        if batch_proc:
+          _upsert("processed_interactions", batch_proc)
+        total_raw += len(batch_raw); total_proc += len(batch_proc); batch_raw = []; batch_proc = []
   if batch_raw:
-    _http("POST", "/rest/v1/raw_ratings", body=batch_raw, headers={"Prefer":"return=minimal"})
-    _http("POST", "/rest/v1/processed_interactions", body=batch_proc, headers={"Prefer":"return=minimal"})
-    total_proc += len(batch_proc)
-  print(f"[v0] processed_interactions inserted total: {total_proc}")
+    _upsert("raw_ratings", batch_raw)
+    if batch_proc:
+      _upsert("processed_interactions", batch_proc)
+    total_raw += len(batch_raw); total_proc += len(batch_proc)
+  print(f"[v0] raw_ratings inserted total: {total_raw}")
+  if derive:
+    derive_processed.derive(uid_min, uid_max)
+  else:
+    print(f"[v0] processed_interactions inserted total: {total_proc}")
   print(f"[v0] Wrote {PROCESSED_INTERACTIONS_CSV}")
 
-def main():
+def main(derive=False):
   _check_env()
-  tmp_dir = Path("scripts/tmp"); tmp_dir.mkdir(parents=True, exist_ok=True)
-  movies_csv = tmp_dir / "movies.csv"
-  links_csv = tmp_dir / "links.csv"
-  ratings_csv = tmp_dir / "ratings.csv"
-
-  _download(MOVIES_URL, movies_csv)
-  _download(LINKS_URL, links_csv)
-  _download(RATINGS_URL, ratings_csv)
+  source_cache.prefetch([MOVIES_URL, LINKS_URL, RATINGS_URL])
 
-  upsert_movies(_read_csv_rows(movies_csv))
-  upsert_links(_read_csv_rows(links_csv))
-  upsert_ratings_and_processed(_read_csv_rows(ratings_csv))
+  upsert_movies(_read_csv_rows(_download(MOVIES_URL)))
+  upsert_links(_read_csv_rows(_download(LINKS_URL)))
+  upsert_ratings_and_processed(_read_csv_rows(_download(RATINGS_URL)), derive=derive)
 
   print("[v0] Ingestion complete.")
 
 if __name__ == "__main__":
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--derive-processed", action="store_true",
+                  help="upload raw_ratings only and derive processed_interactions via RPC (needs scripts/sql/014)")
+  args = ap.parse_args()
   try:
-    main()
+    main(derive=args.derive_processed)
   except Exception as e:
     print(f"[v0] ERROR: {e}")
     raise
@@ -8,7 +8,8 @@ Outputs: scripts/output/trust_matrix.npy
 import os
 import sys
 import numpy as np
-import pandas as pd
+
+import interactions_cache
 
 OUT_DIR = os.path.join("scripts","output")
 os.makedirs(OUT_DIR, exist_ok=True)
@@ -16,13 +17,15 @@ INTERACTIONS_CSV = os.path.join(OUT_DIR, "interaction_log_processed.csv")
 
 def main():
     try:
-        df = pd.read_csv(INTERACTIONS_CSV, parse_dates=["ts"])
+        cols = interactions_cache.load(INTERACTIONS_CSV)
     except Exception as e:
         print("[v0] Failed to load interactions CSV:", e)
         sys.exit(1)
 
-    users = df["user_id"].dropna().unique()
-    users = users.astype(int)
+    # Unique users in order of first appearance (same order pandas.unique gave)
+    user_col = np.asarray(cols.user_id)
+    uniq, first = np.unique(user_col, return_index=True)
+    users = uniq[np.argsort(first)].astype(int)
     n = len(users)
     print(f"[v0] Unique users: {n}")
     if n == 0:
@@ -1,7 +1,13 @@
 # Dependency-free (stdlib only) and uses Supabase REST via SUPABASE_SERVICE_ROLE_KEY
 
-import os, sys, json, time
-from urllib import request, parse
+import os, sys, time, argparse
+
+import sb_rest
+import table_reader
+import table_snapshot
+import catalog
+import scoring
+import topn
 
 SUPABASE_URL = (os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL") or "").rstrip("/")
 SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
@@ -12,112 +18,68 @@ def _need_env():
         print(f"[v0] Missing env vars: {', '.join(missing)}", file=sys.stderr)
         sys.exit(1)
 
-def _rest_select(table: str, select: str):
-    # Paged GET using Range headers to avoid large responses
+def _rest_select(table: str, select: str, fmt: str = None):
+    # Paged GET using Range headers to avoid large responses; pages after the first are fetched concurrently.
+    # fmt="csv" reads text/csv pages instead of JSON (default SB_READ_FORMAT or json).
     assert SUPABASE_URL and SERVICE_KEY
-    url = f"{SUPABASE_URL}/rest/v1/{table}?select={parse.quote(select)}"
-    headers = {
-        "apikey": SERVICE_KEY,
-        "Authorization": f"Bearer {SERVICE_KEY}",
-        "Accept": "application/json",
-    }
-    page = 10000
-    start = 0
-    out = []
-    while True:
-        req = request.Request(url, method="GET", headers={**headers, "Range-Unit":"items", "Range": f"{start}-{start+page-1}"})
-        with request.urlopen(req) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            out.extend(data)
-            if len(data) < page:
-                break
-            start += page
-    return out
+    return table_reader.fetch_all(table, select, page=10000, fmt=fmt)
 
 def _rest_upsert_recommendations(rows):
     if not rows:
         print("[v0] No rows to upsert into recommendations.")
         return
     url = f"{SUPABASE_URL}/rest/v1/recommendations?on_conflict=user_id"
-    body = json.dumps(rows).encode("utf-8")
-    req = request.Request(url, data=body, method="POST")
-    req.add_header("Content-Type", "application/json")
-    req.add_header("Prefer", "resolution=merge-duplicates")
-    req.add_header("apikey", SERVICE_KEY)
-    req.add_header("Authorization", f"Bearer {SERVICE_KEY}")
-    with request.urlopen(req) as resp:
-        code = resp.getcode()
-        if code not in (200, 201, 204):
-            txt = resp.read().decode("utf-8", errors="replace")
-            raise RuntimeError(f"Upsert recommendations failed: {code} {txt}")
+    resp = sb_rest.client().request("POST", url, body=rows, headers={"Prefer": "resolution=merge-duplicates"})
+    code = resp.getcode()
+    if code not in (200, 201, 204):
+        raise RuntimeError(f"Upsert recommendations failed: {code} {resp.text()}")
     print(f"[v0] Upserted {len(rows)} users into recommendations.")
 
-def bayesian_score(movie_means, movie_counts, global_mean, mid, m_prior=25.0):
-    c = movie_counts.get(mid, 0)
-    if c == 0:
-        return global_mean
-    return (m_prior * global_mean + c * movie_means[mid]) / (m_prior + c)
-
-def main():
+def main(snapshot: bool = True, full_refresh: bool = False):
     _need_env()
     print("[v0] Loading processed_interactions (user_id, movie_id, value)...")
-    interactions = _rest_select("processed_interactions", "user_id,movie_id,value")
-    if not interactions:
+    if snapshot:
+        # Local snapshot; only rows past its ts watermark are downloaded
+        interactions = table_snapshot.interactions(full=full_refresh)
+    else:
+        interactions = table_reader.fetch_columns("processed_interactions", page=10000)
+    if not len(interactions):
         print("[v0] No interactions found. Did you run 01_ingest_supabase_stdlib.py?", file=sys.stderr)
         sys.exit(1)
 
-    print("[v0] Loading raw_movies (movie_id,title,genres) ...")
-    movies = { int(m["movie_id"]): m for m in _rest_select("raw_movies", "movie_id,title,genres") }
-
-    print("[v0] Loading raw_links (movie_id,tmdb_id) ...")
-    links = { int(l["movie_id"]): l for l in _rest_select("raw_links", "movie_id,tmdb_id") }
-
-    # Compute per-movie mean and global mean from values
-    sums, counts = {}, {}
-    user_seen = {}
-    for r in interactions:
-        try:
-            uid = int(r["user_id"]); mid = int(r["movie_id"]); val = float(r["value"])
-        except Exception:
-            continue
-        sums[mid] = sums.get(mid, 0.0) + val
-        counts[mid] = counts.get(mid, 0) + 1
-        user_seen.setdefault(uid, set()).add(mid)
-
-    if not counts:
+    print("[v0] Loading the movie catalog (raw_movies + raw_links) ...")
+    if snapshot:
+        movies = catalog.load(full=full_refresh)
+    else:
+        movies = catalog.build(_rest_select("raw_movies", "movie_id,title,genres"), _rest_select("raw_links", "movie_id,tmdb_id"))
+
+    # Compute per-movie mean and global mean from values (np.bincount, see scoring.py)
+    user_seen = topn.Seen.from_columns(interactions.user_id, interactions.movie_id)
+    stats = scoring.movie_stats(interactions.movie_id, interactions.value)
+
+    if not len(stats):
         print("[v0] No valid ratings to compute.", file=sys.stderr)
         sys.exit(1)
 
-    movie_means = { mid: (sums[mid] / counts[mid]) for mid in sums }
-    global_mean = (sum(sums.values()) / sum(counts.values()))
-    print(f"[v0] Global mean: {global_mean:.4f} | Movies rated: {len(movie_means)} | Users: {len(user_seen)}")
+    global_mean = stats.global_mean
+    print(f"[v0] Global mean: {global_mean:.4f} | Movies rated: {len(stats)} | Users: {len(user_seen)}")
 
     # Precompute movie scores (Bayesian shrunk mean)
-    movie_scores = {}
-    for mid in movie_means.keys():
-        movie_scores[mid] = bayesian_score(movie_means, counts, global_mean, mid, m_prior=25.0)
+    movie_scores = stats.scores(25.0)
 
-    # For each user, top-N unseen movies by score
+    # For each user, top-N unseen movies by score (sorted-skip walk in batches of users, see topn.py)
     N = 20
     payload = []
-    for uid, seen in user_seen.items():
-        candidates = []
-        for mid, score in movie_scores.items():
-            if mid in seen:
-                continue
-            candidates.append((mid, score))
-        candidates.sort(key=lambda x: x[1], reverse=True)
-        top = candidates[:N]
-
+    for uid, top in (r for batch in topn.global_top_n(stats.movie_id, movie_scores, user_seen, n=N, tie=stats.first_seen)
+                     for r in batch.by_user()):
         items = []
         for mid, score in top:
             m = movies.get(mid) or {}
-            l = links.get(mid) or {}
             items.append({
                 "movieId": mid,
                 "title": m.get("title"),
-                "tmdbId": l.get("tmdb_id"),
-                "score": round(float(score), 5),
+                "tmdbId": m.get("tmdb_id"),
+                "score": round(score, 5),
             })
 
         payload.append({
@@ -137,8 +99,12 @@ def main():
     print("[v0] Training complete. Recommendations updated.")
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--full-refresh", action="store_true", help="re-download the local table snapshots in full")
+    ap.add_argument("--no-snapshot", action="store_true", help="read every table from the server without a local snapshot")
+    args = ap.parse_args()
     try:
-        main()
+        main(snapshot=not args.no_snapshot, full_refresh=args.full_refresh)
     except Exception as e:
         print(f"[v0] ERROR: {e}", file=sys.stderr)
         sys.exit(1)
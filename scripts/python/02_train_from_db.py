@@ -3,9 +3,15 @@
 
 import os
 import json
+import argparse
 import math
-from collections import defaultdict
-from urllib import request, error
+
+import sb_rest
+import table_reader
+import table_snapshot
+import catalog
+import scoring
+import topn
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SERVICE_KEY  = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
@@ -28,23 +34,18 @@ def _headers(extra=None):
 
 def _get(table: str, select: str, range_from: int, range_to: int):
     url = f"{SUPABASE_URL}/rest/v1/{table}?select={select}"
-    req = request.Request(url, headers=_headers({
+    resp = sb_rest.client().request("GET", url, headers=_headers({
         "Range": f"{range_from}-{range_to}",
         "Range-Unit": "items",
     }))
-    with request.urlopen(req) as resp:
-        data = resp.read().decode("utf-8", errors="replace")
-        return json.loads(data or "[]")
+    return json.loads(resp.text() or "[]")
 
 def _upsert(table: str, rows: list, on_conflict: str):
     if not rows:
         return
     url = f"{SUPABASE_URL}/rest/v1/{table}?on_conflict={on_conflict}"
-    data = json.dumps(rows).encode("utf-8")
-    req = request.Request(url, data=data, headers=_headers({"Prefer": "resolution=merge-duplicates"}))
-    with request.urlopen(req) as resp:
-        # noop: 201/204
-        return
+    # noop: 201/204
+    sb_rest.client().request("POST", url, body=rows, headers=_headers({"Prefer": "resolution=merge-duplicates"}))
 
 def fetch_all(table: str, select: str):
     items = []
@@ -57,74 +58,56 @@ def fetch_all(table: str, select: str):
         start += PAGE_SIZE
     return items
 
-def bayesian_score(votes, avg, C, m=20):
-    # Weighted rating (IMDb formula)
-    v = votes
-    R = avg
-    return (v/(v+m))*R + (m/(v+m))*C
-
-def main():
+def main(snapshot=True, full_refresh=False):
     _check_env()
 
     print("[v0] Loading processed_interactions (user_id, movie_id, value)...")
-    interactions = fetch_all("processed_interactions", "user_id,movie_id,value")
-    if not interactions:
+    # Typed columns, decoded page by page (no dict per interaction); with snapshot, only rows
+    # past the local snapshot's ts watermark are downloaded
+    if snapshot:
+        interactions = table_snapshot.interactions(full=full_refresh)
+    else:
+        interactions = table_reader.fetch_columns("processed_interactions", page=PAGE_SIZE)
+    if not len(interactions):
         print("[v0] No interactions found. Did you run scripts/python/01_ingest_supabase_run.py?")
         return
 
     print(f"[v0] Interactions: {len(interactions)}")
 
-    # Compute movie aggregates
-    movie_sum = defaultdict(float)
-    movie_cnt = defaultdict(int)
-    users_seen = defaultdict(set)
-
-    for r in interactions:
-        uid = int(r["user_id"])
-        mid = int(r["movie_id"])
-        val = float(r["value"])
-        movie_sum[mid] += val
-        movie_cnt[mid] += 1
-        users_seen[uid].add(mid)
+    # Compute movie aggregates (np.bincount over the movie_id column, see scoring.py)
+    users_seen = topn.Seen.from_columns(interactions.user_id, interactions.movie_id)
+    stats = scoring.movie_stats(interactions.movie_id, interactions.value)
 
     # Global mean rating C
-    total_sum = sum(movie_sum.values())
-    total_cnt = sum(movie_cnt.values()) or 1
-    C = total_sum / total_cnt
+    C = stats.global_mean
     print(f"[v0] Global mean rating C={C:.4f}")
 
-    # Precompute scores per movie
-    movie_avg = {mid: (movie_sum[mid]/movie_cnt[mid]) for mid in movie_cnt}
-    movie_score = {mid: bayesian_score(movie_cnt[mid], movie_avg[mid], C, m=20) for mid in movie_cnt}
+    # Precompute scores per movie (weighted rating, IMDb formula)
+    movie_score = stats.scores(20)
 
     # Load metadata for join
     print("[v0] Loading raw_movies (for titles) and raw_links (for tmdb_id)...")
-    movies = {int(m["movie_id"]): m for m in fetch_all("raw_movies", "movie_id,title,genres")}
-    links  = {int(l["movie_id"]): l for l in fetch_all("raw_links", "movie_id,tmdb_id,imdb_id")}
+    if snapshot:
+        movies = catalog.load(full=full_refresh)
+    else:
+        movies = catalog.build(fetch_all("raw_movies", "movie_id,title,genres"), fetch_all("raw_links", "movie_id,tmdb_id,imdb_id"))
 
     # Build recommendations per user
     rec_rows = []
     TOP_K = 20
-    users = list(users_seen.keys())
-    print(f"[v0] Building recommendations for {len(users)} users...")
-    for uid in users:
-        seen = users_seen[uid]
-        # Candidate movies: not seen
-        candidates = [mid for mid in movie_score.keys() if mid not in seen]
-        # Sort by score desc
-        candidates.sort(key=lambda m: movie_score.get(m, 0.0), reverse=True)
-        top = candidates[:TOP_K]
-
+    print(f"[v0] Building recommendations for {len(users_seen)} users...")
+    # Top unseen movies by score, in batches of users (topn.py)
+    for uid, top in (r for batch in topn.global_top_n(stats.movie_id, movie_score, users_seen, n=TOP_K, tie=stats.first_seen)
+                     for r in batch.by_user()):
         items = []
-        for mid in top:
+        for mid, score in top:
             md = movies.get(mid) or {}
-            lk = links.get(mid) or {}
             items.append({
                 "movie_id": mid,
                 "title": md.get("title"),
                 "genres": md.get("genres"),
-                "tmdb_id": lk.get("tmdb_id"),
-                "score": round(float(movie_score.get(mid, 0.0)), 6),
+                "tmdb_id": md.get("tmdb_id"),
+                "score": round(score, 6),
             })
 
         rec_rows.append({
@@ -142,11 +125,14 @@ def main():
     print("[v0] Upserted recommendations for all users.")
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--full-refresh", action="store_true", help="re-download the local table snapshots in full")
+    ap.add_argument("--no-snapshot", action="store_true", help="read every table from the server without a local snapshot")
+    args = ap.parse_args()
     try:
-        main()
-    except error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace")
-        print(f"[v0] HTTPError {e.code}: {e.reason}\n{body}")
+        main(snapshot=not args.no_snapshot, full_refresh=args.full_refresh)
+    except sb_rest.RestError as e:
+        print(f"[v0] HTTPError {e.code}: {e.reason}\n{e.body}")
         raise
     except Exception as ex:
         print(f"[v0] ERROR: {ex}")
@@ -1,8 +1,13 @@
-import os, json, math
-from urllib import request, parse, error
-from collections import defaultdict
+import os, math, argparse
 from datetime import datetime, timezone
 
+import sb_rest
+import table_reader
+import table_snapshot
+import catalog
+import scoring
+import topn
+
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 
@@ -13,31 +18,8 @@ def _check_env():
   if missing: raise RuntimeError(f"[v0] Missing env: {', '.join(missing)}")
 
 def _http(method, path, params=None, headers=None, body=None):
-  url = f"{SUPABASE_URL}{path}"
-  if params:
-    q = parse.urlencode(params, doseq=True)
-    url = f"{url}?{q}"
-  data = json.dumps(body).encode("utf-8") if body is not None else None
-  req = request.Request(url, method=method, data=data)
-  req.add_header("apikey", SUPABASE_SERVICE_ROLE_KEY)
-  req.add_header("Authorization", f"Bearer {SUPABASE_SERVICE_ROLE_KEY}")
-  if body is not None:
-    req.add_header("Content-Type", "application/json")
-  if headers:
-    for k,v in headers.items(): req.add_header(k,v)
-  try:
-    with request.urlopen(req, timeout=120) as resp:
-      raw = resp.read()
-      txt = raw.decode("utf-8") if raw else ""
-      if txt:
-        try: return json.loads(txt)
-        except json.JSONDecodeError: return txt
-      return None
-  except error.HTTPError as e:
-    msg = e.read().decode("utf-8", errors="ignore")
-    raise RuntimeError(f"[v0] HTTP {e.code} {e.reason} at {url} :: {msg}")
-  except error.URLError as e:
-    raise RuntimeError(f"[v0] URL error at {url} :: {e}")
+  # Pooled keep-alive connection; RestError (a RuntimeError) keeps the old "[v0] HTTP <code> ..." message.
+  return sb_rest.client().json(method, path, body=body, params=params, headers=headers)
 
 def fetch_all(table, select="*", page_size=5000):
   print(f"[v0] Fetching {table}…")
@@ -58,59 +40,44 @@ def fetch_all(table, select="*", page_size=5000):
     start += page_size
   return rows
 
-def bayesian_scores(interactions, m_min=50, prior=3.5):
-  per_movie = defaultdict(lambda: {"sum":0.0, "cnt":0})
-  total = 0.0; n = 0
-  for r in interactions:
-    v = float(r["value"])
-    total += v; n += 1
-    pm = per_movie[int(r["movie_id"])]
-    pm["sum"] += v; pm["cnt"] += 1
-  global_mean = (total / n) if n else prior
-  scores = {}
-  for mid, agg in per_movie.items():
-    c = agg["cnt"]; a = agg["sum"]/c
-    score = (c/(c+m_min))*a + (m_min/(c+m_min))*global_mean
-    scores[mid] = score
-  return global_mean, scores
-
-def main():
+def main(snapshot=True, full_refresh=False):
   _check_env()
-  inter = fetch_all("processed_interactions", select="user_id,movie_id,value")
-  if not inter:
+  # Typed columns, decoded page by page (no dict per interaction); with snapshot, only rows
+  # past the local snapshot's ts watermark are downloaded
+  if snapshot:
+    inter = table_snapshot.interactions(full=full_refresh)
+  else:
+    inter = table_reader.fetch_columns("processed_interactions", page=5000)
+  if not len(inter):
     print("[v0] No interactions found in processed_interactions. Re-run 01_ingest_supabase_verified.py.")
     return
-  movies = fetch_all("raw_movies", select="movie_id,title")
-  links = fetch_all("raw_links", select="movie_id,tmdb_id")
-  title_by_movie = {int(m["movie_id"]): m.get("title") for m in movies}
-  tmdb_by_movie = {int(l["movie_id"]): l.get("tmdb_id") for l in links}
+  if snapshot:
+    movies = catalog.load(full=full_refresh)
+  else:
+    movies = catalog.build(fetch_all("raw_movies", select="movie_id,title"), fetch_all("raw_links", select="movie_id,tmdb_id"))
 
   # Build by user
-  by_user = defaultdict(set)
-  flat = []
-  for r in inter:
-    uid = int(r["user_id"]); mid = int(r["movie_id"]); val = float(r["value"])
-    by_user[uid].add(mid); flat.append({"movie_id": mid, "value": val})
+  by_user = topn.Seen.from_columns(inter.user_id, inter.movie_id)
 
-  global_mean, movie_scores = bayesian_scores(flat)
-  print(f"[v0] Global mean: {round(global_mean,4)} | Movies rated: {len(movie_scores)} | Users: {len(by_user)}")
+  # Bayesian average per movie, m=50 toward the global mean (np.bincount, see scoring.py)
+  stats = scoring.movie_stats(inter.movie_id, inter.value, default_mean=3.5)
+  global_mean, movie_scores = stats.global_mean, stats.scores(50)
+  print(f"[v0] Global mean: {round(global_mean,4)} | Movies rated: {len(stats)} | Users: {len(by_user)}")
 
-  # Top-N per user
+  # Top-N per user (batched sorted-skip walk, see topn.py)
   TOPN = 20
   items_by_user = {}
-  for uid, seen in by_user.items():
-    candidates = [(mid, s) for mid, s in movie_scores.items() if mid not in seen]
-    candidates.sort(key=lambda x: x[1], reverse=True)
-    top = candidates[:TOPN]
-    items = []
-    for mid, s in top:
-      items.append({
-        "movie_id": mid,
-        "score": round(float(s),5),
-        "title": title_by_movie.get(mid),
-        "tmdb_id": tmdb_by_movie.get(mid),
-      })
-    items_by_user[uid] = items
+  for batch in topn.global_top_n(stats.movie_id, movie_scores, by_user, n=TOPN, tie=stats.first_seen):
+    for uid, top in batch.by_user():
+      items = []
+      for mid, s in top:
+        items.append({
+          "movie_id": mid,
+          "score": round(s,5),
+          "title": movies.title(mid),
+          "tmdb_id": movies.tmdb_id(mid),
+        })
+      items_by_user[uid] = items
 
   # Upsert into recommendations
   print("[v0] Upserting recommendations…")
@@ -128,8 +95,12 @@ def main():
   print(f"[v0] Upserted recommendations for users: {total}")
 
 if __name__ == "__main__":
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--full-refresh", action="store_true", help="re-download the local table snapshots in full")
+  ap.add_argument("--no-snapshot", action="store_true", help="read every table from the server without a local snapshot")
+  args = ap.parse_args()
   try:
-    main()
+    main(snapshot=not args.no_snapshot, full_refresh=args.full_refresh)
   except Exception as e:
     print(f"[v0] ERROR: {e}")
     raise
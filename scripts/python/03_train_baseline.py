@@ -2,6 +2,8 @@
 
 import os, csv
 
+import scoring
+
 STATS = "scripts/output/movie_stats.csv"
 OUTPUT = "scripts/output/movie_scores.csv"
 
@@ -13,15 +15,14 @@ def main():
     if not os.path.exists(STATS):
         raise FileNotFoundError(f"{STATS} not found. Run 02_movie_stats.py first.")
 
-    scores = []
+    mids, counts, avgs = [], [], []
     with open(STATS, "r", encoding="utf-8") as f:
         r = csv.DictReader(f)
         for row in r:
-            mid = row["movie_id"]
-            c = float(row["count"])
-            avg = float(row["avg"])
-            score = (c * avg + M * C) / (c + M)
-            scores.append((mid, score))
+            mids.append(row["movie_id"])
+            counts.append(float(row["count"]))
+            avgs.append(float(row["avg"]))
+    scores = list(zip(mids, scoring.shrink(counts, avgs, M, C).tolist()))
 
     with open(OUTPUT, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
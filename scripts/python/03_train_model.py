@@ -3,13 +3,30 @@ Minimal training loop placeholder.
 - Builds simple item popularity per user weighted by trust as a stand-in for a full Transformer (keeps dependencies light).
 - Saves numpy arrays representing item scores per user for fast prediction.
 Outputs: scripts/output/item_index.npy, scripts/output/user_item_scores.npy
+
+Scores are (T + I) X: the trust matrix T (with the user's own row added once) times the
+user x item value sums X. The default sparse mode takes that product over blocks of
+users: the positive trust weights of a block are expanded against the CSR rows of X
+(interaction_matrix) and summed with np.bincount into one dense block, so memory stays at
+one block of trust rows plus one block of scores. trust_matrix.npy is memory-mapped and
+user_item_scores.npy is written in place. --mode loop runs the original per-user,
+per-weight loop over dense dict vectors, unchanged except that both modes skip NaN
+weights explicitly (the loop used to let them through and turn the whole row NaN).
+The printed time covers building the user vectors and the aggregation.
+
+Usage:
+    python scripts/python/03_train_model.py [--mode sparse|loop] [--block ROWS]
 """
 
 import os
 import sys
-import numpy as np
-import pandas as pd
+import time
+import argparse
 from collections import defaultdict
+import numpy as np
+
+import interactions_cache
+import interaction_matrix
 
 OUT_DIR = os.path.join("scripts","output")
 os.makedirs(OUT_DIR, exist_ok=True)
@@ -18,34 +35,27 @@ INTERACTIONS_CSV = os.path.join(OUT_DIR, "interaction_log_processed.csv")
 TRUST_NPY = os.path.join(OUT_DIR, "trust_matrix.npy")
 TRUST_USERS_NPY = os.path.join(OUT_DIR, "trust_users.npy")
 
-def main():
-    try:
-        df = pd.read_csv(INTERACTIONS_CSV, parse_dates=["ts"])
-        trust = np.load(TRUST_NPY)
-        trust_users = np.load(TRUST_USERS_NPY)
-    except Exception as e:
-        print("[v0] Error loading inputs:", e)
-        sys.exit(1)
+BLOCK_CELLS = 1 << 23      # float64 accumulator cells per block (64 MiB)
+CHUNK = 1 << 22            # expanded (weight, interaction) pairs per np.bincount call
 
-    # Map item ids to indices
-    item_ids = df["movie_id"].astype(int).unique()
-    item_ids.sort()
+def loop_scores(cols, item_ids, trust, trust_users, out):
+    # The original implementation, kept as the reference for --mode loop
+    user_col = np.asarray(cols.user_id)
+    movie_col = np.asarray(cols.movie_id)
+    value_col = np.asarray(cols.value)
     item_index = {mid: i for i, mid in enumerate(item_ids)}
-    np.save(os.path.join(OUT_DIR, "item_index.npy"), item_ids)
 
     # Build base user->item value sums
     by_user = defaultdict(lambda: np.zeros(len(item_ids), dtype=np.float32))
-    for row in df.itertuples(index=False):
-        u = int(row.user_id)
-        i = item_index.get(int(row.movie_id))
+    for u, mid, val in zip(user_col.tolist(), movie_col.tolist(), value_col.tolist()):
+        i = item_index.get(mid)
         if i is not None:
-            by_user[u][i] += float(row.value)
+            by_user[u][i] += val
 
     # Align users to trust matrix order
     user_index = {int(u): idx for idx, u in enumerate(trust_users)}
 
     # For each user, aggregate neighbors' vectors with trust weights
-    user_item_scores = np.zeros((len(trust_users), len(item_ids)), dtype=np.float32)
     for u, row_idx in user_index.items():
         # own vector
         base = by_user.get(u, np.zeros(len(item_ids), dtype=np.float32))
@@ -53,14 +63,90 @@ def main():
         weights = trust[row_idx]  # shape (n_users,)
         agg = np.zeros_like(base)
         for v, w in enumerate(weights):
-            if w <= 0: 
+            if not w > 0:  # zero, negative and NaN weights carry no trust (as in sparse mode)
                 continue
             vu = int(trust_users[v])
             agg += w * by_user.get(vu, np.zeros(len(item_ids), dtype=np.float32))
-        user_item_scores[row_idx] = base + agg
+        out[row_idx] = base + agg
+
+def sparse_scores(X, trust, trust_users, out, block=None):
+    n, m = len(trust_users), X.shape[1]
+    if not n or not m:
+        return
+    block = block or max(1, BLOCK_CELLS // m)
 
-    np.save(os.path.join(OUT_DIR, "user_item_scores.npy"), user_item_scores)
+    # CSR row of each trust user in X (empty when the user has no interactions)
+    trust_users = np.asarray(trust_users, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(X.row_ids, trust_users), max(len(X) - 1, 0))
+    present = X.row_ids[pos] == trust_users if len(X) else np.zeros(n, dtype=bool)
+    starts = X.indptr[pos]
+    lens = np.where(present, X.indptr[pos + 1] - starts, 0)
+
+    for b0 in range(0, n, block):
+        b1 = min(n, b0 + block)
+        rows = b1 - b0
+        t = np.asarray(trust[b0:b1])
+        rr, vv = np.nonzero(t > 0)            # zero, negative and NaN weights carry no trust
+        ww = t[rr, vv].astype(np.float64)
+        # + I: each user's own vector with weight 1
+        rr = np.concatenate((np.arange(rows), rr))
+        vv = np.concatenate((np.arange(b0, b1), vv))
+        ww = np.concatenate((np.ones(rows), ww))
+
+        acc = np.zeros(rows * m, dtype=np.float64)
+        ln = lens[vv]
+        cum = np.cumsum(ln)
+        i = 0
+        while i < len(vv):
+            done = cum[i - 1] if i else 0
+            j = max(int(np.searchsorted(cum, done + CHUNK, side="right")), i + 1)
+            l = ln[i:j]
+            total = int(l.sum())
+            if total:
+                offs = np.cumsum(l) - l
+                src = np.repeat(starts[vv[i:j]] - offs, l) + np.arange(total)
+                flat = np.repeat(rr[i:j] * m, l) + X.indices[src]
+                acc += np.bincount(flat, weights=np.repeat(ww[i:j], l) * X.data[src], minlength=rows * m)
+            i = j
+        out[b0:b1] = acc.reshape(rows, m)
+
+def main(mode="sparse", block=None):
+    try:
+        cols = interactions_cache.load(INTERACTIONS_CSV)
+        trust = np.load(TRUST_NPY, mmap_mode=None if mode == "loop" else "r")
+        trust_users = np.load(TRUST_USERS_NPY)
+    except Exception as e:
+        print("[v0] Error loading inputs:", e)
+        sys.exit(1)
+
+    def scores_file(n_items):
+        return np.lib.format.open_memmap(os.path.join(OUT_DIR, "user_item_scores.npy"), mode="w+",
+                                         dtype=np.float32, shape=(len(trust_users), n_items))
+
+    # Timed from the interaction columns, so each mode includes building its own user vectors
+    t0 = time.perf_counter()
+    if mode == "loop":
+        item_ids = np.unique(np.asarray(cols.movie_id)).astype(int)
+        user_item_scores = scores_file(len(item_ids))
+        loop_scores(cols, item_ids, trust, trust_users, user_item_scores)
+    else:
+        # Base user->item value sums as a sparse CSR matrix; its columns are the sorted item ids
+        X = interaction_matrix.from_cache(cols)
+        item_ids = X.col_ids.astype(int)
+        user_item_scores = scores_file(len(item_ids))
+        sparse_scores(X, trust, trust_users, user_item_scores, block)
+    print(f"[v0] Trust aggregation ({mode}) for {len(trust_users)} users x {len(item_ids)} items "
+          f"in {time.perf_counter() - t0:.2f}s")
+    np.save(os.path.join(OUT_DIR, "item_index.npy"), item_ids)
+    user_item_scores.flush()
+    del user_item_scores
     print("[v0] Saved user_item_scores.npy and item_index.npy")
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=("sparse", "loop"), default="sparse",
+                    help="blocked sparse (T + I) X product, or the per-user loop")
+    ap.add_argument("--block", type=int, default=None,
+                    help=f"users per block in sparse mode (default {BLOCK_CELLS} cells / items)")
+    args = ap.parse_args()
+    main(mode=args.mode, block=args.block)
@@ -14,9 +14,13 @@ Env:
 - SUPABASE_SERVICE_ROLE_KEY
 """
 
-import os, csv, json, requests
+import os, csv
 from collections import defaultdict
 
+import sb_rest
+import interactions_cache
+import catalog
+
 OUTPUT_DIR = "scripts/output"
 INTERACTIONS = os.path.join(OUTPUT_DIR, "interaction_log_processed.csv")
 SCORES = os.path.join(OUTPUT_DIR, "movie_scores.csv")
@@ -27,26 +31,6 @@ def _must_env(name: str) -> str:
         raise RuntimeError(f"Missing required env var: {name}")
     return v
 
-def supabase_get_all(table: str, select: str = "*"):
-    base = _must_env("SUPABASE_URL").rstrip("/")
-    key = _must_env("SUPABASE_SERVICE_ROLE_KEY")
-    url = f"{base}/rest/v1/{table}?select={select}"
-    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
-    out = []
-    start = 0
-    page = 1000
-    while True:
-        hdrs = headers | {"Range": f"{start}-{start+page-1}"}
-        r = requests.get(url, headers=hdrs, timeout=120)
-        if r.status_code not in (200, 206):
-            raise RuntimeError(f"GET {table} failed: {r.status_code} {r.text[:300]}")
-        batch = r.json()
-        out.extend(batch)
-        if len(batch) < page:
-            break
-        start += page
-    return out
-
 def supabase_upsert(table: str, rows, conflict: str):
     base = _must_env("SUPABASE_URL").rstrip("/")
     key = _must_env("SUPABASE_SERVICE_ROLE_KEY")
@@ -57,9 +41,10 @@ def supabase_upsert(table: str, rows, conflict: str):
         "Content-Type": "application/json",
         "Prefer": "resolution=merge-duplicates,return=minimal",
     }
-    r = requests.post(url, headers=headers, data=json.dumps(rows))
-    if r.status_code >= 400:
-        raise RuntimeError(f"Upsert {table} failed: {r.status_code} {r.text[:300]}")
+    try:
+        sb_rest.client().request("POST", url, body=rows, headers=headers)
+    except sb_rest.RestError as e:
+        raise RuntimeError(f"Upsert {table} failed: {e.code} {e.body[:300]}")
 
 def load_scores(path: str):
     scores = []
@@ -82,20 +67,15 @@ def main(top_k: int = 10):
 
     # Build per-user "seen" set and user list
     seen = defaultdict(set)
-    with open(INTERACTIONS, "r", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            try:
-                uid = int(row["user_id"]); mid = int(row["movie_id"])
-                seen[uid].add(mid)
-            except:
-                continue
+    cols = interactions_cache.load(INTERACTIONS)
+    for uid, mid in zip(cols.user_id, cols.movie_id):
+        seen[int(uid)].add(int(mid))
     users = sorted(seen.keys())
     print(f"[v0] Users with interactions: {len(users)}")
 
     # Load metadata from Supabase for title/tmdb_id
-    movies = { int(m["movie_id"]): (m.get("title") or "") for m in supabase_get_all("processed_movies", "movie_id,title") }
-    links  = { int(l["movie_id"]): (int(l["tmdb_id"]) if l.get("tmdb_id") is not None else None) for l in supabase_get_all("processed_links", "movie_id,tmdb_id") }
+    _must_env("SUPABASE_URL"); _must_env("SUPABASE_SERVICE_ROLE_KEY")
+    movies = catalog.load("processed_movies", "processed_links")
 
     # Load global scores
     ranked = load_scores(SCORES)
@@ -111,8 +91,8 @@ def main(top_k: int = 10):
                 continue
             recs.append({
                 "movieId": mid,
-                "title": movies.get(mid, ""),
-                "tmdbId": links.get(mid, None),
+                "title": movies.title(mid, ""),
+                "tmdbId": movies.tmdb_id(mid),
                 "score": float(score_map.get(mid, 0.0)),
             })
             if len(recs) >= top_k:
@@ -1,14 +1,14 @@
 import os
 import sys
-import json
 import math
-import time
-import urllib.request
-import urllib.error
 import urllib.parse
 from collections import defaultdict
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Tuple, Set
+from typing import Dict, Any, List, Set
+
+import sb_rest
+import table_reader
+import catalog
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL") or os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
@@ -24,44 +24,15 @@ def sb_headers() -> Dict[str, str]:
         "Content-Type": "application/json",
     }
 
-def sb_get(table: str, select: str, range_from: int = 0, range_to: int = 9999, filters: str = "") -> Tuple[List[Dict[str, Any]], int, int, int]:
+def sb_get_all(table: str, select: str, fmt: str = None) -> List[Dict[str, Any]]:
+    # fmt="csv" reads text/csv pages instead of JSON (default SB_READ_FORMAT or json)
     assert SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY
-    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}?select={urllib.parse.quote(select)}"
-    if filters:
-        url += f"&{filters}"
-    req = urllib.request.Request(url, headers=sb_headers(), method="GET")
-    # PostgREST pagination
-    req.add_header("Range-Unit", "items")
-    req.add_header("Range", f"{range_from}-{range_to}")
     try:
-        with urllib.request.urlopen(req) as resp:
-            content_range = resp.headers.get("Content-Range", "0-0/0")
-            body = resp.read().decode("utf-8", errors="replace") or "[]"
-            items = json.loads(body)
-            # parse "start-end/total"
-            parts = content_range.split("/")
-            total = int(parts[1]) if len(parts) == 2 and parts[1].isdigit() else len(items)
-            start_end = parts[0].split("-")
-            start = int(start_end[0]) if start_end and start_end[0].isdigit() else range_from
-            end = int(start_end[1]) if len(start_end) > 1 and start_end[1].isdigit() else range_to
-            return items, start, end, total
-    except urllib.error.HTTPError as e:
-        err = e.read().decode("utf-8", errors="replace")
-        fail(f"HTTPError GET {table}: {e.code} {e.reason} - {err}")
-    except urllib.error.URLError as e:
-        fail(f"URLError GET {table}: {e.reason}")
-
-def sb_get_all(table: str, select: str) -> List[Dict[str, Any]]:
-    all_items: List[Dict[str, Any]] = []
-    start = 0
-    page = 10000
-    while True:
-        items, s, e, total = sb_get(table, select, range_from=start, range_to=start + page - 1)
-        all_items.extend(items)
-        if e + 1 >= total:
-            break
-        start = e + 1
-        time.sleep(0.05)
+        all_items = table_reader.fetch_all(table, select, page=10000, fmt=fmt)
+    except sb_rest.RestError as e:
+        if e.code is None:
+            fail(f"URLError GET {table}: {e}")
+        fail(f"HTTPError GET {table}: {e.code} {e.reason} - {e.body}")
     print(f"[v0] Fetched {len(all_items)} rows from {table}")
     return all_items
 
@@ -71,16 +42,12 @@ def sb_upsert(table: str, rows: List[Dict[str, Any]], on_conflict: str) -> None:
     url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}?on_conflict={urllib.parse.quote(on_conflict)}"
     headers = sb_headers()
     headers["Prefer"] = "resolution=merge-duplicates"
-    body = json.dumps(rows).encode("utf-8")
-    req = urllib.request.Request(url, data=body, headers=headers, method="POST")
     try:
-        with urllib.request.urlopen(req) as resp:
-            if resp.getcode() not in (200, 201, 204):
-                txt = resp.read().decode("utf-8", errors="replace")
-                fail(f"Upsert {table} failed: {txt}")
-    except urllib.error.HTTPError as e:
-        txt = e.read().decode("utf-8", errors="replace")
-        fail(f"HTTPError upserting {table}: {e.code} {e.reason} - {txt}")
+        resp = sb_rest.client().request("POST", url, body=rows, headers=headers)
+        if resp.getcode() not in (200, 201, 204):
+            fail(f"Upsert {table} failed: {resp.text()}")
+    except sb_rest.RestError as e:
+        fail(f"HTTPError upserting {table}: {e.code} {e.reason} - {e.body}")
 
 def main() -> None:
     if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
@@ -88,11 +55,7 @@ def main() -> None:
 
     # Load data
     interactions = sb_get_all("processed_interactions", "user_id,movie_id,value")
-    movies = sb_get_all("processed_movies", "movie_id,title")
-    links = sb_get_all("processed_links", "movie_id,tmdb_id")
-
-    title_by_movie: Dict[int, str] = {int(m["movie_id"]): (m["title"] or "") for m in movies}
-    tmdb_by_movie: Dict[int, int] = {int(l["movie_id"]): int(l["tmdb_id"] or 0) for l in links}
+    movies = catalog.load("processed_movies", "processed_links")
 
     # Compute global average score per movie
     sum_by_movie: Dict[int, float] = defaultdict(float)
@@ -126,8 +89,8 @@ def main() -> None:
                 continue
             items.append({
                 "movieId": mid,
-                "title": title_by_movie.get(mid),
-                "tmdbId": tmdb_by_movie.get(mid),
+                "title": movies.title(mid),
+                "tmdbId": movies.tmdb_id(mid, 0 if movies.linked(mid) else None),
                 "score": round(avg_by_movie.get(mid, 0.0), 6),
             })
             if len(items) >= 20:
@@ -138,7 +101,6 @@ def main() -> None:
     # recommendations has PK user_id; conflict on user_id
     for i in range(0, len(rows), 200):
         sb_upsert("recommendations", rows[i:i+200], on_conflict="user_id")
-        time.sleep(0.05)
 
     print("[v0] Prediction complete")
 
@@ -0,0 +1,305 @@
+"""
+Compact local movie catalog: title, genres, tmdb_id and imdb_id by movie_id.
+
+The trainers used to rebuild title_by_movie / tmdb_by_movie dicts from full
+raw_movies and raw_links scans on every run. The catalog keeps the same data
+as flat arrays on disk:
+    movie_id.npy                   int64, sorted
+    tmdb_id.npy                    int64, NO_ID without a links row, NULL_ID for a row with a null tmdb_id
+    title.bin + title.off.npy      UTF-8 titles back to back, int32 byte offsets (rows + 1)
+    genres.bin + genres.off.npy    same layout
+    imdb_id.bin + imdb_id.off.npy  same layout (text, so leading zeros survive)
+    manifest.json                  format, row counts and the max movie_id read from each table
+A lookup binary-searches movie_id (np.searchsorted, or bisect without numpy)
+and slices the blobs. Everything is memory-mapped, so a run only pages in the
+movies it touches. Decoded records are memoized per movie, so the handful of
+top-scored movies repeated across every user's list cost one search each.
+
+Refresh works like table_snapshot: rows with a movie_id above the manifest's
+max are read from each table and merged in, and the local row counts are
+checked against count=exact, with a full download on mismatch. Titles edited in
+place need full=True (--full-refresh in the trainers, or SNAPSHOT_FULL_REFRESH=1).
+
+For 62k MovieLens-shaped movies the arrays take 6.1 MiB, against 45 MiB for
+the {movie_id: row} dicts they replace. Run python scripts/python/catalog.py to
+print both for your catalog.
+
+Usage:
+    cat = catalog.load()                                   # raw_movies + raw_links
+    cat = catalog.load("processed_movies", "processed_links")
+    cat.title(1), cat.tmdb_id(1), cat.get(1)               # get: dict or None
+
+Env:
+- SNAPSHOT_DIR, SNAPSHOT_FULL_REFRESH as for table_snapshot
+"""
+
+import os
+import json
+import mmap
+import time
+import bisect
+from array import array
+from pathlib import Path
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+import table_reader
+import interactions_cache
+from delta_store import scope
+from table_snapshot import STATE_DIR, FULL_REFRESH
+
+NO_ID = -1          # no links row for the movie
+NULL_ID = -2        # a links row whose tmdb_id is null
+FORMAT = 2          # bumped when the on-disk meaning changes; older catalogs are rebuilt
+TEXT_FIELDS = ("title", "genres", "imdb_id")
+MOVIES_SELECT = "movie_id,title,genres"
+LINKS_SELECT = "movie_id,tmdb_id,imdb_id"
+
+def _int_or(v, default):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return default
+
+def _texts(values):
+    """(offsets, blob) for a sequence of strings; None is stored as ""."""
+    off = array("i", [0])
+    blob = bytearray()
+    for v in values:
+        blob += (v or "").encode("utf-8")
+        off.append(len(blob))
+    return off, bytes(blob)
+
+def _map_blob(path: Path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class Catalog:
+    def __init__(self, movie_id, tmdb_id, texts: dict, source: str = ""):
+        self.movie_id = movie_id         # sorted int64
+        self.tmdb_id_col = tmdb_id
+        self.texts = texts               # field -> (offsets, blob)
+        self.source = source
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.movie_id)
+
+    def __contains__(self, movie_id) -> bool:
+        return self.index(movie_id) >= 0
+
+    @property
+    def nbytes(self) -> int:
+        cols = [self.movie_id, self.tmdb_id_col] + [off for off, _ in self.texts.values()]
+        n = sum(c.nbytes if np is not None and isinstance(c, np.ndarray) else len(c) * c.itemsize for c in cols)
+        return n + sum(len(blob) for _, blob in self.texts.values())
+
+    def index(self, movie_id) -> int:
+        """Row of movie_id, or -1."""
+        mid = int(movie_id)
+        ids = self.movie_id
+        if np is not None and isinstance(ids, np.ndarray):
+            i = int(ids.searchsorted(mid))
+        else:
+            i = bisect.bisect_left(ids, mid)
+        return i if i < len(ids) and ids[i] == mid else -1
+
+    def _text(self, field: str, i: int) -> str:
+        off, blob = self.texts[field]
+        return blob[int(off[i]):int(off[i + 1])].decode("utf-8")
+
+    def row(self, i: int) -> dict:
+        tmdb = int(self.tmdb_id_col[i])
+        out = {"movie_id": int(self.movie_id[i]), "tmdb_id": None if tmdb < 0 else tmdb}
+        for f in TEXT_FIELDS:
+            out[f] = self._text(f, i)
+        return out
+
+    def get(self, movie_id):
+        """{"movie_id", "title", "genres", "tmdb_id", "imdb_id"} for movie_id, or None. Do not mutate."""
+        try:
+            return self._memo[movie_id]
+        except KeyError:
+            pass
+        i = self.index(movie_id)
+        rec = self.row(i) if i >= 0 else None
+        self._memo[movie_id] = rec
+        return rec
+
+    def title(self, movie_id, default=None):
+        rec = self.get(movie_id)
+        return default if rec is None else rec["title"]
+
+    def genres(self, movie_id, default=None):
+        rec = self.get(movie_id)
+        return default if rec is None else rec["genres"]
+
+    def tmdb_id(self, movie_id, default=None):
+        rec = self.get(movie_id)
+        return default if rec is None or rec["tmdb_id"] is None else rec["tmdb_id"]
+
+    def linked(self, movie_id) -> bool:
+        """Whether the links table has a row for movie_id (its tmdb_id may still be null)."""
+        i = self.index(movie_id)
+        return i >= 0 and int(self.tmdb_id_col[i]) != NO_ID
+
+    def imdb_id(self, movie_id, default=None):
+        rec = self.get(movie_id)
+        return default if rec is None or not rec["imdb_id"] else rec["imdb_id"]
+
+    def rows(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def save(self, d: Path, manifest: dict):
+        d.mkdir(parents=True, exist_ok=True)
+        (d / "manifest.json").unlink(missing_ok=True)   # invalid until every file is replaced
+        interactions_cache.write_npy(d / "movie_id.npy", self.movie_id, "<i8")
+        interactions_cache.write_npy(d / "tmdb_id.npy", self.tmdb_id_col, "<i8")
+        for f, (off, blob) in self.texts.items():
+            interactions_cache.write_npy(d / f"{f}.off.npy", off, "<i4")
+            tmp = d / f"{f}.bin.part"
+            with open(tmp, "wb") as fh:
+                fh.write(blob)
+            os.replace(tmp, d / f"{f}.bin")
+        tmp = d / "manifest.json.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(dict(manifest, rows=len(self)), fh, indent=2)
+        os.replace(tmp, d / "manifest.json")
+
+def build(movie_rows, link_rows, base: Catalog = None, source: str = "rows") -> Catalog:
+    """A catalog from raw_movies- and raw_links-shaped dicts, layered over base when given (rows win)."""
+    recs = {}
+    for r in movie_rows:
+        mid = _int_or(r.get("movie_id"), None)
+        if mid is not None:
+            rec = recs.setdefault(mid, {})
+            rec["title"], rec["genres"] = r.get("title"), r.get("genres")
+    for r in link_rows:
+        mid = _int_or(r.get("movie_id"), None)
+        if mid is not None:
+            rec = recs.setdefault(mid, {})
+            rec["tmdb_id"] = _int_or(r.get("tmdb_id"), NULL_ID)
+            imdb = r.get("imdb_id")
+            rec["imdb_id"] = None if imdb is None else str(imdb)
+    ids = sorted(recs)
+    if base is not None and len(base):
+        ids = sorted(set(ids).union(int(m) for m in base.movie_id))
+    cols = {f: [] for f in ("tmdb_id",) + TEXT_FIELDS}
+    for mid in ids:
+        rec = recs.get(mid, {})
+        old = base.get(mid) if base is not None and (len(rec) < 4) else None
+        for f, col in cols.items():
+            if f in rec:
+                col.append(rec[f])
+            elif old is not None:
+                col.append(int(base.tmdb_id_col[base.index(mid)]) if f == "tmdb_id" else old[f])
+            else:
+                col.append(NO_ID if f == "tmdb_id" else None)
+    if np is not None:
+        movie_id = np.asarray(ids, dtype="<i8")
+        tmdb = np.asarray(cols["tmdb_id"], dtype="<i8")
+    else:
+        movie_id, tmdb = array("q", ids), array("q", cols["tmdb_id"])
+    texts = {f: _texts(cols[f]) for f in TEXT_FIELDS}
+    if np is not None:
+        texts = {f: (np.frombuffer(off, dtype="<i4"), blob) for f, (off, blob) in texts.items()}
+    return Catalog(movie_id, tmdb, texts, source)
+
+def _open(d: Path) -> Catalog:
+    ids = interactions_cache.read_npy(d / "movie_id.npy", "q", True)
+    tmdb = interactions_cache.read_npy(d / "tmdb_id.npy", "q", True)
+    texts = {f: (interactions_cache.read_npy(d / f"{f}.off.npy", "i", True), _map_blob(d / f"{f}.bin"))
+             for f in TEXT_FIELDS}
+    return Catalog(ids, tmdb, texts, source="local")
+
+def _read_manifest(d: Path):
+    try:
+        with open(d / "manifest.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _max_id(rows, prev=None):
+    ids = [m for m in (_int_or(r.get("movie_id"), None) for r in rows) if m is not None]
+    return max(ids + ([prev] if prev is not None else []), default=None)
+
+def _counts_differ(man: dict) -> bool:
+    for table in (man["movies_table"], man["links_table"]):
+        n, local = table_reader.count(table), man["table_rows"][table]
+        if n is not None and n != local:
+            print(f"[v0] catalog: {local} {table} rows locally but {n} on the server; doing a full refresh")
+            return True
+    return False
+
+def load(movies_table: str = "raw_movies", links_table: str = "raw_links", full: bool = None,
+         refresh: bool = True, verify: bool = True) -> Catalog:
+    """The local catalog for the two tables, refreshed from the server by max movie_id."""
+    t0 = time.time()
+    d = Path(STATE_DIR) / scope() / f"{movies_table}.catalog"
+    full = FULL_REFRESH if full is None else full
+    man = None if full else _read_manifest(d)
+    if man is not None and (man.get("links_table") != links_table or man.get("format") != FORMAT):
+        man = None
+    if man is None:
+        if not full:
+            print(f"[v0] catalog: none usable for {movies_table}, downloading {movies_table} and {links_table}")
+        movies = table_reader.fetch_all(movies_table, MOVIES_SELECT)
+        links = table_reader.fetch_all(links_table, LINKS_SELECT)
+        cat = build(movies, links, source="full")
+        man = {"format": FORMAT, "movies_table": movies_table, "links_table": links_table,
+               "max_id": {movies_table: _max_id(movies), links_table: _max_id(links)},
+               "table_rows": {movies_table: len(movies), links_table: len(links)}}
+        changed = True
+    else:
+        cat = _open(d)
+        if not refresh:
+            return cat
+        new = {}
+        for table, select in ((movies_table, MOVIES_SELECT), (links_table, LINKS_SELECT)):
+            hi = man["max_id"][table]
+            new[table] = table_reader.fetch_all(table, select, params={"movie_id": f"gt.{hi}"} if hi is not None else None)
+            man["max_id"][table] = _max_id(new[table], hi)
+            man["table_rows"][table] += len(new[table])
+        changed = bool(new[movies_table] or new[links_table])
+        if changed:
+            cat = build(new[movies_table], new[links_table], base=cat, source="incremental")
+        print(f"[v0] catalog: {len(new[movies_table])} new {movies_table} rows, {len(new[links_table])} new {links_table} rows")
+        if verify and _counts_differ(man):
+            return load(movies_table, links_table, full=True, refresh=True, verify=False)
+    if changed:
+        man["refreshed_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        cat.save(d, man)
+        cat = _open(d)
+    print(f"[v0] catalog: {len(cat)} movies in {cat.nbytes / 2**20:.1f} MiB ({cat.source}, {time.time() - t0:.2f}s)")
+    return cat
+
+def _dict_bytes(movie_rows, link_rows) -> int:
+    """Heap taken by the {movie_id: row} dicts the trainers used to build."""
+    import tracemalloc
+    tracemalloc.start()
+    movies = {int(m["movie_id"]): dict(m) for m in json.loads(json.dumps(movie_rows))}
+    links = {int(l["movie_id"]): dict(l) for l in json.loads(json.dumps(link_rows))}
+    n = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del movies, links
+    return n
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Refresh the local movie catalog and report its size.")
+    ap.add_argument("--movies", default="raw_movies")
+    ap.add_argument("--links", default="raw_links")
+    ap.add_argument("--full-refresh", action="store_true")
+    args = ap.parse_args()
+    cat = load(args.movies, args.links, full=args.full_refresh)
+    rows = list(cat.rows())
+    movies = [{k: r[k] for k in ("movie_id", "title", "genres")} for r in rows]
+    links = [{k: r[k] for k in ("movie_id", "tmdb_id", "imdb_id")} for r in rows]
+    print(f"[v0] catalog arrays: {cat.nbytes / 2**20:.1f} MiB; "
+          f"as dicts of rows: {_dict_bytes(movies, links) / 2**20:.1f} MiB")
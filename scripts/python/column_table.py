@@ -0,0 +1,143 @@
+"""
+Typed column storage for table reads, in place of lists of row dicts.
+
+A page of PostgREST rows as dicts costs a few hundred bytes per interaction.
+The same (user_id, movie_id, value) triple is 12 bytes in int32/int32/float32
+columns. ColumnBuilder decodes each page into growable typed buffers (numpy
+when installed, array.array otherwise), and the page's dicts can be dropped
+right after. Capacity doubles, so appends are amortized O(1) and finish()
+trims the slack.
+
+ColumnTable exposes the columns as attributes (t.user_id, t.movie_id, ...),
+like interactions_cache.Interactions, so scoring code can take either one.
+iter_rows() yields plain Python tuples in chunks for code that still loops
+row by row (numpy scalars do not serialize to JSON).
+
+Usage:
+    b = column_table.ColumnBuilder(column_table.INTERACTIONS)
+    for page in table_reader.read_pages("processed_interactions", "user_id,movie_id,value"):
+        b.extend(page)
+    t = b.finish("processed_interactions")
+"""
+
+from array import array
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+INTERACTIONS = (("user_id", "<i4"), ("movie_id", "<i4"), ("value", "<f4"))
+_TYPECODES = {"<i4": "i", "<i8": "q", "<f4": "f", "<f8": "d"}
+
+def _caster(col: tuple):
+    # Spec entries are (name, dtype) or (name, dtype, cast), e.g. ("ts", "<i8", ts_epoch)
+    if len(col) > 2:
+        return col[2]
+    return float if col[1][1] == "f" else int
+
+class ColumnTable:
+    def __init__(self, columns: dict, source: str = ""):
+        self.columns = columns
+        self.source = source
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    def __getattr__(self, name: str):
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @property
+    def names(self):
+        return list(self.columns)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(c.nbytes if np is not None and isinstance(c, np.ndarray) else len(c) * c.itemsize
+                   for c in self.columns.values())
+
+    def iter_rows(self, *names, chunk: int = 65536):
+        """Tuples of Python scalars for the named columns (all columns by default)."""
+        cols = [self.columns[n] for n in (names or self.columns)]
+        for i in range(0, len(self), chunk):
+            yield from zip(*(c[i:i + chunk].tolist() for c in cols))
+
+class ColumnBuilder:
+    """Appends pages of rows to typed columns. Rows with a missing or unparseable value are skipped."""
+
+    def __init__(self, spec=INTERACTIONS, capacity: int = 65536):
+        self.spec = tuple(spec)
+        self.n = 0
+        self.skipped = 0
+        if np is not None:
+            self._bufs = [np.empty(capacity, dtype=col[1]) for col in self.spec]
+        else:
+            self._bufs = [array(_TYPECODES[col[1]]) for col in self.spec]
+
+    def _reserve(self, extra: int):
+        cap = len(self._bufs[0])
+        if self.n + extra <= cap:
+            return
+        cap = max(self.n + extra, cap * 2)
+        for i, b in enumerate(self._bufs):
+            grown = np.empty(cap, dtype=b.dtype)
+            grown[:self.n] = b[:self.n]
+            self._bufs[i] = grown
+
+    def _convert(self, rows: list, fields):
+        """Per-column Python values for the rows whose every column parses."""
+        casts = [(f, _caster(col)) for f, col in zip(fields, self.spec)]
+        out = [[] for _ in casts]
+        for r in rows:
+            try:
+                vals = [cast(r[f]) for f, cast in casts]
+            except (KeyError, IndexError, TypeError, ValueError):
+                self.skipped += 1
+                continue
+            for col, v in zip(out, vals):
+                col.append(v)
+        return out
+
+    def extend(self, rows: list, fields=None) -> int:
+        """Append one page; returns the number of rows kept. Rows are dicts keyed by column name, or
+        sequences (e.g. csv.reader rows, numbers as strings) read at the positions in fields."""
+        k = len(rows)
+        if not k:
+            return 0
+        fields = fields or [col[0] for col in self.spec]
+        if np is None:
+            cols = self._convert(rows, fields)
+            for b, c in zip(self._bufs, cols):
+                b.extend(c)
+            kept = len(cols[0])
+            self.n += kept
+            return kept
+        self._reserve(k)
+        try:
+            # Fast path: JSON numbers (or CSV numeric strings) go straight into the typed buffers
+            for f, col, b in zip(fields, self.spec, self._bufs):
+                vals = (r[f] for r in rows) if len(col) < 3 else (col[2](r[f]) for r in rows)
+                b[self.n:self.n + k] = np.fromiter(vals, dtype=b.dtype, count=k)
+        except (KeyError, IndexError, TypeError, ValueError):
+            cols = self._convert(rows, fields)
+            k = len(cols[0])
+            for b, c in zip(self._bufs, cols):
+                b[self.n:self.n + k] = c
+        self.n += k
+        return k
+
+    def finish(self, source: str = "") -> ColumnTable:
+        if np is not None:
+            cols = [b[:self.n].copy() if len(b) > self.n else b for b in self._bufs]
+        else:
+            cols = self._bufs
+        self._bufs = []
+        if self.skipped:
+            print(f"[v0] {source or 'columns'}: skipped {self.skipped} rows with missing or invalid values")
+        return ColumnTable({col[0]: c for col, c in zip(self.spec, cols)}, source)
@@ -0,0 +1,145 @@
+"""
+Per-key content hashes from the previous ingest, so a re-run only upserts rows that changed.
+
+Each table keeps two flat files under scripts/tmp/delta: <table>.keys and
+<table>.hashes. They hold uint64 arrays sorted by key, 16 bytes per row
+(25M ratings ≈ 400 MB on disk and in memory, versus several GB for a dict).
+Keys are packed ints: movie_id, or (user_id << 32) | movie_id for rating
+tables. Hashes are the first 8 bytes of a BLAKE2b digest of the row's
+canonical JSON.
+
+Usage:
+    store = DeltaStore("processed_interactions", ("user_id", "movie_id"))
+    changed = list(store.filter(rows))      # only new or changed rows
+    upsert(changed)
+    store.commit()                          # persist only after the upsert succeeded
+    store.log_counts()
+
+Lookups bisect from the last hit first, so key-ordered input (MovieLens ratings
+are sorted by userId, movieId) costs O(1) probes per row.
+
+State is scoped per SUPABASE_URL. Writes that bypass the store (other ingest
+scripts, manual edits) are invisible to it. After those, run once with
+reset=True (--delta-reset) so every row is sent and the hashes are rebuilt.
+
+Env:
+- DELTA_STATE_DIR  override the store directory (default scripts/tmp/delta)
+"""
+
+import os
+import json
+import bisect
+import hashlib
+from array import array
+from pathlib import Path
+
+STATE_DIR = Path(os.environ.get("DELTA_STATE_DIR") or "scripts/tmp/delta")
+_HINT_WINDOW = 64
+
+def scope() -> str:
+    url = (os.environ.get("SUPABASE_URL") or os.environ.get("NEXT_PUBLIC_SUPABASE_URL") or "").rstrip("/")
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:12]
+
+def pack_key(values) -> int:
+    if len(values) == 1:
+        return int(values[0])
+    hi, lo = int(values[0]), int(values[1])
+    if not (0 <= hi < 1 << 32 and 0 <= lo < 1 << 32):
+        raise ValueError(f"[v0] key {values} does not fit in two uint32 halves")
+    return (hi << 32) | lo
+
+def row_hash(row: dict) -> int:
+    blob = json.dumps(row, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(blob, digest_size=8).digest(), "little")
+
+class DeltaStore:
+    def __init__(self, table: str, key_fields, state_dir: Path = None, reset: bool = False):
+        self.table = table
+        self.key_fields = tuple(key_fields)
+        self.dir = Path(state_dir or STATE_DIR) / scope()
+        self.keys = array("Q")
+        self.hashes = array("Q")
+        self.pending = {}                   # new keys seen this run -> hash
+        self.counts = {"inserted": 0, "changed": 0, "unchanged": 0}
+        self._hint = 0
+        if reset:
+            print(f"[v0] {self.table} delta: reset requested, every row counts as new")
+        else:
+            self._load()
+
+    def _paths(self):
+        return self.dir / f"{self.table}.keys", self.dir / f"{self.table}.hashes"
+
+    def _load(self):
+        kp, hp = self._paths()
+        if not (kp.exists() and hp.exists()):
+            print(f"[v0] {self.table} delta: no previous state, every row counts as new")
+            return
+        with open(kp, "rb") as f:
+            self.keys.frombytes(f.read())
+        with open(hp, "rb") as f:
+            self.hashes.frombytes(f.read())
+        if len(self.keys) != len(self.hashes):
+            print(f"[v0] {self.table} delta: state files disagree, discarding")
+            self.keys, self.hashes = array("Q"), array("Q")
+            return
+        print(f"[v0] {self.table} delta: loaded {len(self.keys)} keys")
+
+    def _find(self, key: int) -> int:
+        keys, n, h = self.keys, len(self.keys), self._hint
+        if h < n and keys[h] <= key:
+            i = bisect.bisect_left(keys, key, h, min(n, h + _HINT_WINDOW))
+            if i == min(n, h + _HINT_WINDOW) and i < n:
+                i = bisect.bisect_left(keys, key, i, n)
+        else:
+            i = bisect.bisect_left(keys, key)
+        self._hint = i
+        return i if i < n and keys[i] == key else -1
+
+    def classify(self, row: dict) -> str:
+        """Return "inserted", "changed" or "unchanged", and stage the row's hash for commit()."""
+        key = pack_key([row[k] for k in self.key_fields])
+        digest = row_hash(row)
+        i = self._find(key)
+        if i < 0:
+            prev = self.pending.get(key)
+            kind = "unchanged" if prev == digest else ("changed" if prev is not None else "inserted")
+            self.pending[key] = digest
+        elif self.hashes[i] == digest:
+            kind = "unchanged"
+        else:
+            kind = "changed"
+            self.hashes[i] = digest
+        self.counts[kind] += 1
+        return kind
+
+    def filter(self, rows):
+        """Yield only rows that are new or whose content changed since the last commit."""
+        for row in rows:
+            if self.classify(row) != "unchanged":
+                yield row
+
+    def commit(self):
+        """Merge staged keys into the sorted arrays and write them atomically."""
+        if self.pending:
+            add = sorted(self.pending.items())
+            keys, hashes = array("Q"), array("Q")
+            i = j = 0
+            ok, oh = self.keys, self.hashes
+            while i < len(ok) or j < len(add):
+                if j >= len(add) or (i < len(ok) and ok[i] < add[j][0]):
+                    keys.append(ok[i]); hashes.append(oh[i]); i += 1
+                else:
+                    keys.append(add[j][0]); hashes.append(add[j][1]); j += 1
+            self.keys, self.hashes, self.pending = keys, hashes, {}
+        self.dir.mkdir(parents=True, exist_ok=True)
+        for path, arr in zip(self._paths(), (self.keys, self.hashes)):
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            with open(tmp, "wb") as f:
+                arr.tofile(f)
+            os.replace(tmp, path)
+        self._hint = 0
+
+    def log_counts(self):
+        c = self.counts
+        print(f"[v0] {self.table} delta: inserted {c['inserted']}, changed {c['changed']}, unchanged {c['unchanged']}")
@@ -0,0 +1,36 @@
+"""
+Fill processed_interactions from raw_ratings inside the database.
+
+Calls the derive_processed_interactions RPC from
+scripts/sql/014_derive_processed_interactions.sql once per user-id range: one
+set-based INSERT ... SELECT per call, with ranges small enough to stay under the
+statement timeout. The function upserts on (user_id, movie_id), so repeating a
+range is harmless and sb_rest may retry a call.
+
+Usage:
+    derive_processed.derive(user_min, user_max)
+
+Env:
+- DERIVE_USERS_PER_CALL  user ids per RPC call (default 20000)
+"""
+
+import os
+
+import sb_rest
+
+USERS_PER_CALL = int(os.environ.get("DERIVE_USERS_PER_CALL") or 20000)
+
+def derive(user_min, user_max, step: int = USERS_PER_CALL) -> int:
+    """Rows written for users user_min..user_max (inclusive); 0 when user_min is None."""
+    if user_min is None:
+        print("[v0] No ratings uploaded; nothing to derive")
+        return 0
+    rest = sb_rest.client()
+    total = 0
+    for lo in range(user_min, user_max + 1, step):
+        hi = min(user_max, lo + step - 1)
+        n = rest.json("POST", "/rest/v1/rpc/derive_processed_interactions", body={"p_user_min": lo, "p_user_max": hi})
+        total += int(n or 0)
+        print(f"[v0] processed_interactions derived for users {lo}-{hi}: {n}")
+    print(f"[v0] processed_interactions derived in-database: {total} rows written")
+    return total
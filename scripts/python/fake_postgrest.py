@@ -0,0 +1,469 @@
+"""
+Local PostgREST stand-in for benchmarking and load-testing the pipeline offline (stdlib only).
+
+Serves /rest/v1/<table> from in-memory tables with the subset of PostgREST the
+scripts rely on:
+- GET with select=, eq/neq/gt/gte/lt/lte/in/is filters, or=(...)/and=(...)
+  groups, order=, limit/offset and Range: a-b paging. Content-Range is
+  "a-b/total" with Prefer: count=exact, planned or estimated, and "a-b/*"
+  otherwise. 206 for a partial page, 416 past the end. Accept: text/csv
+  returns CSV. --db-max-rows caps the rows per response the way PostgREST's
+  db-max-rows does.
+- POST with on_conflict= and Prefer: resolution=merge-duplicates or
+  ignore-duplicates. return=minimal (201, empty) or return=representation.
+- Errors match Postgres: a duplicate key without a resolution is 409 (23505),
+  on_conflict without a matching unique key is 400 (42P10), and a key repeated
+  inside one upsert is 500 (21000).
+- DELETE with filters, and POST /rest/v1/rpc/derive_processed_interactions
+  (see scripts/sql/014_derive_processed_interactions.sql).
+- gzip request bodies and gzip responses (Accept-Encoding).
+
+Fault injection: --latency-ms/--jitter-ms per request, --max-body-bytes and
+--max-rows (413), --rate N requests/s with --burst (429 + Retry-After), and
+--error-rate for random 503s. GET /__stats returns request counters;
+POST /__reset clears all tables.
+
+Usage:
+    python scripts/python/fake_postgrest.py --port 54321 --latency-ms 20 --max-rows 5000 --rate 50
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_SERVICE_ROLE_KEY=dev python scripts/python/01_ingest_supabase_resilient.py
+
+From Python (benchmarks): server, url = fake_postgrest.serve_in_thread(latency_ms=5)
+"""
+
+import io
+import csv
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+from urllib import parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Unique keys of the pipeline tables (primary keys + 013_add_unique_indexes.sql)
+UNIQUE_KEYS = {
+    "raw_movies": ("movie_id",), "raw_links": ("movie_id",),
+    "processed_movies": ("movie_id",), "processed_links": ("movie_id",),
+    "raw_ratings": ("user_id", "movie_id"), "processed_interactions": ("user_id", "movie_id"),
+    "recommendations": ("user_id",),
+}
+
+class PgError(Exception):
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status, self.code, self.message = status, code, message
+
+class Table:
+    def __init__(self, name: str):
+        self.name = name
+        self.key = UNIQUE_KEYS.get(name)
+        self.rows = []                      # list of row dicts in insertion order
+        self.index = {}                     # key tuple -> position in rows
+        self.live = 0
+
+    def _key(self, row, cols):
+        return tuple(row.get(c) for c in cols)
+
+    def upsert(self, batch: list, on_conflict, resolution):
+        cols = list(batch[0].keys()) if batch else []
+        batch = [{c: r.get(c) for c in cols} for r in batch]   # PostgREST takes the first object's keys
+        key = tuple(on_conflict) if on_conflict else self.key
+        if on_conflict and tuple(on_conflict) != self.key:
+            raise PgError(400, "42P10", "there is no unique or exclusion constraint matching the ON CONFLICT specification")
+        out = []
+        if key:
+            seen = set()
+            for r in batch:
+                k = self._key(r, key)
+                if k in seen and resolution == "merge-duplicates":
+                    raise PgError(500, "21000", "ON CONFLICT DO UPDATE command cannot affect row a second time")
+                if k in self.index and resolution is None:
+                    raise PgError(409, "23505", f'duplicate key value violates unique constraint "{self.name}_pkey"')
+                seen.add(k)
+        for r in batch:
+            k = self._key(r, key) if key else None
+            pos = self.index.get(k) if key else None
+            if pos is not None:
+                if resolution == "ignore-duplicates":
+                    continue
+                self.rows[pos].update(r)
+                out.append(self.rows[pos])
+                continue
+            if key:
+                self.index[k] = len(self.rows)
+            self.rows.append(dict(r))
+            self.live += 1
+            out.append(r)
+        return out
+
+    def select(self, filters, order):
+        rows = [r for r in self.rows if r is not None and all(f(r) for f in filters)]
+        for col, desc, nulls_first in reversed(order):
+            # Postgres default: NULLS LAST ascending, NULLS FIRST descending
+            rows.sort(key=lambda r: (((r.get(col) is None) != nulls_first) != desc, r.get(col)), reverse=desc)
+        return rows
+
+    def delete(self, filters):
+        n = 0
+        for i, r in enumerate(self.rows):
+            if r is not None and all(f(r) for f in filters):
+                self.rows[i] = None
+                n += 1
+        if n:
+            self.rows = [r for r in self.rows if r is not None]
+            self.index = {self._key(r, self.key): i for i, r in enumerate(self.rows)} if self.key else {}
+            self.live = len(self.rows)
+        return n
+
+def _coerce(raw: str, like):
+    if isinstance(like, bool):
+        return raw.lower() == "true"
+    if isinstance(like, int):
+        try: return int(raw)
+        except ValueError: return float(raw)
+    if isinstance(like, float):
+        return float(raw)
+    return raw
+
+_OPS = {"eq": lambda a, b: a == b, "neq": lambda a, b: a != b, "gt": lambda a, b: a > b,
+        "gte": lambda a, b: a >= b, "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b}
+
+def _split_top(s: str):
+    # "a.eq.1,and(b.gt.2,c.lt.3)" -> ["a.eq.1", "and(b.gt.2,c.lt.3)"]
+    parts, depth, cur = [], 0, []
+    for ch in s:
+        if ch == "," and depth == 0:
+            parts.append("".join(cur))
+            cur = []
+            continue
+        depth += (ch == "(") - (ch == ")")
+        cur.append(ch)
+    parts.append("".join(cur))
+    return [p for p in parts if p]
+
+def _logic(op: str, expr: str):
+    # or=(a.gt.1,and(a.eq.1,b.gt.2)), as used by keyset pagination
+    terms = []
+    for t in _split_top(expr.strip()[1:-1]):
+        if t.startswith(("or(", "and(")):
+            name, _, rest = t.partition("(")
+            terms.append(_logic(name, "(" + rest))
+        else:
+            col, _, e = t.partition(".")
+            terms.append(_filter(col, e))
+    combine = any if op == "or" else all
+    return lambda r: combine(f(r) for f in terms)
+
+def _filter(col: str, expr: str):
+    if col in ("or", "and"):
+        return _logic(col, expr)
+    op, _, raw = expr.partition(".")
+    if op == "is":
+        want = None if raw == "null" else raw == "true"
+        return lambda r: r.get(col) is want
+    if op == "in":
+        items = [s.strip().strip('"') for s in raw.strip("()").split(",") if s.strip()]
+        return lambda r: r.get(col) is not None and r.get(col) in {_coerce(s, r.get(col)) for s in items}
+    if op not in _OPS:
+        raise PgError(400, "PGRST100", f"unsupported operator {op!r}")
+    fn = _OPS[op]
+    return lambda r: r.get(col) is not None and fn(r.get(col), _coerce(raw, r.get(col)))
+
+class Store:
+    def __init__(self):
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def table(self, name: str) -> Table:
+        t = self.tables.get(name)
+        if t is None:
+            t = self.tables[name] = Table(name)
+        return t
+
+    def rpc(self, fn: str, args: dict):
+        if fn == "derive_processed_interactions":
+            lo, hi = args.get("p_user_min"), args.get("p_user_max")
+            latest = {}
+            for r in self.table("raw_ratings").rows:
+                if r is None or None in (r.get("user_id"), r.get("movie_id"), r.get("rating"), r.get("ts")):
+                    continue
+                if (lo is not None and r["user_id"] < lo) or (hi is not None and r["user_id"] > hi):
+                    continue
+                k = (r["user_id"], r["movie_id"])
+                if k not in latest or r["ts"] > latest[k]["ts"]:
+                    latest[k] = r
+            proc = self.table("processed_interactions")
+            changed = []
+            for k, r in latest.items():
+                cur = proc.rows[proc.index[k]] if k in proc.index else None
+                if cur is None or (cur.get("value"), cur.get("ts")) != (r["rating"], r["ts"]):
+                    changed.append({"user_id": r["user_id"], "movie_id": r["movie_id"], "value": r["rating"], "ts": r["ts"]})
+            if changed:
+                proc.upsert(changed, ("user_id", "movie_id"), "merge-duplicates")
+            return len(changed)
+        raise PgError(404, "PGRST202", f"Could not find the function public.{fn}")
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.t = burst, time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        """0 if a token was available, else seconds until one will be."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+            self.t = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "fake-postgrest/0.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.opts.get("verbose"):
+            super().log_message(fmt, *args)
+
+    # --- plumbing -------------------------------------------------------------
+    def _count(self, key: str, n: int = 1):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + n
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers: dict = None):
+        hdrs = dict(headers or {})
+        if body and "gzip" in (self.headers.get("Accept-Encoding") or "") and len(body) >= 256:
+            body = gzip.compress(body, compresslevel=5)
+            hdrs["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        if body:
+            self.send_header("Content-Type", content_type)
+        for k, v in hdrs.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+        self._count(f"status_{status}")
+        self._count("bytes_out", len(body))
+
+    def _error(self, e: PgError, headers: dict = None):
+        self._send(e.status, json.dumps({"code": e.code, "message": e.message, "details": None, "hint": None}).encode(),
+                   headers=headers)
+
+    def _body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(n) if n else b""
+        self._count("bytes_in", len(data))
+        if (self.headers.get("Content-Encoding") or "").lower() == "gzip":
+            if self.server.opts.get("no_gzip_requests"):
+                raise PgError(415, "PGRST102", "Content-Encoding gzip is not supported")
+            data = gzip.decompress(data)
+        limit = self.server.opts.get("max_body_bytes")
+        if limit and len(data) > limit:
+            raise PgError(413, "PGRST413", f"Payload too large: {len(data)} bytes > {limit}")
+        return data
+
+    def _faults(self) -> bool:
+        """Apply latency / rate limiting / random errors. Returns False if a response was already sent."""
+        o = self.server.opts
+        if o.get("latency_ms") or o.get("jitter_ms"):
+            time.sleep((o.get("latency_ms", 0) + random.uniform(0, o.get("jitter_ms", 0))) / 1000.0)
+        if self.server.bucket:
+            wait = self.server.bucket.take()
+            if wait:
+                self._body_drain()
+                self._error(PgError(429, "PGRST429", "Too many requests"), {"Retry-After": str(max(1, round(wait)))})
+                return False
+        if o.get("error_rate") and random.random() < o["error_rate"]:
+            self._body_drain()
+            self._error(PgError(503, "PGRST503", "Service temporarily unavailable (injected)"))
+            return False
+        return True
+
+    def _body_drain(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if n:
+            self.rfile.read(n)
+
+    def _route(self):
+        u = parse.urlsplit(self.path)
+        q = parse.parse_qsl(u.query, keep_blank_values=True)
+        parts = [p for p in u.path.split("/") if p]
+        return parts, q
+
+    def _prefer(self) -> dict:
+        out = {}
+        for item in (self.headers.get("Prefer") or "").split(","):
+            k, _, v = item.strip().partition("=")
+            if k:
+                out[k] = v
+        return out
+
+    # --- verbs ----------------------------------------------------------------
+    def do_GET(self):
+        self._count("requests")
+        parts, q = self._route()
+        if parts == ["__stats"]:
+            with self.server.store.lock:
+                tables = {n: t.live for n, t in self.server.store.tables.items()}
+            return self._send(200, json.dumps({"stats": self.server.stats, "tables": tables}).encode())
+        if not self._faults():
+            return
+        try:
+            self._get(parts, q)
+        except PgError as e:
+            self._error(e)
+
+    do_HEAD = do_GET
+
+    def _get(self, parts, q):
+        if len(parts) != 3 or parts[:2] != ["rest", "v1"]:
+            raise PgError(404, "PGRST125", f"Invalid path {self.path}")
+        select, order, filters, limit, offset = None, [], [], None, 0
+        for k, v in q:
+            if k == "select":
+                select = [c.split("::")[0].strip() for c in v.split(",")] if v and v != "*" else None
+            elif k == "order":
+                for term in v.split(","):
+                    bits = term.split(".")
+                    desc = "desc" in bits[1:]
+                    nulls_first = "nullsfirst" in bits[1:] or (desc and "nullslast" not in bits[1:])
+                    order.append((bits[0], desc, nulls_first))
+            elif k == "limit":
+                limit = int(v)
+            elif k == "offset":
+                offset = int(v)
+            else:
+                filters.append(_filter(k, v))
+        rng = self.headers.get("Range")
+        if rng:
+            a, _, b = rng.rpartition("=")[2].partition("-")   # "0-99" or "items=0-99"
+            offset = offset + int(a)
+            if b:
+                limit = min(limit, int(b) - int(a) + 1) if limit is not None else int(b) - int(a) + 1
+        cap = self.server.opts.get("db_max_rows")
+        if cap:
+            limit = min(limit, cap) if limit is not None else cap
+        with self.server.store.lock:
+            rows = self.server.store.table(parts[2]).select(filters, order)
+        total = len(rows)
+        page = rows[offset: offset + limit if limit is not None else None]
+        if select:
+            page = [{c: r.get(c) for c in select} for r in page]
+        counted = self._prefer().get("count") in ("exact", "planned", "estimated")
+        tail = str(total) if counted else "*"
+        if offset and offset >= total and total:
+            raw_416 = {"Content-Range": f"*/{total}"}
+            return self._send(416, json.dumps({"code": "PGRST103", "message": "Requested range not satisfiable"}).encode(),
+                              headers=raw_416)
+        content_range = f"{offset}-{offset + len(page) - 1}/{tail}" if page else f"*/{tail}"
+        status = 206 if counted and page and len(page) < total else 200
+        if "text/csv" in (self.headers.get("Accept") or ""):
+            buf = io.StringIO()
+            cols = select or (list(page[0].keys()) if page else [])
+            w = csv.writer(buf)
+            w.writerow(cols)
+            for r in page:
+                w.writerow(["" if r.get(c) is None else r.get(c) for c in cols])
+            return self._send(status, buf.getvalue().encode("utf-8"), "text/csv; charset=utf-8", {"Content-Range": content_range})
+        self._count("rows_out", len(page))
+        self._send(status, json.dumps(page).encode("utf-8"), headers={"Content-Range": content_range})
+
+    def do_POST(self):
+        self._count("requests")
+        parts, q = self._route()
+        if parts == ["__reset"]:
+            self._body_drain()
+            with self.server.store.lock:
+                self.server.store.tables.clear()
+            return self._send(204)
+        if not self._faults():
+            return
+        try:
+            self._post(parts, dict(q))
+        except PgError as e:
+            self._error(e)
+
+    def _post(self, parts, q):
+        data = self._body()
+        try:
+            payload = json.loads(data or b"null")
+        except ValueError:
+            raise PgError(400, "PGRST102", "Empty or invalid json")
+        if len(parts) == 4 and parts[:3] == ["rest", "v1", "rpc"]:
+            with self.server.store.lock:
+                result = self.server.store.rpc(parts[3], payload or {})
+            return self._send(200, json.dumps(result).encode())
+        if len(parts) != 3 or parts[:2] != ["rest", "v1"]:
+            raise PgError(404, "PGRST125", f"Invalid path {self.path}")
+        batch = payload if isinstance(payload, list) else [payload]
+        max_rows = self.server.opts.get("max_rows")
+        if max_rows and len(batch) > max_rows:
+            raise PgError(413, "PGRST413", f"Payload too large: {len(batch)} rows > {max_rows}")
+        prefer = self._prefer()
+        on_conflict = [c.strip() for c in q["on_conflict"].split(",")] if q.get("on_conflict") else None
+        with self.server.store.lock:
+            out = self.server.store.table(parts[2]).upsert(batch, on_conflict, prefer.get("resolution"))
+        self._count("rows_in", len(batch))
+        if prefer.get("return") == "representation":
+            return self._send(201, json.dumps(out).encode("utf-8"))
+        self._send(201)
+
+    def do_DELETE(self):
+        self._count("requests")
+        parts, q = self._route()
+        if not self._faults():
+            return
+        try:
+            if len(parts) != 3 or parts[:2] != ["rest", "v1"]:
+                raise PgError(404, "PGRST125", f"Invalid path {self.path}")
+            filters = [_filter(k, v) for k, v in q]
+            with self.server.store.lock:
+                self.server.store.table(parts[2]).delete(filters)
+            self._send(204)
+        except PgError as e:
+            self._error(e)
+
+def make_server(host: str = "127.0.0.1", port: int = 54321, **opts) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer((host, port), Handler)
+    srv.daemon_threads = True
+    srv.opts = opts
+    srv.store = Store()
+    srv.stats, srv.stats_lock = {}, threading.Lock()
+    rate = opts.get("rate")
+    srv.bucket = TokenBucket(rate, opts.get("burst") or max(1.0, rate)) if rate else None
+    return srv
+
+def serve_in_thread(host: str = "127.0.0.1", port: int = 0, **opts):
+    """Start a server on a background thread; returns (server, base_url). Call server.shutdown() when done."""
+    srv = make_server(host, port, **opts)
+    threading.Thread(target=srv.serve_forever, name="fake-postgrest", daemon=True).start()
+    return srv, f"http://{host}:{srv.server_address[1]}"
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="In-memory PostgREST stand-in for offline pipeline runs.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=54321)
+    ap.add_argument("--latency-ms", type=float, default=0, help="fixed delay added to every request")
+    ap.add_argument("--jitter-ms", type=float, default=0, help="extra uniform random delay")
+    ap.add_argument("--max-body-bytes", type=int, default=0, help="reject larger (decompressed) bodies with 413")
+    ap.add_argument("--max-rows", type=int, default=0, help="reject POSTs with more rows with 413")
+    ap.add_argument("--db-max-rows", type=int, default=0, help="cap rows per GET response (PostgREST db-max-rows)")
+    ap.add_argument("--rate", type=float, default=0, help="requests per second before 429s (token bucket)")
+    ap.add_argument("--burst", type=float, default=0, help="token bucket size (default: rate)")
+    ap.add_argument("--error-rate", type=float, default=0, help="fraction of requests failing with 503")
+    ap.add_argument("--no-gzip-requests", action="store_true", help="answer gzip request bodies with 415")
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+    opts = {k: v for k, v in vars(args).items() if k not in ("host", "port")}
+    srv = make_server(args.host, args.port, **opts)
+    print(f"[v0] fake PostgREST on http://{args.host}:{args.port} (SUPABASE_URL); Ctrl-C to stop")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,124 @@
+"""
+Durable per-table progress for long ingests, so a crashed run can resume instead of starting over.
+
+One JSON file per script under scripts/tmp/checkpoints. For each table it
+records the source URL and its SHA-256 (from the source_cache manifest, read only
+after the source has been revalidated, so a file that changed upstream is never
+matched against the previous download's hash), the source offset (rows of the
+prepared row stream acknowledged in order), the last
+committed batch sequence number, and whether the table finished. The file is
+rewritten (fsync + atomic rename) after every acknowledged batch. Hook it up
+with UpsertPool(on_commit=ckpt.on_commit), which only fires once all earlier
+batches for the table have been acknowledged, so the offset never has gaps.
+
+A resumed run skips `offset` rows of the same source and replays from there.
+A batch the server applied just before the crash may be sent again, so writes
+must be upserts on the 013_add_unique_indexes.sql keys.
+
+Usage:
+    ckpt = Checkpoint("01_ingest_supabase_resilient", resume=args.resume)
+    rows = ckpt.skip("raw_ratings", RATINGS_URL, rows)
+    with UpsertPool(post, on_commit=ckpt.on_commit) as pool:
+        pool.feed("raw_ratings", rows)
+    ckpt.finish("raw_ratings")
+
+Env:
+- INGEST_CHECKPOINT_DIR  override the checkpoint directory (default scripts/tmp/checkpoints)
+"""
+
+import os
+import json
+import time
+import hashlib
+import itertools
+import threading
+from pathlib import Path
+
+import source_cache
+
+CHECKPOINT_DIR = Path(os.environ.get("INGEST_CHECKPOINT_DIR") or "scripts/tmp/checkpoints")
+
+def _target() -> str:
+    url = (os.environ.get("SUPABASE_URL") or os.environ.get("NEXT_PUBLIC_SUPABASE_URL") or "").rstrip("/")
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:12]
+
+def _source_sha(url: str, resolve: bool = False):
+    if resolve:
+        # Conditional GET (or wait on the prefetch) first; the manifest may still describe the last run's file
+        source_cache.cached_fetch(url)
+    ent = source_cache.entry(url)
+    return ent.get("sha256") if ent else None
+
+class Checkpoint:
+    def __init__(self, name: str, resume: bool = False, checkpoint_dir: Path = None):
+        self.path = Path(checkpoint_dir or CHECKPOINT_DIR) / f"{name}.json"
+        self._lock = threading.Lock()
+        self.state = {"target": _target(), "tables": {}}
+        if resume:
+            self._load()
+        self._save()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            print(f"[v0] No checkpoint at {self.path}; starting from the beginning")
+            return
+        except json.JSONDecodeError:
+            print(f"[v0] Checkpoint {self.path} is unreadable; starting from the beginning")
+            return
+        if state.get("target") != self.state["target"]:
+            print("[v0] Checkpoint was written for a different SUPABASE_URL; starting from the beginning")
+            return
+        self.state = state
+        for table, t in state.get("tables", {}).items():
+            status = "complete" if t.get("done") else f"offset {t.get('offset', 0)}, last batch {t.get('batch')}"
+            print(f"[v0] Checkpoint {table}: {status}")
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def start(self, table: str, url: str) -> int:
+        """Source offset to resume table from; 0 (and a fresh entry) if the source changed or nothing was saved."""
+        sha = _source_sha(url, resolve=True)
+        with self._lock:
+            t = self.state["tables"].get(table)
+            if t and (t.get("url") != url or (t.get("sha256") and sha and t["sha256"] != sha)):
+                print(f"[v0] {table}: source changed since the checkpoint; restarting this table")
+                t = None
+            if t is None:
+                t = self.state["tables"][table] = {"url": url, "sha256": sha, "offset": 0, "batch": None, "done": False}
+                self._save()
+            elif sha and not t.get("sha256"):
+                t["sha256"] = sha
+            return t["offset"]
+
+    def skip(self, table: str, url: str, rows):
+        """Drop the rows already committed for table; returns an iterator over the rest."""
+        offset = self.start(table, url)
+        if offset:
+            done = self.state["tables"][table].get("done")
+            print(f"[v0] {table}: {'already complete' if done else 'resuming'} after {offset} committed rows")
+        return itertools.islice(rows, offset, None)
+
+    def on_commit(self, table: str, seq: int, n: int):
+        with self._lock:
+            t = self.state["tables"][table]
+            t["offset"] += n
+            t["batch"] = seq
+            t["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            self._save()
+
+    def finish(self, table: str):
+        with self._lock:
+            t = self.state["tables"][table]
+            t["done"] = True
+            t["sha256"] = t.get("sha256") or _source_sha(t["url"])
+            self._save()
@@ -0,0 +1,203 @@
+"""
+Sparse user x item interaction matrix shared by the training stages.
+
+Each stage used to keep its own structure for the same data: dicts of seen
+sets, dicts of dense per-user float32 vectors (03_train_model), or dicts of
+session lists (train_trustchain). InteractionMatrix is one CSR matrix in plain
+numpy arrays:
+    indptr   int64, rows + 1      row i is indices/data[indptr[i]:indptr[i + 1]]
+    indices  int32                column positions, ascending within a row
+    data     float32              summed values (or the last one, duplicates="last")
+    row_ids, col_ids  int64       sorted external ids (user_id / movie_id) per position
+About 8 bytes per interaction. Rows are users by default. transpose() (or .T)
+gives the item-major CSR, i.e. the CSC of the original, with one stable argsort
+of the column indices. Row slices are views.
+
+Ids are encoded to positions in O(n) with a presence table when they are small
+non-negative ints (all MovieLens ids), else by sorting.
+
+Builders:
+    from_columns(user_id, movie_id, value)     any equal-length columns
+    from_cache(cols)                           interactions_cache / column_table columns
+    from_csv(path)                             via interactions_cache (the .npy cache when current)
+    from_pages(pages)                          REST pages of row dicts, e.g. table_reader.read_pages(...)
+    from_table("processed_interactions")       table_reader.fetch_columns
+
+Usage:
+    X = interaction_matrix.from_csv("scripts/output/interaction_log_processed.csv")
+    X.row_of(42), X.row(i), X.rows(0, 1024).toarray(), X.user_degree, X.item_degree
+    seen = X.seen()                            # topn.Seen over the same arrays
+"""
+
+import numpy as np
+
+KINDS = ("user", "item")
+
+def _encode(ids):
+    """(sorted unique ids, position of each id in them)."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return ids, ids
+    lo, hi = int(ids.min()), int(ids.max())
+    if lo >= 0 and hi < max(1 << 22, 4 * len(ids)):
+        present = np.zeros(hi + 1, dtype=bool)
+        present[ids] = True
+        uniq = np.flatnonzero(present)
+        table = np.cumsum(present) - 1
+        return uniq, table[ids]
+    s = np.sort(ids)
+    uniq = s[np.concatenate(([True], s[1:] != s[:-1]))]
+    return uniq, np.searchsorted(uniq, ids)
+
+class InteractionMatrix:
+    def __init__(self, indptr, indices, data, row_ids, col_ids, kind: str = "user"):
+        self.indptr, self.indices, self.data = indptr, indices, data
+        self.row_ids, self.col_ids = row_ids, col_ids
+        self.kind = kind                 # what the rows are: "user" or "item"
+
+    @property
+    def shape(self):
+        return len(self.row_ids), len(self.col_ids)
+
+    @property
+    def nnz(self) -> int:
+        return int(self.indptr[-1] - self.indptr[0])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.indptr, self.indices, self.data, self.row_ids, self.col_ids))
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def __repr__(self):
+        return f"InteractionMatrix({self.kind} rows, shape={self.shape}, nnz={self.nnz})"
+
+    def row_of(self, row_id) -> int:
+        """Row position of an external id (user_id for user rows), or -1."""
+        i = int(np.searchsorted(self.row_ids, row_id))
+        return i if i < len(self.row_ids) and self.row_ids[i] == row_id else -1
+
+    def row(self, i: int):
+        """(column positions, values) of row i, as views."""
+        lo, hi = self.indptr[i], self.indptr[i + 1]
+        return self.indices[lo:hi], self.data[lo:hi]
+
+    def rows(self, i0: int, i1: int) -> "InteractionMatrix":
+        """Rows i0..i1-1 as a matrix sharing this one's arrays (indptr is not rebased)."""
+        return InteractionMatrix(self.indptr[i0:i1 + 1], self.indices, self.data,
+                                 self.row_ids[i0:i1], self.col_ids, self.kind)
+
+    def take_rows(self, positions) -> "InteractionMatrix":
+        """Rows at arbitrary positions, copied into a new compact matrix."""
+        positions = np.asarray(positions, dtype=np.int64)
+        starts, ends = self.indptr[positions], self.indptr[positions + 1]
+        lens = ends - starts
+        indptr = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(lens, out=indptr[1:])
+        src = np.repeat(starts - indptr[:-1], lens) + np.arange(indptr[-1])
+        return InteractionMatrix(indptr, self.indices[src], self.data[src], self.row_ids[positions],
+                                 self.col_ids, self.kind)
+
+    def _compact(self):
+        """indptr from 0 and the indices/data it covers (a row slice keeps the parent's offsets)."""
+        lo, hi = self.indptr[0], self.indptr[-1]
+        return self.indptr - lo, self.indices[lo:hi], self.data[lo:hi]
+
+    def row_positions(self):
+        """Row position of every stored entry."""
+        indptr, _, _ = self._compact()
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(indptr))
+
+    def transpose(self) -> "InteractionMatrix":
+        """The same interactions with rows and columns swapped (CSR of the transpose, i.e. CSC)."""
+        _, indices, data = self._compact()
+        order = np.argsort(indices, kind="stable")
+        indptr = np.zeros(len(self.col_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=len(self.col_ids)), out=indptr[1:])
+        kind = KINDS[1 - KINDS.index(self.kind)]
+        return InteractionMatrix(indptr, self.row_positions()[order].astype(np.int32), data[order],
+                                 self.col_ids, self.row_ids, kind)
+
+    T = property(transpose)
+
+    @property
+    def row_degree(self):
+        """Stored entries per row."""
+        return np.diff(self.indptr)
+
+    @property
+    def col_degree(self):
+        _, indices, _ = self._compact()
+        return np.bincount(indices, minlength=len(self.col_ids))
+
+    @property
+    def user_degree(self):
+        return self.row_degree if self.kind == "user" else self.col_degree
+
+    @property
+    def item_degree(self):
+        return self.col_degree if self.kind == "user" else self.row_degree
+
+    def row_sums(self):
+        _, _, data = self._compact()
+        return np.bincount(self.row_positions(), weights=data, minlength=len(self))
+
+    def col_sums(self):
+        _, indices, data = self._compact()
+        return np.bincount(indices, weights=data, minlength=len(self.col_ids))
+
+    def toarray(self, dtype=np.float32):
+        """Dense (rows, cols) array; slice rows first for large matrices."""
+        _, indices, data = self._compact()
+        out = np.zeros(self.shape, dtype=dtype)
+        out[self.row_positions(), indices] = data
+        return out
+
+    def seen(self):
+        """The column ids per row as a topn.Seen (user -> seen movie ids)."""
+        import topn
+        indptr, indices, _ = self._compact()
+        return topn.Seen(self.row_ids, indptr, self.col_ids[indices])
+
+def from_columns(user_id, movie_id, value=None, duplicates: str = "sum") -> InteractionMatrix:
+    """User-major matrix from id/value columns. Repeated (user, movie) pairs are summed, or with
+    duplicates="last" the later value wins. value=None stores 1.0 per interaction."""
+    row_ids, rows = _encode(user_id)
+    col_ids, cols = _encode(movie_id)
+    v = np.ones(len(rows), dtype=np.float32) if value is None else np.asarray(value, dtype=np.float32)
+    ncols = max(len(col_ids), 1)
+    key = rows * ncols + cols
+    if len(key) > 1 and not (key[1:] >= key[:-1]).all():    # keyset reads arrive sorted already
+        order = np.argsort(key, kind="stable")
+        key, v = key[order], v[order]
+    if len(key):
+        first = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+        if len(first) < len(key):
+            if duplicates == "last":
+                v = v[np.append(first[1:], len(key)) - 1]
+            else:
+                v = np.add.reduceat(v.astype(np.float64), first).astype(np.float32)
+            key = key[first]
+    indptr = np.zeros(len(row_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(key // ncols, minlength=len(row_ids)), out=indptr[1:])
+    return InteractionMatrix(indptr, (key % ncols).astype(np.int32), v, row_ids, col_ids, "user")
+
+def from_cache(cols, duplicates: str = "sum") -> InteractionMatrix:
+    return from_columns(cols.user_id, cols.movie_id, cols.value, duplicates)
+
+def from_csv(csv_path=None, duplicates: str = "sum", **kw) -> InteractionMatrix:
+    """kw goes to interactions_cache.load (build=False reads without writing the cache, default_value)."""
+    import interactions_cache
+    return from_cache(interactions_cache.load(csv_path or interactions_cache.DEFAULT_CSV, **kw), duplicates)
+
+def from_pages(pages, duplicates: str = "sum") -> InteractionMatrix:
+    import column_table
+    b = column_table.ColumnBuilder(column_table.INTERACTIONS)
+    for page in pages:
+        b.extend(page)
+    return from_cache(b.finish("pages"), duplicates)
+
+def from_table(table: str = "processed_interactions", duplicates: str = "sum", **kw) -> InteractionMatrix:
+    import table_reader
+    return from_cache(table_reader.fetch_columns(table, **kw), duplicates)
@@ -0,0 +1,256 @@
+"""
+Columnar binary copy of interaction_log_processed.csv for the downstream stages.
+
+Next to the CSV, <stem>.columns/ holds one .npy file per column plus manifest.json:
+    user_id.npy   int32
+    movie_id.npy  int32
+    value.npy     float32   (the "value" or "rating" CSV column)
+    ts.npy        int64     epoch seconds; TS_MISSING where the CSV had none
+The manifest records the row count and the CSV's size and mtime, so a CSV
+rewritten by another ingest is detected and the columns are rebuilt. When a
+parse filled empty value cells, the fill value is recorded too, and a load
+asking for a different default_value rebuilds the columns.
+
+Ingest scripts stream rows into ColumnWriter while they write the CSV. It is
+stdlib only and writes the .npy format by hand. load() memory-maps the columns
+with numpy when it is installed, otherwise reads them into array.array. Either
+way the columns support len(), indexing and iteration. When the cache is
+missing or stale, load() parses the CSV once and writes the cache for next time.
+
+Usage:
+    cols = interactions_cache.load()            # default scripts/output/interaction_log_processed.csv
+    for uid, mid in zip(cols.user_id, cols.movie_id): ...
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import struct
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+DEFAULT_CSV = Path("scripts/output/interaction_log_processed.csv")
+COLUMNS = (("user_id", "i", "<i4"), ("movie_id", "i", "<i4"), ("value", "f", "<f4"), ("ts", "q", "<i8"))
+TS_MISSING = -(1 << 63)
+_HEADER_LEN = 128  # fixed, so the row count can be patched in after streaming
+_MAGIC = b"\x93NUMPY"
+_TYPECODES = {descr: tc for _, tc, descr in COLUMNS}
+
+def cache_dir(csv_path=DEFAULT_CSV) -> Path:
+    p = Path(csv_path)
+    return p.with_name(p.stem + ".columns")
+
+def ts_epoch(v) -> int:
+    """Epoch seconds from an int, a numeric string or an ISO-8601 timestamp; TS_MISSING if unparseable."""
+    if v is None or v == "":
+        return TS_MISSING
+    if isinstance(v, (int, float)):
+        return int(v)
+    try:
+        return int(float(v))
+    except ValueError:
+        pass
+    try:
+        dt = datetime.fromisoformat(str(v).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return TS_MISSING
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+def _npy_header(descr: str, n: int) -> bytes:
+    d = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, n)
+    hl = _HEADER_LEN - len(_MAGIC) - 4
+    return _MAGIC + b"\x01\x00" + struct.pack("<H", hl) + (d.ljust(hl - 1) + "\n").encode("latin1")
+
+def _source_stat(csv_path: Path) -> dict:
+    st = csv_path.stat()
+    return {"source_size": st.st_size, "source_mtime_ns": st.st_mtime_ns}
+
+class ColumnWriter:
+    """Append rows as they are produced; close() publishes the columns once the CSV is closed."""
+
+    def __init__(self, csv_path=DEFAULT_CSV, flush_rows: int = 65536):
+        self.csv_path = Path(csv_path)
+        self.dir = cache_dir(self.csv_path)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        (self.dir / "manifest.json").unlink(missing_ok=True)   # invalid until close()
+        self.flush_rows = flush_rows
+        self.rows = 0
+        self.default_value = None           # set when empty value cells were filled; recorded in the manifest
+        self._bufs = [array(tc) for _, tc, _ in COLUMNS]
+        self._files = []
+        for name, _, descr in COLUMNS:
+            f = open(self.dir / f"{name}.npy.part", "wb")
+            f.write(_npy_header(descr, 0))
+            self._files.append(f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def append(self, user_id, movie_id, value, ts=None):
+        b = self._bufs
+        b[0].append(int(user_id)); b[1].append(int(movie_id)); b[2].append(float(value)); b[3].append(ts_epoch(ts))
+        self.rows += 1
+        if len(b[0]) >= self.flush_rows:
+            self._flush()
+
+    def append_columns(self, user_id, movie_id, value, ts):
+        """Bulk append of equal-length columns (numpy arrays or sequences); ts already in epoch seconds."""
+        self._flush()
+        for col, (_, tc, descr), f in zip((user_id, movie_id, value, ts), COLUMNS, self._files):
+            if np is not None:
+                f.write(np.ascontiguousarray(col, dtype=descr).tobytes())
+            else:
+                a = array(tc, col)
+                if sys.byteorder == "big":
+                    a.byteswap()
+                a.tofile(f)
+        self.rows += len(user_id)
+
+    def _flush(self):
+        for buf, f in zip(self._bufs, self._files):
+            if sys.byteorder == "big":
+                buf.byteswap()
+            buf.tofile(f)
+            del buf[:]
+
+    def close(self):
+        self._flush()
+        for (name, _, descr), f in zip(COLUMNS, self._files):
+            f.seek(0)
+            f.write(_npy_header(descr, self.rows))
+            f.close()
+            os.replace(self.dir / f"{name}.npy.part", self.dir / f"{name}.npy")
+        manifest = {"rows": self.rows, "columns": {n: d for n, _, d in COLUMNS}, "ts_missing": TS_MISSING,
+                    "default_value": self.default_value,
+                    "source": str(self.csv_path), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        if self.csv_path.exists():
+            manifest.update(_source_stat(self.csv_path))
+        tmp = self.dir / "manifest.json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, self.dir / "manifest.json")
+        print(f"[v0] Wrote {self.rows} rows as .npy columns -> {self.dir}")
+
+    def abort(self):
+        for (name, _, _), f in zip(COLUMNS, self._files):
+            f.close()
+            (self.dir / f"{name}.npy.part").unlink(missing_ok=True)
+
+class Interactions:
+    __slots__ = ("user_id", "movie_id", "value", "ts", "source")
+
+    def __init__(self, user_id, movie_id, value, ts, source: str):
+        self.user_id, self.movie_id, self.value, self.ts, self.source = user_id, movie_id, value, ts, source
+
+    def __len__(self):
+        return len(self.user_id)
+
+def write_npy(path: Path, values, descr: str):
+    """One 1-D column as a .npy file (numpy array or sequence), written to a .part file and renamed."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".part")
+    with open(tmp, "wb") as f:
+        f.write(_npy_header(descr, len(values)))
+        if np is not None:
+            f.write(np.ascontiguousarray(values, dtype=descr).tobytes())
+        else:
+            a = values if isinstance(values, array) else array(_TYPECODES[descr], values)
+            if sys.byteorder == "big":
+                a = array(a.typecode, a)
+                a.byteswap()
+            a.tofile(f)
+    os.replace(tmp, path)
+
+def read_npy(path: Path, typecode: str, mmap: bool):
+    if np is not None:
+        return np.load(path, mmap_mode="r" if mmap else None)
+    with open(path, "rb") as f:
+        if f.read(6) != _MAGIC:
+            raise ValueError(f"[v0] {path} is not a .npy file")
+        major = f.read(2)[0]
+        hl = struct.unpack("<H", f.read(2))[0] if major == 1 else struct.unpack("<I", f.read(4))[0]
+        f.seek(hl, os.SEEK_CUR)
+        arr = array(typecode)
+        arr.frombytes(f.read())
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+def _load_columns(csv_path: Path, mmap: bool, default_value: float):
+    d = cache_dir(csv_path)
+    try:
+        with open(d / "manifest.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if csv_path.exists() and any(manifest.get(k) != v for k, v in _source_stat(csv_path).items()):
+        print(f"[v0] {csv_path} changed since its columns were written; rebuilding")
+        return None
+    filled = manifest.get("default_value")
+    if filled is not None and filled != default_value:
+        print(f"[v0] Columns in {d} filled empty values with {filled}, not {default_value}; rebuilding")
+        return None
+    cols = [read_npy(d / f"{name}.npy", tc, mmap) for name, tc, _ in COLUMNS]
+    if any(len(c) != manifest.get("rows") for c in cols):
+        print(f"[v0] Column files in {d} disagree with the manifest; rebuilding")
+        return None
+    return Interactions(*cols, source="npy")
+
+def _parse_csv(csv_path: Path, build: bool, default_value: float = 0.0):
+    writer = ColumnWriter(csv_path) if build else None
+    bufs = [array(tc) for _, tc, _ in COLUMNS]
+    skipped = filled = 0
+    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                uid = int(row.get("user_id") or row.get("userId"))
+                mid = int(row.get("movie_id") or row.get("movieId") or row.get("item_id"))
+                raw = row.get("value") or row.get("rating")
+                val = float(raw) if raw else default_value
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            filled += not raw
+            ts = ts_epoch(row.get("ts") or row.get("timestamp"))
+            bufs[0].append(uid); bufs[1].append(mid); bufs[2].append(val); bufs[3].append(ts)
+            if writer:
+                writer.append(uid, mid, val, ts)
+    if skipped:
+        print(f"[v0] {csv_path}: skipped {skipped} rows without integer ids or a numeric value")
+    if writer:
+        if filled:
+            writer.default_value = default_value
+        writer.close()
+    if np is not None:
+        bufs = [np.frombuffer(b, dtype=d) if len(b) else np.zeros(0, dtype=d) for b, (_, _, d) in zip(bufs, COLUMNS)]
+    return Interactions(*bufs, source="csv")
+
+def load(csv_path=DEFAULT_CSV, mmap: bool = True, build: bool = True, default_value: float = 0.0) -> Interactions:
+    """Columns for csv_path: the .npy cache when it is current, else a CSV parse (which also writes the cache
+    unless build=False). default_value fills empty value cells in a CSV parse."""
+    csv_path = Path(csv_path)
+    t0 = time.time()
+    cols = _load_columns(csv_path, mmap, default_value)
+    if cols is None:
+        if not csv_path.exists():
+            raise FileNotFoundError(f"{csv_path} not found. Run an 01_ingest_* script first.")
+        cols = _parse_csv(csv_path, build, default_value)
+    print(f"[v0] Loaded {len(cols)} interactions from {cols.source} in {time.time() - t0:.2f}s")
+    return cols
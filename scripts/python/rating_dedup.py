@@ -0,0 +1,188 @@
+"""
+Last-write-wins dedup of (user_id, movie_id) rating rows before they are upserted.
+
+A batch that repeats a key makes PostgREST's on_conflict upsert fail ("ON
+CONFLICT DO UPDATE command cannot affect row a second time"). The upsert pool
+then halves it all the way down to single rows. Dropping the older copies first
+avoids those round trips.
+
+Keys are packed into one 64-bit int, (user_id << 32) | movie_id, as in
+delta_store. With numpy, one lexsort over (key, ts, position) keeps the last
+row per key (about 16 bytes per row). Without numpy, a dict keyed by the packed
+int holds the winning row index. Ties on ts go to the row that came later in the
+source. A missing ts loses to any real one.
+
+Streams cut into batches use StreamDedup. It keeps the latest ts per packed key
+across batches, so a row older than one already sent is dropped. With numpy the
+keys live in a few sorted runs that are merged as they grow, about 16 bytes per
+distinct key. dedup_csv() rewrites a processed CSV and its .npy columns when a
+later batch superseded a row that was already written.
+
+Usage:
+    rows, removed = rating_dedup.dedup_rows(rows, label="processed_interactions")
+
+    latest = rating_dedup.StreamDedup()
+    for batch in batches:                       # (user_id, movie_id, value, ts) tuples
+        keep, superseding = latest.keep(batch)
+"""
+
+import os
+import csv
+
+from array import array
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+import interactions_cache
+from delta_store import pack_key
+from interactions_cache import ts_epoch
+
+def latest_mask(user_ids, movie_ids, ts):
+    """Per-row keep flags (1 = latest row for its key) and the number of rows dropped.
+    ts holds epoch seconds, with TS_MISSING where unknown."""
+    n = len(user_ids)
+    if n == 0:
+        return bytearray(), 0
+    if np is not None:
+        keys = (np.asarray(user_ids, dtype=np.uint64) << np.uint64(32)) | np.asarray(movie_ids, dtype=np.uint64)
+        order = np.lexsort((np.arange(n), np.asarray(ts, dtype=np.int64), keys))
+        sk = keys[order]
+        last = np.ones(n, dtype=bool)
+        last[:-1] = sk[1:] != sk[:-1]
+        keep = np.zeros(n, dtype=np.uint8)
+        keep[order[last]] = 1
+        return bytearray(keep.tobytes()), n - int(last.sum())
+    latest = {}
+    for i in range(n):
+        k = pack_key((user_ids[i], movie_ids[i]))
+        j = latest.get(k)
+        if j is None or ts[i] >= ts[j]:
+            latest[k] = i
+    keep = bytearray(n)
+    for i in latest.values():
+        keep[i] = 1
+    return keep, n - len(latest)
+
+def dedup_rows(rows: list, user_field: str = "user_id", movie_field: str = "movie_id", ts_field: str = "ts",
+               label: str = None, quiet: bool = False):
+    """Return (rows without superseded duplicates, in source order; number removed)."""
+    if len(rows) < 2:
+        return rows, 0
+    uids = array("q", (int(r[user_field]) for r in rows))
+    mids = array("q", (int(r[movie_field]) for r in rows))
+    ts = array("q", (ts_epoch(r.get(ts_field)) for r in rows))
+    keep, removed = latest_mask(uids, mids, ts)
+    if not removed:
+        return rows, 0
+    if not quiet:
+        print(f"[v0] {label or 'ratings'}: removed {removed} duplicate ({user_field}, {movie_field}) rows, kept latest {ts_field}")
+    return [r for r, k in zip(rows, keep) if k], removed
+
+def dedup_tuples(tuples: list, label: str = None, quiet: bool = False):
+    """Same as dedup_rows for (user_id, movie_id, value, ts) tuples."""
+    if len(tuples) < 2:
+        return tuples, 0
+    keep, removed = latest_mask(array("q", (t[0] for t in tuples)), array("q", (t[1] for t in tuples)),
+                                array("q", (ts_epoch(t[3]) for t in tuples)))
+    if removed and not quiet:
+        print(f"[v0] {label or 'ratings'}: removed {removed} duplicate (user_id, movie_id) rows, kept latest ts")
+    return ([t for t, k in zip(tuples, keep) if k] if removed else tuples), removed
+
+class StreamDedup:
+    """Latest ts per (user_id, movie_id) over every batch seen so far."""
+
+    def __init__(self):
+        self._runs = []          # [(sorted uint64 keys, int64 ts)], oldest first (numpy)
+        self._latest = {}        # packed key -> ts (without numpy)
+        self.removed = 0         # rows dropped: older in their batch, or older than a row already kept
+        self.superseded = 0      # kept rows that replace a row kept in an earlier batch
+
+    def _lookup(self, keys):
+        prev = np.zeros(len(keys), dtype=np.int64)
+        found = np.zeros(len(keys), dtype=bool)
+        for rk, rt in reversed(self._runs):
+            i = np.minimum(np.searchsorted(rk, keys), len(rk) - 1)
+            hit = ~found & (rk[i] == keys)
+            prev[hit] = rt[i[hit]]
+            found |= hit
+        return prev, found
+
+    def _add(self, keys, ts):
+        o = np.argsort(keys, kind="stable")
+        self._runs.append((keys[o], ts[o]))
+        # Merge runs of similar size so a lookup searches O(log n) runs; the newer entry of a key wins
+        while len(self._runs) > 1 and len(self._runs[-2][0]) <= 2 * len(self._runs[-1][0]):
+            (k1, t1), (k2, t2) = self._runs.pop(-2), self._runs.pop()
+            k, t = np.concatenate((k1, k2)), np.concatenate((t1, t2))
+            o = np.argsort(k, kind="stable")
+            k, t = k[o], t[o]
+            last = np.ones(len(k), dtype=bool)
+            last[:-1] = k[1:] != k[:-1]
+            self._runs.append((k[last], t[last]))
+
+    def keep(self, tuples: list):
+        """(keep flags per tuple, number of kept rows that supersede an earlier batch's row) for a batch
+        of (user_id, movie_id, value, ts) tuples. Ties on ts go to the later row, as in latest_mask."""
+        if not tuples:
+            return bytearray(), 0
+        uids = array("q", (t[0] for t in tuples))
+        mids = array("q", (t[1] for t in tuples))
+        ts = array("q", (ts_epoch(t[3]) for t in tuples))
+        keep, removed = latest_mask(uids, mids, ts)
+        superseding = older = 0
+        if np is not None:
+            idx = np.flatnonzero(np.frombuffer(bytes(keep), dtype=np.uint8))
+            keys = ((np.asarray(uids, dtype=np.uint64) << np.uint64(32)) | np.asarray(mids, dtype=np.uint64))[idx]
+            kts = np.asarray(ts, dtype=np.int64)[idx]
+            prev, found = self._lookup(keys)
+            stale = found & (kts < prev)
+            for i in idx[stale].tolist():
+                keep[i] = 0
+            older = int(stale.sum())
+            superseding = int((found & ~stale).sum())
+            self._add(keys[~stale], kts[~stale])
+        else:
+            for i in range(len(tuples)):
+                if not keep[i]:
+                    continue
+                k = pack_key((uids[i], mids[i]))
+                prev = self._latest.get(k)
+                if prev is not None and ts[i] < prev:
+                    keep[i] = 0
+                    older += 1
+                    continue
+                superseding += prev is not None
+                self._latest[k] = ts[i]
+        self.removed += removed + older
+        self.superseded += superseding
+        return keep, superseding
+
+def dedup_csv(csv_path, label: str = None) -> int:
+    """Keep only the latest row per (user_id, movie_id) in a processed interactions CSV and rewrite its
+    .npy columns; rows keep their order. Returns the number of rows removed."""
+    cols = interactions_cache.load(csv_path)
+    keep, removed = latest_mask(cols.user_id, cols.movie_id, cols.ts)
+    if not removed:
+        return 0
+    tmp = f"{csv_path}.tmp"
+    with open(csv_path, "r", newline="", encoding="utf-8") as src, open(tmp, "w", newline="", encoding="utf-8") as dst:
+        r, w = csv.reader(src), csv.writer(dst)
+        w.writerow(next(r))
+        for row, k in zip(r, keep):
+            if k:
+                w.writerow(row)
+    os.replace(tmp, csv_path)
+    if np is not None:
+        mask = np.frombuffer(bytes(keep), dtype=np.uint8).astype(bool)
+        kept = [np.asarray(c)[mask] for c in (cols.user_id, cols.movie_id, cols.value, cols.ts)]
+    else:
+        kept = [array(tc, (v for v, k in zip(c, keep) if k))
+                for c, (_, tc, _) in zip((cols.user_id, cols.movie_id, cols.value, cols.ts), interactions_cache.COLUMNS)]
+    del cols
+    with interactions_cache.ColumnWriter(csv_path) as w:
+        w.append_columns(*kept)
+    print(f"[v0] {label or csv_path}: removed {removed} rows superseded by a later batch, kept latest ts")
+    return removed
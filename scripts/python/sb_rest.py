@@ -0,0 +1,439 @@
+"""
+Shared Supabase REST client for the pipeline scripts (stdlib only).
+
+Every request goes through a per-host pool of persistent http.client
+connections, so a run with thousands of batches pays for a handful of TCP+TLS
+handshakes instead of one per call. The pool is thread-safe (UpsertPool workers
+each check out their own connection) and counts opened vs reused connections.
+An idle socket the server has already closed is discarded before reuse. If a
+reused socket still fails, the request goes out once more on a fresh one, but
+only if it never reached the server or is safe to resend (see below).
+
+Bodies are gzipped in both directions. Every request advertises
+Accept-Encoding: gzip and gzip responses are inflated before callers see them.
+Request bodies of SB_REST_GZIP_MIN_BYTES or more are sent with
+Content-Encoding: gzip. If a host rejects a compressed body (415, or a 400
+saying the body could not be parsed), the request is resent uncompressed, after
+taking its own token from the bucket, and that host gets plain bodies from then on. Raw vs on-the-wire byte counts are
+kept for both directions.
+
+Every request first takes a token from a client-wide TokenBucket
+(SB_REST_RATE requests/s; unlimited by default). A 429 pauses the bucket for
+the server's Retry-After, so all threads back off together instead of each
+sleeping on its own. It also caps the rate at half of what was being sent, so
+the threads do not stampede again when the pause ends. The cap then grows back
+by about one request/s per second of successful traffic. 429 responses are retried with
+exponential backoff and full jitter, honouring Retry-After. So are 502, 503 and 504
+responses, timeouts and dropped connections, but only when resending is safe, because
+the server may already have applied the write: GET/HEAD, upserts
+(Prefer: resolution=...) and RPC calls. A plain 500 is not retried, because
+PostgREST uses it for deterministic SQL errors.
+
+All counts are printed at exit, or on demand with log_stats().
+
+Usage:
+    rest = sb_rest.client()
+    rows = rest.json("GET", "/rest/v1/raw_movies", params={"select": "movie_id,title"})
+    resp = rest.request("POST", "/rest/v1/raw_links", body=batch, headers={"Prefer": "return=minimal"})
+
+Env:
+- SUPABASE_URL (or NEXT_PUBLIC_SUPABASE_URL), SUPABASE_SERVICE_ROLE_KEY
+- SB_REST_MAX_IDLE        idle connections kept per host (default 8)
+- SB_REST_GZIP            set to 0 to disable compression entirely (default 1)
+- SB_REST_GZIP_MIN_BYTES  smallest request body worth compressing (default 1024)
+- SB_REST_GZIP_LEVEL      compression level for request bodies (default 5)
+- SB_REST_RATE            max requests per second across all threads (default 0 = unlimited)
+- SB_REST_BURST           token bucket size (default: max(1, rate))
+- SB_REST_RETRIES         retries per request for transient failures (default 5)
+- SB_REST_BACKOFF_BASE    first backoff ceiling in seconds (default 0.5)
+- SB_REST_BACKOFF_MAX     backoff ceiling in seconds (default 30)
+"""
+
+import os
+import gzip
+import select
+import json
+import time
+import atexit
+import random
+import threading
+import http.client
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib import parse
+
+MAX_IDLE = int(os.environ.get("SB_REST_MAX_IDLE") or 8)
+GZIP = os.environ.get("SB_REST_GZIP", "1") != "0"
+GZIP_MIN_BYTES = int(os.environ.get("SB_REST_GZIP_MIN_BYTES") or 1024)
+GZIP_LEVEL = int(os.environ.get("SB_REST_GZIP_LEVEL") or 5)
+
+RATE = float(os.environ.get("SB_REST_RATE") or 0)
+BURST = float(os.environ.get("SB_REST_BURST") or 0)
+RETRIES = int(os.environ.get("SB_REST_RETRIES") or 5)
+BACKOFF_BASE = float(os.environ.get("SB_REST_BACKOFF_BASE") or 0.5)
+BACKOFF_MAX = float(os.environ.get("SB_REST_BACKOFF_MAX") or 30)
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Substrings of a 400 body meaning the server tried to read gzip bytes as JSON.
+_UNREADABLE_BODY = ("Empty or invalid json", "Error in $", "invalid byte sequence", "Failed to parse")
+
+# Errors that mean a kept-alive socket was closed by the server between requests.
+_STALE = (http.client.RemoteDisconnected, http.client.CannotSendRequest, http.client.BadStatusLine,
+          BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+class RestError(RuntimeError):
+    """HTTP status >= 400 (code set) or a transport failure (code None)."""
+
+    def __init__(self, msg: str, code: int = None, reason: str = "", url: str = "", body: str = ""):
+        super().__init__(msg)
+        self.code, self.reason, self.url, self.body = code, reason, url, body
+
+class Response:
+    __slots__ = ("status", "reason", "headers", "body")
+
+    def __init__(self, status: int, reason: str, headers, body: bytes):
+        self.status, self.reason, self.headers, self.body = status, reason, headers, body
+
+    def getcode(self) -> int:
+        return self.status
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace") if self.body else ""
+
+    def json(self):
+        """Parsed JSON body; falls back to the raw text, or None for an empty body."""
+        txt = self.text()
+        if not txt:
+            return None
+        try:
+            return json.loads(txt)
+        except json.JSONDecodeError:
+            return txt
+
+def _dropped(conn) -> bool:
+    # An idle keep-alive socket that is readable has been closed by the server (or holds stray bytes).
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+class ConnectionPool:
+    """LIFO pool of idle keep-alive connections for one scheme://host:port."""
+
+    def __init__(self, scheme: str, host: str, port: int, stats: dict, max_idle: int = MAX_IDLE):
+        self.scheme, self.host, self.port = scheme, host, port
+        self.max_idle = max_idle
+        self.stats = stats
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self, timeout: float):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None or not _dropped(conn):
+                break
+            conn.close()
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            conn = cls(self.host, self.port, timeout=timeout)
+            _bump(self.stats, "connections_opened")
+            return conn, False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for c in idle:
+            c.close()
+
+class TokenBucket:
+    """Client-wide request pacing. rate <= 0 means unlimited, but pause() windows (from 429s) still apply."""
+
+    def __init__(self, rate: float = RATE, burst: float = BURST):
+        self.limit = rate          # configured ceiling; <= 0 = none
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._granted = deque(maxlen=64)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Block until a request may go out; returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate <= 0:
+                    self._granted.append(now)
+                    return waited
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self._granted.append(now)
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def throttled(self, seconds: float):
+        """A 429: hold every caller for `seconds`, then resume at half the recently observed rate."""
+        with self._lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            g = self._granted
+            observed = (len(g) - 1) / (g[-1] - g[0]) if len(g) > 1 and g[-1] > g[0] else 2.0
+            rate = max(1.0, observed / 2)
+            if self.rate <= 0 or rate < self.rate:
+                self.rate, self.burst, self.tokens = rate, 1.0, 0.0
+                self.updated = self.paused_until
+                g.clear()
+
+    def succeeded(self):
+        # Additive increase: roughly +1 request/s per second of successful traffic
+        if self.rate > 0 and (self.limit <= 0 or self.rate < self.limit):
+            with self._lock:
+                self.rate += 1.0 / self.rate
+                if self.limit > 0:
+                    self.rate = min(self.rate, self.limit)
+
+def _retry_after(headers) -> float:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    v = headers.get("Retry-After") if headers is not None else None
+    if not v:
+        return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(v).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: uniform over [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+def _resend_is_safe(method: str, path: str, hdrs: dict) -> bool:
+    # After a timeout the server may have applied the request; only resend what is idempotent.
+    return method in ("GET", "HEAD") or "resolution=" in (hdrs.get("Prefer") or "") or "/rpc/" in path
+
+_stats_lock = threading.Lock()
+
+def _bump(stats: dict, key: str, n: int = 1):
+    with _stats_lock:
+        stats[key] = stats.get(key, 0) + n
+
+class RestClient:
+    def __init__(self, base_url: str = None, key: str = None, timeout: float = 120):
+        self.base_url = (base_url or os.environ.get("SUPABASE_URL") or os.environ.get("NEXT_PUBLIC_SUPABASE_URL") or "").rstrip("/")
+        self.key = key if key is not None else os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+        self.timeout = timeout
+        self.stats = {"requests": 0, "connections_opened": 0, "connections_reused": 0, "stale_retries": 0,
+                      "sent_raw_bytes": 0, "sent_wire_bytes": 0, "recv_raw_bytes": 0, "recv_wire_bytes": 0,
+                      "gzip_fallbacks": 0, "retries": 0, "throttled": 0, "wait_ms": 0}
+        self.gzip = GZIP
+        self.bucket = TokenBucket()
+        self.retries = RETRIES
+        self._plain_hosts = set()           # hosts that rejected gzip request bodies
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, scheme: str, host: str, port: int) -> ConnectionPool:
+        k = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(k)
+            if pool is None:
+                pool = self._pools[k] = ConnectionPool(scheme, host, port, self.stats)
+            return pool
+
+    def _url(self, path: str, params=None) -> str:
+        url = path if path.startswith(("http://", "https://")) else f"{self.base_url}{path}"
+        if params:
+            q = parse.urlencode(params, doseq=True)
+            url = f"{url}{'&' if '?' in url else '?'}{q}"
+        return url
+
+    def default_headers(self) -> dict:
+        return {"apikey": self.key, "Authorization": f"Bearer {self.key}"} if self.key else {}
+
+    def _send(self, pool: ConnectionPool, method: str, target: str, data, hdrs: dict, url: str, timeout: float):
+        for attempt in (0, 1):
+            conn, reused = pool.get(timeout)
+            sent = False
+            try:
+                conn.request(method, target, body=data, headers=hdrs)
+                sent = True
+                resp = conn.getresponse()
+                payload = resp.read()
+            except _STALE as e:
+                conn.close()
+                if reused and attempt == 0 and (not sent or _resend_is_safe(method, target.split("?")[0], hdrs)):
+                    # The server dropped an idle keep-alive socket; retry once on a fresh one. Once the request
+                    # was fully sent the server may have applied it, so only idempotent requests go again.
+                    _bump(self.stats, "stale_retries")
+                    continue
+                raise RestError(f"[v0] URL error {url} :: {e}", url=url) from e
+            except OSError as e:
+                conn.close()
+                raise RestError(f"[v0] URL error {url} :: {e}", url=url) from e
+            if reused:
+                _bump(self.stats, "connections_reused")
+            if resp.will_close:
+                conn.close()
+            else:
+                pool.put(conn)
+            return resp, payload
+
+    def _inflate(self, resp, payload: bytes) -> bytes:
+        _bump(self.stats, "recv_wire_bytes", len(payload))
+        if payload and (resp.headers.get("Content-Encoding") or "").lower() == "gzip":
+            payload = gzip.decompress(payload)
+        _bump(self.stats, "recv_raw_bytes", len(payload))
+        return payload
+
+    def request(self, method: str, path: str, body=None, params=None, headers=None, timeout: float = None,
+                retries: int = None) -> Response:
+        """Send one request on a pooled connection. body may be bytes or any JSON-serializable value.
+        Transient failures are retried up to `retries` times (default SB_REST_RETRIES)."""
+        url = self._url(path, params)
+        u = parse.urlsplit(url)
+        port = u.port or (443 if u.scheme == "https" else 80)
+        target = u.path + (f"?{u.query}" if u.query else "")
+        hdrs = self.default_headers()
+        if self.gzip:
+            hdrs["Accept-Encoding"] = "gzip"
+        data = wire = None
+        if body is not None:
+            data = body if isinstance(body, (bytes, bytearray)) else json.dumps(body).encode("utf-8")
+            hdrs["Content-Type"] = "application/json"
+        hdrs.update(headers or {})
+        compress = (data is not None and self.gzip and len(data) >= GZIP_MIN_BYTES
+                    and u.hostname not in self._plain_hosts and "Content-Encoding" not in hdrs)
+        if compress:
+            wire = gzip.compress(data, compresslevel=GZIP_LEVEL)
+            hdrs["Content-Encoding"] = "gzip"
+        pool = self._pool(u.scheme, u.hostname, port)
+        _bump(self.stats, "requests")
+        if data is not None:
+            _bump(self.stats, "sent_raw_bytes", len(data))
+            _bump(self.stats, "sent_wire_bytes", len(wire if compress else data))
+
+        max_retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire()
+            if waited:
+                _bump(self.stats, "wait_ms", int(waited * 1000))
+            try:
+                resp, payload = self._send(pool, method, target, wire if compress else data, hdrs, url, timeout or self.timeout)
+            except RestError as e:
+                if attempt >= max_retries or not _resend_is_safe(method, u.path, hdrs):
+                    raise
+                delay = _backoff(attempt)
+                attempt += 1
+                _bump(self.stats, "retries")
+                print(f"[v0] {method} {u.path}: {e.__cause__ or e}; retry {attempt}/{max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            # A 502/504 may come after the upstream applied the write; 429 was never processed.
+            if (resp.status in RETRY_STATUSES and attempt < max_retries
+                    and (resp.status == 429 or _resend_is_safe(method, u.path, hdrs))):
+                payload = self._inflate(resp, payload)
+                ra = _retry_after(resp.headers)
+                delay = max(ra or 0.0, _backoff(attempt))
+                if resp.status == 429:
+                    # Throttled: hold every thread sharing this client, not just this one.
+                    _bump(self.stats, "throttled")
+                    self.bucket.throttled(delay)
+                attempt += 1
+                _bump(self.stats, "retries")
+                print(f"[v0] {method} {u.path}: HTTP {resp.status}; retry {attempt}/{max_retries} in {delay:.1f}s")
+                if resp.status != 429:
+                    time.sleep(delay)
+                continue
+            break
+        if resp.status < 400:
+            self.bucket.succeeded()
+        payload = self._inflate(resp, payload)
+        if compress and (resp.status == 415 or (resp.status == 400 and any(m in payload.decode("utf-8", errors="ignore") for m in _UNREADABLE_BODY))):
+            # This host does not accept compressed request bodies; resend plain and stop compressing for it.
+            with self._lock:
+                self._plain_hosts.add(u.hostname)
+            _bump(self.stats, "gzip_fallbacks")
+            _bump(self.stats, "requests")
+            _bump(self.stats, "sent_wire_bytes", len(data))
+            del hdrs["Content-Encoding"]
+            waited = self.bucket.acquire()
+            if waited:
+                _bump(self.stats, "wait_ms", int(waited * 1000))
+            resp, payload = self._send(pool, method, target, data, hdrs, url, timeout or self.timeout)
+            payload = self._inflate(resp, payload)
+
+        if resp.status >= 400:
+            msg = payload.decode("utf-8", errors="ignore")
+            raise RestError(f"[v0] HTTP {resp.status} {resp.reason} {url} :: {msg}", code=resp.status,
+                            reason=resp.reason, url=url, body=msg)
+        return Response(resp.status, resp.reason, resp.headers, payload)
+
+    def json(self, method: str, path: str, body=None, params=None, headers=None, timeout: float = None, retries: int = None):
+        return self.request(method, path, body=body, params=params, headers=headers, timeout=timeout, retries=retries).json()
+
+    def log_stats(self):
+        s = dict(self.stats)
+        if not s["requests"]:
+            return
+        reuse = s["connections_reused"] / s["requests"]
+        print(f"[v0] REST: {s['requests']} requests over {s['connections_opened']} connections "
+              f"(reused {s['connections_reused']}, {reuse:.0%}; stale retries {s['stale_retries']})")
+        if s["sent_raw_bytes"] or s["recv_raw_bytes"]:
+            print(f"[v0] REST bytes: sent {_mb(s['sent_wire_bytes'])} on the wire for {_mb(s['sent_raw_bytes'])} raw, "
+                  f"received {_mb(s['recv_wire_bytes'])} for {_mb(s['recv_raw_bytes'])} raw"
+                  f"{'; gzip fallbacks ' + str(s['gzip_fallbacks']) if s['gzip_fallbacks'] else ''}")
+        if s["retries"] or s["wait_ms"]:
+            print(f"[v0] REST retries: {s['retries']} ({s['throttled']} throttled by 429), "
+                  f"{s['wait_ms'] / 1000:.1f}s waiting on the rate limiter (summed over threads)")
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for p in pools:
+            p.close()
+
+def _mb(n: int) -> str:
+    return f"{n / (1 << 20):.1f} MiB"
+
+_client = None
+_client_lock = threading.Lock()
+
+def client() -> RestClient:
+    """Process-wide shared client, created on first use from the environment."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RestClient()
+            atexit.register(_client.log_stats)
+        return _client
+
+def log_stats():
+    if _client is not None:
+        _client.log_stats()
@@ -0,0 +1,169 @@
+"""
+Per-movie rating statistics and Bayesian (shrunk) scores over id columns.
+
+Every trainer scores a movie the same way: its mean rating shrunk toward a
+prior mean by m virtual votes,
+    score = (count * mean + m * prior) / (count + m)
+with the global mean as the prior (03_train_baseline uses a fixed 3.5). Each
+one used to accumulate per-movie sums and counts in dicts, one interaction at a
+time, which was the CPU hot spot of a training run. movie_stats() does it with
+two np.bincount passes over the movie_id column. Small non-negative ids (all
+MovieLens ids) index the bins directly; anything else is encoded with
+np.unique first. Without numpy, one dict pass gives the same results.
+
+first_seen gives the row where each movie first appears in the input. Ranking
+ties on score by it keeps the order the dict loops produced, since they listed
+movies in insertion order.
+
+scores() takes one prior weight or a vector of them. A vector gives one row of
+scores per weight from the same counts, so priors can be compared without
+re-reading the data. Weights in use: 02_train_from_db 20, 02_train_and_upsert
+25, 02_train_from_db_final/_resilient/_verified 50, 03_train_baseline 10.
+
+Usage:
+    st = scoring.movie_stats(t.movie_id, t.value)
+    s = st.scores(50)                  # aligned with st.movie_id
+    s = st.scores([10, 20, 25, 50])    # shape (4, movies)
+    by_movie = st.score_map(50)        # {movie_id: score} of Python floats
+
+    python scripts/python/scoring.py [--csv PATH] [--m 10 20 25 50]
+        times the engine against the dict loop and compares the top 20 per prior
+"""
+
+import time
+from array import array
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+PRIORS = (10.0, 20.0, 25.0, 50.0)
+_DIRECT_BINS = 1 << 22   # ids below this (or 4x the row count) are used as bincount bins as-is
+
+def _tolist(a):
+    return a.tolist() if hasattr(a, "tolist") else list(a)
+
+def shrink(count, mean, m, prior):
+    """Bayesian average per movie; m may be a vector of prior weights (one row per weight)."""
+    if np is not None:
+        c = np.asarray(count, dtype=np.float64)
+        a = np.asarray(mean, dtype=np.float64)
+        w = np.asarray(m, dtype=np.float64)
+        if w.ndim:
+            w = w[:, None]
+        return (c * a + w * prior) / (c + w)
+    if isinstance(m, (list, tuple)):
+        return [shrink(count, mean, w, prior) for w in m]
+    return array("d", ((c * a + m * prior) / (c + m) for c, a in zip(count, mean)))
+
+class MovieStats:
+    def __init__(self, movie_id, count, total, value_sum: float, n: int, default_mean: float = None,
+                 first_seen=None, bins=None):
+        self.movie_id = movie_id      # sorted, unique
+        self.count = count
+        self.sum = total
+        self.n = n
+        self.global_mean = value_sum / n if n else default_mean
+        self._first = first_seen
+        self._bins = bins             # (bin per row, True when the bins are the movie ids), for first_seen
+
+    def __len__(self):
+        return len(self.movie_id)
+
+    @property
+    def mean(self):
+        if np is not None:
+            return self.sum / self.count
+        return array("d", (s / c for s, c in zip(self.sum, self.count)))
+
+    @property
+    def first_seen(self):
+        """Row position of each movie's first interaction, aligned with movie_id."""
+        if self._first is None:
+            bins, direct = self._bins
+            first = np.full(int(bins.max()) + 1 if len(bins) else 0, self.n, dtype=np.int64)
+            np.minimum.at(first, bins, np.arange(len(bins), dtype=np.int64))
+            self._first = first[self.movie_id] if direct else first
+        return self._first
+
+    def scores(self, m, prior: float = None):
+        return shrink(self.count, self.mean, m, self.global_mean if prior is None else prior)
+
+    def score_map(self, m, prior: float = None) -> dict:
+        return dict(zip(_tolist(self.movie_id), _tolist(self.scores(m, prior))))
+
+def _encode(mid):
+    """(unique ids, bin per row or None when the ids are the bins)."""
+    n = len(mid)
+    if n and int(mid.min()) >= 0 and int(mid.max()) < max(_DIRECT_BINS, 4 * n):
+        return None, None
+    ids, inv = np.unique(mid, return_inverse=True)
+    return ids, inv
+
+def movie_stats(movie_id, value, default_mean: float = None) -> MovieStats:
+    """Counts, sums and means per movie plus the global mean, from equal-length id and value columns."""
+    if np is None:
+        counts, sums, first = {}, {}, {}
+        for i, (mid, v) in enumerate(zip(movie_id, value)):
+            mid = int(mid)
+            if mid not in counts:
+                first[mid] = i
+            counts[mid] = counts.get(mid, 0) + 1
+            sums[mid] = sums.get(mid, 0.0) + v
+        ids = sorted(counts)
+        return MovieStats(array("q", ids), array("q", (counts[i] for i in ids)), array("d", (sums[i] for i in ids)),
+                          sum(sums.values()), len(movie_id), default_mean, array("q", (first[i] for i in ids)))
+    mid = np.asarray(movie_id)
+    val = np.asarray(value, dtype=np.float64)
+    ids, inv = _encode(mid)
+    if ids is None:
+        count = np.bincount(mid)
+        total = np.bincount(mid, weights=val)
+        ids = np.flatnonzero(count)
+        count, total = count[ids], total[ids]
+        bins = (mid, True)
+    else:
+        count = np.bincount(inv, minlength=len(ids))
+        total = np.bincount(inv, weights=val, minlength=len(ids))
+        bins = (inv, False)
+    return MovieStats(ids, count, total, float(val.sum()), len(mid), default_mean, bins=bins)
+
+def _dict_loop(movie_id, value, m):
+    # What each trainer did before: dict accumulation, then one score per movie
+    s, c = {}, {}
+    for mid, v in zip(_tolist(movie_id), _tolist(value)):
+        s[mid] = s.get(mid, 0.0) + v
+        c[mid] = c.get(mid, 0) + 1
+    g = sum(s.values()) / sum(c.values())
+    return {mid: (c[mid] * (s[mid] / c[mid]) + m * g) / (c[mid] + m) for mid in c}
+
+if __name__ == "__main__":
+    import argparse
+    import interactions_cache
+    ap = argparse.ArgumentParser(description="Time the scoring engine and compare prior weights.")
+    ap.add_argument("--csv", default=str(interactions_cache.DEFAULT_CSV))
+    ap.add_argument("--m", type=float, nargs="+", default=list(PRIORS))
+    args = ap.parse_args()
+    cols = interactions_cache.load(args.csv)
+
+    t0 = time.perf_counter()
+    old = [_dict_loop(cols.movie_id, cols.value, w) for w in args.m]
+    t_old = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    st = movie_stats(cols.movie_id, cols.value)
+    grid = st.scores(args.m)
+    t_new = time.perf_counter() - t0
+    print(f"[v0] {len(cols)} interactions, {len(st)} movies, {len(args.m)} priors: "
+          f"dict loop {t_old:.2f}s, engine {t_new:.3f}s ({t_old / max(t_new, 1e-9):.0f}x)")
+
+    ids = _tolist(st.movie_id)
+    tops = []
+    for w, row, ref in zip(args.m, grid, old):
+        row = _tolist(row)
+        drift = max(abs(row[i] - ref[mid]) for i, mid in enumerate(ids))
+        top = sorted(range(len(ids)), key=lambda i: -row[i])[:20]
+        tops.append({ids[i] for i in top})
+        print(f"[v0] m={w:g}: max |engine - dict loop| {drift:.2e}; top 3 {[ids[i] for i in top[:3]]}")
+    for w, top in zip(args.m[1:], tops[1:]):
+        print(f"[v0] top 20 shared between m={args.m[0]:g} and m={w:g}: {len(tops[0] & top)}")
@@ -0,0 +1,186 @@
+"""
+Local content cache for the MovieLens source CSVs used by the 01_ingest_* scripts.
+
+Files live under scripts/tmp/cache, keyed by URL. manifest.json keeps the ETag,
+Last-Modified, size and SHA-256 of every cached file, so a re-run sends one
+conditional GET per source and an unchanged file costs a single 304 round trip.
+iter_csv_rows() parses a fresh download while it is still arriving, so callers
+never need the whole file in memory.
+
+Env:
+- SOURCE_CACHE_DIR     override the cache directory (default scripts/tmp/cache)
+- SOURCE_CACHE_VERIFY  set to 1 to re-hash cached files before trusting them
+"""
+
+import io
+import os
+import csv
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib import request, error
+
+CACHE_DIR = Path(os.environ.get("SOURCE_CACHE_DIR") or "scripts/tmp/cache")
+MANIFEST_PATH = CACHE_DIR / "manifest.json"
+CHUNK_BYTES = 1 << 20
+
+_manifest_lock = threading.Lock()
+_inflight = {}  # url -> Future[Path] started by prefetch() in this process
+
+def _cache_name(url: str) -> str:
+    base = url.rsplit("/", 1)[-1].split("?", 1)[0] or "source"
+    return f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}-{base}"
+
+def _load_manifest() -> dict:
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _save_manifest(manifest: dict):
+    tmp = MANIFEST_PATH.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, MANIFEST_PATH)
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_BYTES), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _entry_is_valid(entry: dict, verify: bool) -> bool:
+    path = CACHE_DIR / entry.get("file", "")
+    if not path.is_file() or path.stat().st_size != entry.get("size"):
+        return False
+    return not verify or sha256_file(path) == entry.get("sha256")
+
+def _conditional_open(url: str, timeout: int, force: bool):
+    """Return (cached_path, None) when the cached copy is current, else (None, response)."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    verify = os.environ.get("SOURCE_CACHE_VERIFY") == "1"
+    with _manifest_lock:
+        entry = _load_manifest().get(url)
+    if entry and not force and not _entry_is_valid(entry, verify):
+        print(f"[v0] Cache entry for {url} is stale or corrupt; refetching")
+        entry = None
+
+    req = request.Request(url, method="GET")
+    if entry and not force:
+        if entry.get("etag"): req.add_header("If-None-Match", entry["etag"])
+        if entry.get("last_modified"): req.add_header("If-Modified-Since", entry["last_modified"])
+
+    try:
+        return None, request.urlopen(req, timeout=timeout)
+    except error.HTTPError as e:
+        if e.code == 304 and entry:
+            print(f"[v0] Not modified (304), using cached {entry['file']}")
+            return CACHE_DIR / entry["file"], None
+        raise
+
+class _CacheWriter(io.RawIOBase):
+    """Readable wrapper over an HTTP response that copies every byte into the cache as it is read."""
+
+    def __init__(self, url: str, resp):
+        self.url, self.resp = url, resp
+        self.name = _cache_name(url)
+        self.dest = CACHE_DIR / self.name
+        self.part = self.dest.with_suffix(self.dest.suffix + ".part")
+        self.out = open(self.part, "wb")
+        self.sha = hashlib.sha256(); self.size = 0; self.done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        n = self.resp.readinto(buf)
+        if n:
+            view = memoryview(buf)[:n]
+            self.out.write(view); self.sha.update(view); self.size += n
+        elif not self.done:
+            self._commit()
+        return n
+
+    def _commit(self):
+        self.done = True
+        self.out.close()
+        os.replace(self.part, self.dest)
+        with _manifest_lock:
+            manifest = _load_manifest()
+            manifest[self.url] = {
+                "file": self.name,
+                "size": self.size,
+                "sha256": self.sha.hexdigest(),
+                "etag": self.resp.headers.get("ETag"),
+                "last_modified": self.resp.headers.get("Last-Modified"),
+            }
+            _save_manifest(manifest)
+        print(f"[v0] Downloaded {self.url} ({self.size} bytes, sha256 {self.sha.hexdigest()[:12]}…)")
+
+    def close(self):
+        if not self.closed:
+            self.resp.close()
+            if not self.done:
+                # Abandoned mid-stream: never publish a truncated file.
+                self.out.close()
+                self.part.unlink(missing_ok=True)
+        super().close()
+
+def _fetch(url: str, timeout: int, force: bool) -> Path:
+    path, resp = _conditional_open(url, timeout, force)
+    if path is not None:
+        return path
+    with _CacheWriter(url, resp) as w:
+        while w.read(CHUNK_BYTES):
+            pass
+    return w.dest
+
+def entry(url: str) -> dict:
+    """Manifest entry (file, size, sha256, etag, last_modified) for url, or None if not cached yet."""
+    with _manifest_lock:
+        return _load_manifest().get(url)
+
+def cached_fetch(url: str, timeout: int = 300, force: bool = False) -> Path:
+    """Return a local path holding the current contents of url, revalidating the cached copy."""
+    if url in _inflight and not force:
+        return _inflight[url].result()
+    return _fetch(url, timeout, force)
+
+def open_stream(url: str, timeout: int = 300, encoding: str = "utf-8", force: bool = False):
+    """Open url as a text stream. Fresh downloads are parsed as they arrive and cached on the way."""
+    if url in _inflight and not force:
+        path, resp = _inflight[url].result(), None
+    else:
+        path, resp = _conditional_open(url, timeout, force)
+    if path is not None:
+        return open(path, "r", newline="", encoding=encoding, errors="replace")
+    raw = io.BufferedReader(_CacheWriter(url, resp), buffer_size=CHUNK_BYTES)
+    return io.TextIOWrapper(raw, encoding=encoding, errors="replace", newline="")
+
+def iter_csv_rows(url: str, timeout: int = 300, encoding: str = "utf-8"):
+    """Yield csv.DictReader rows from url without holding the file in memory."""
+    with open_stream(url, timeout=timeout, encoding=encoding) as f:
+        for row in csv.DictReader(f):
+            yield row
+
+def prefetch(urls, timeout: int = 300, max_workers: int = 3) -> dict:
+    """Start downloading urls concurrently; returns {url: Future[Path]} without waiting.
+
+    Later cached_fetch / iter_csv_rows calls for the same url wait on the running
+    download instead of issuing their own request, so callers can keep their
+    sequential structure and still start on the first file while the rest arrive.
+    """
+    pending = [u for u in urls if u not in _inflight]
+    if pending:
+        ex = ThreadPoolExecutor(max_workers=min(max_workers, len(pending)), thread_name_prefix="source-fetch")
+        for u in pending:
+            _inflight[u] = ex.submit(_fetch, u, timeout, False)
+        ex.shutdown(wait=False)
+    return {u: _inflight[u] for u in urls}
+
+def cached_text(url: str, encoding: str = "utf-8", errors: str = "replace", timeout: int = 300) -> str:
+    return cached_fetch(url, timeout=timeout).read_bytes().decode(encoding, errors=errors)
@@ -0,0 +1,407 @@
+"""
+Parallel paged reads of PostgREST tables: keyset scans for keyed tables, Range windows otherwise.
+
+The trainers used to page through a table one round trip at a time. read_pages()
+asks for the first page with Prefer: count=planned. That gives the total in
+Content-Range ("0-9999/25000095"), and the remaining Range windows are then
+fetched by a small thread pool sharing sb_rest's keep-alive client. Pages are
+yielded in table order. At most `workers * 2` pages are in flight, so memory
+stays bounded no matter how large the table is.
+
+- count=planned is the planner's estimate, so it can be low. Past the estimate
+  the reader goes on one page at a time until a short page marks the end.
+- Servers cap the rows per response (db-max-rows; Supabase defaults to 1000).
+  A short first page that does not reach the total reveals the cap, and the
+  page size drops to it. Any range that still comes back short is finished
+  with follow-up requests.
+- Offset windows only partition a table when its order is fixed. Tables with a
+  unique key are ordered by it (ORDER_KEYS); pass order= for others.
+
+Tables with a unique key in ORDER_KEYS are read by keyset instead. Each request
+is ordered by the key (processed_interactions_user_movie_idx for user_id,
+movie_id), has limit=page, and continues after the last key seen:
+    or=(user_id.gt.U,and(user_id.eq.U,movie_id.gt.M))
+Every page is an index range scan, so deep pages cost the same as the first
+(an OFFSET has to walk past every skipped row). Rows that arrive mid-scan
+cannot shift page boundaries either. For parallelism, the first key column's
+min..max is cut into `workers` slices. Each slice is scanned on its own
+thread, and its pages are handed over through a two-page queue. Rows with a
+NULL key are never returned by a keyset scan; they are unusable to the
+trainers anyway. keyset=False, or an explicit order=, uses Range windows.
+
+fetch_columns() decodes each page into typed columns (column_table) and drops
+the page's dicts, so a 25M-row read holds 12 bytes per interaction rather than
+a dict per row.
+
+With fmt="csv" pages are requested as text/csv. A header line plus bare values
+is about a quarter of the bytes of a JSON array of objects that repeats every
+key on every row (the gap mostly closes once sb_rest gzips the response), and
+csv.reader parses it faster than json.loads. fetch_columns() reads CSV by
+default and feeds the strings straight into the typed column buffers.
+read_pages() defaults to JSON: turning CSV rows back into dicts happens in
+Python (the known numeric columns in CSV_TYPES, or types=, are cast, and empty
+fields become None), and that costs about twice the client CPU of json.loads.
+json/jsonb columns come back as text in CSV.
+
+Usage:
+    rows = table_reader.fetch_all("processed_interactions", "user_id,movie_id,value")
+    for page in table_reader.read_pages("raw_movies", "movie_id,title"): ...
+    t = table_reader.fetch_columns("processed_interactions")   # t.user_id, t.movie_id, t.value
+
+Benchmark (JSON vs CSV against fake_postgrest, no Supabase needed):
+    python scripts/python/table_reader.py --bench --rows 500000 --latency-ms 20
+
+Env:
+- SB_READ_WORKERS   concurrent page requests (default 4)
+- SB_READ_PAGE      rows per Range window (default 10000)
+- SB_READ_COUNT     Prefer count= mode for the total: planned, exact or estimated (default planned)
+- SB_READ_KEYSET    0 to read keyed tables with Range windows too (default 1)
+- SB_READ_FORMAT    csv or json for every read (default: csv for fetch_columns, json for dict reads)
+"""
+
+import io
+import os
+import csv
+import sys
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import sb_rest
+import column_table
+
+WORKERS = int(os.environ.get("SB_READ_WORKERS") or 4)
+PAGE = int(os.environ.get("SB_READ_PAGE") or 10000)
+COUNT = os.environ.get("SB_READ_COUNT") or "planned"
+KEYSET = (os.environ.get("SB_READ_KEYSET") or "1") != "0"
+FORMAT = os.environ.get("SB_READ_FORMAT")
+
+# Column types for CSV reads into dicts; other columns stay strings
+CSV_TYPES = {"user_id": int, "movie_id": int, "tmdb_id": int, "value": float, "rating": float, "score": float}
+
+# Unique keys from scripts/sql/013_add_unique_indexes.sql and the schema primary keys
+ORDER_KEYS = {
+    "processed_interactions": "user_id,movie_id",
+    "raw_ratings": "user_id,movie_id",
+    "raw_movies": "movie_id",
+    "raw_links": "movie_id",
+    "processed_movies": "movie_id",
+    "processed_links": "movie_id",
+    "recommendations": "user_id",
+}
+
+def _total(content_range: str):
+    # "0-9999/25000095" -> 25000095; "0-9999/*" or missing -> None
+    tail = (content_range or "").rpartition("/")[2]
+    return int(tail) if tail.isdigit() else None
+
+def _after(cols, last) -> dict:
+    # Row-value comparison (a, b) > (x, y) in PostgREST filter syntax
+    if len(cols) == 1:
+        return {cols[0]: f"gt.{last[0]}"}
+    terms = []
+    for i, c in enumerate(cols):
+        t = [f"{cols[j]}.eq.{last[j]}" for j in range(i)] + [f"{c}.gt.{last[i]}"]
+        terms.append(t[0] if len(t) == 1 else f"and({','.join(t)})")
+    return {"or": f"({','.join(terms)})"}
+
+def _row_converter(header, types: dict = None):
+    casts = [(name, (types or {}).get(name) or CSV_TYPES.get(name)) for name in header]
+
+    def convert(row):
+        return {name: None if v == "" else cast(v) if cast else v for (name, cast), v in zip(casts, row)}
+    return convert
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+class _Reader:
+    def __init__(self, table: str, select: str, params: dict, order: str, headers: dict, fmt: str = "json"):
+        self.path = f"/rest/v1/{table}"
+        self.params = {"select": select, **(params or {})}
+        if order:
+            self.params["order"] = order
+        self.headers = dict(headers or {})
+        self.csv = fmt == "csv"
+        if self.csv:
+            self.headers["Accept"] = "text/csv"
+        self.header = None      # CSV column names, from the first page
+        self.index = {}
+        self.requests = 0
+
+    def _parse_csv(self, text: str, params: dict):
+        rd = csv.reader(io.StringIO(text))
+        header = next(rd, None)
+        if header is None:
+            return []
+        if self.header is None and (params is None or params.get("select") == self.params["select"]):
+            self.header, self.index = header, {c: i for i, c in enumerate(header)}
+        return list(rd)
+
+    def key(self, row, cols) -> tuple:
+        return tuple(row[self.index[c]] for c in cols) if self.csv else tuple(row[c] for c in cols)
+
+    def get(self, lo: int = None, hi: int = None, count: str = None, params: dict = None):
+        """One request (a Range window when lo/hi are given); returns (rows, total from Content-Range or None)."""
+        hdrs = dict(self.headers)
+        if lo is not None:
+            hdrs.update({"Range-Unit": "items", "Range": f"{lo}-{hi}"})
+        if count:
+            hdrs["Prefer"] = f"count={count}"
+        self.requests += 1
+        try:
+            resp = sb_rest.client().request("GET", self.path, params=params or self.params, headers=hdrs)
+        except sb_rest.RestError as e:
+            if e.code == 416:   # window starts past the end
+                return [], None
+            raise
+        rows = self._parse_csv(resp.text(), params) if self.csv else resp.json() or []
+        return rows, _total(resp.headers.get("Content-Range"))
+
+    def window(self, lo: int, hi: int) -> list:
+        """All rows of lo..hi, following up when the server returns fewer than asked."""
+        rows = []
+        while lo <= hi:
+            got, _ = self.get(lo, hi)
+            rows.extend(got)
+            if not got or len(got) >= hi - lo + 1:
+                break
+            lo += len(got)
+        return rows
+
+    def bounds(self, col: str):
+        """(min, max) of col, or None for an empty table."""
+        lo, _ = self.get(params={"select": col, "order": f"{col}.asc", "limit": 1})
+        hi, _ = self.get(params={"select": col, "order": f"{col}.desc.nullslast", "limit": 1})
+        first = (lambda rows: rows[0][0]) if self.csv else (lambda rows: rows[0][col])
+        if not lo or first(lo) in (None, ""):
+            return None
+        return int(first(lo)), int(first(hi))
+
+    def scan(self, cols, page: int, lo: int = None, hi: int = None):
+        """Keyset scan of the rows with lo <= cols[0] < hi (all rows when lo is None); yields pages in key order."""
+        params = {**self.params, "order": ",".join(cols), "limit": page}
+        if lo is not None:
+            params["and"] = f"({cols[0]}.gte.{lo},{cols[0]}.lt.{hi})"
+        last, capped = None, False
+        while True:
+            rows, _ = self.get(params=params if last is None else {**params, **_after(cols, last)})
+            if not rows:
+                return
+            yield rows
+            if len(rows) < params["limit"]:
+                if capped:
+                    return
+                # The end, or a server-side row cap; the next request tells which
+                params["limit"], capped = len(rows), True
+            last = self.key(rows[-1], cols)
+
+def _read_keyset(r: _Reader, table: str, cols, page: int, workers: int):
+    t0 = time.time()
+    n = 0
+    b = r.bounds(cols[0]) if workers > 1 else None
+    if b is None or b[1] - b[0] < workers:
+        slices = [(None, None)]
+    else:
+        step = -(-(b[1] - b[0] + 1) // workers)
+        slices = [(lo, min(lo + step, b[1] + 1)) for lo in range(b[0], b[1] + 1, step)]
+    if len(slices) == 1:
+        for rows in r.scan(cols, page):
+            n += len(rows)
+            yield rows
+    else:
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=2) for _ in slices]
+
+        def run(q, lo, hi):
+            try:
+                for rows in r.scan(cols, page, lo, hi):
+                    if not _put(q, rows, stop):
+                        return
+                _put(q, None, stop)
+            except BaseException as e:
+                _put(q, e, stop)
+
+        with ThreadPoolExecutor(max_workers=len(slices), thread_name_prefix=f"scan-{table}") as ex:
+            for q, (lo, hi) in zip(queues, slices):
+                ex.submit(run, q, lo, hi)
+            try:
+                for q in queues:
+                    while True:
+                        item = q.get()
+                        if item is None:
+                            break
+                        if isinstance(item, BaseException):
+                            raise item
+                        n += len(item)
+                        yield item
+            finally:
+                stop.set()
+    dt = time.time() - t0
+    print(f"[v0] {table}: {n} rows in {r.requests} keyset requests ({len(slices)} slices, {dt:.1f}s"
+          f"{f', {n / dt:,.0f} rows/s' if dt > 0 else ''})")
+
+def _open(table: str, select: str, params: dict = None, page: int = None, workers: int = None,
+          order: str = None, count: str = None, headers: dict = None, keyset: bool = None, fmt: str = None):
+    """(reader, generator of raw pages): lists of dicts for JSON, lists of string lists for CSV."""
+    page = page or PAGE
+    workers = max(1, workers or WORKERS)
+    fmt = fmt or FORMAT or "json"
+    key = ORDER_KEYS.get(table)
+    if keyset is None:
+        keyset = KEYSET and order is None and not ({"or", "and", "order", "limit", "offset"} & set(params or {}))
+    if keyset and key:
+        cols = key.split(",")
+        if select != "*":
+            have = [c.strip() for c in select.split(",")]
+            select = ",".join(have + [c for c in cols if c not in have])
+        r = _Reader(table, select, params, None, headers, fmt)
+        return r, _read_keyset(r, table, cols, page, workers)
+    r = _Reader(table, select, params, key if order is None else order, headers, fmt)
+    return r, _read_ranges(r, table, page, workers, count)
+
+def _read_ranges(r: _Reader, table: str, page: int, workers: int, count: str):
+    t0 = time.time()
+    first, total = r.get(0, page - 1, count or COUNT)
+    if first:
+        yield first
+    n = len(first)
+    if n == 0 or (total is not None and n >= total):
+        print(f"[v0] {table}: {n} rows in 1 request")
+        return
+    if n < page:
+        if total is None:
+            print(f"[v0] {table}: {n} rows in 1 request")
+            return
+        page = n   # server-side row cap
+    inflight = deque()
+    nxt = n
+    done = False
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"read-{table}") as ex:
+        while True:
+            # Parallel within the counted total; one at a time beyond it (or without a count)
+            while not done and len(inflight) < workers * 2 and (total is not None and nxt < total or not inflight):
+                inflight.append(ex.submit(r.window, nxt, nxt + page - 1))
+                nxt += page
+            if not inflight:
+                break
+            rows = inflight.popleft().result()
+            if len(rows) < page:
+                done = True
+            if rows:
+                n += len(rows)
+                yield rows
+    dt = time.time() - t0
+    print(f"[v0] {table}: {n} rows in {r.requests} requests ({workers} workers, {dt:.1f}s"
+          f"{f', {n / dt:,.0f} rows/s' if dt > 0 else ''})")
+
+def read_pages(table: str, select: str, params: dict = None, page: int = None, workers: int = None,
+               order: str = None, count: str = None, headers: dict = None, keyset: bool = None,
+               fmt: str = None, types: dict = None):
+    """Yield the table's rows page by page, in order, as dicts. Keyed tables are read by keyset unless
+    keyset=False or order= is given; otherwise order=None uses ORDER_KEYS and order="" leaves rows
+    unordered. fmt is "csv" or "json" (default SB_READ_FORMAT, else json); types adds CSV column casts."""
+    r, pages = _open(table, select, params, page, workers, order, count, headers, keyset, fmt)
+    if not r.csv:
+        yield from pages
+        return
+    convert = None
+    for rows in pages:
+        if convert is None:
+            convert = _row_converter(r.header, types)
+        yield [convert(row) for row in rows]
+
+def fetch_all(table: str, select: str, **kw) -> list:
+    """All rows of table as a list of dicts (see read_pages for the keyword arguments)."""
+    out = []
+    for rows in read_pages(table, select, **kw):
+        out.extend(rows)
+    return out
+
+def count(table: str, params: dict = None, mode: str = "exact"):
+    """Rows matching params, from Content-Range (Prefer: count=mode); None if the server reports none."""
+    key = ORDER_KEYS.get(table)
+    r = _Reader(table, key.split(",")[0] if key else "*", params, None, None)
+    _, total = r.get(0, 0, mode)
+    return total
+
+def fetch_columns(table: str, spec=column_table.INTERACTIONS, **kw) -> column_table.ColumnTable:
+    """The spec's columns of table as a ColumnTable; keyword arguments as for read_pages."""
+    b = column_table.ColumnBuilder(spec)
+    kw["fmt"] = kw.get("fmt") or FORMAT or "csv"
+    r, pages = _open(table, ",".join(col[0] for col in spec), **kw)
+    fields = None
+    for rows in pages:
+        if r.csv and fields is None:
+            fields = [r.index[col[0]] for col in spec]
+        b.extend(rows, fields)
+    t = b.finish(table)
+    print(f"[v0] {table}: {len(t)} rows in {t.nbytes / 1048576:.1f} MiB of columns")
+    return t
+
+def _bench(rows: int, latency_ms: float, workers: int, page: int, port: int):
+    # The server runs in its own process, so client CPU time measures decoding alone
+    import random
+    import socket
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    srv = subprocess.Popen([sys.executable, os.path.join(here, "fake_postgrest.py"), "--port", str(port),
+                            "--latency-ms", str(latency_ms)], stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"] = f"http://127.0.0.1:{port}", "bench"
+        c = sb_rest.client()
+        rnd = random.Random(7)
+        users = max(1, rows // 100)
+        data = [{"user_id": i % users + 1, "movie_id": i // users + 1, "ts": "2015-03-01T12:00:00Z",
+                 "value": rnd.choice((0.5, 1.0, 2.5, 3.0, 3.5, 4.0, 5.0))} for i in range(rows)]
+        for i in range(0, rows, 50000):
+            c.request("POST", "/rest/v1/processed_interactions", body=data[i:i + 50000], headers={"Prefer": "return=minimal"})
+        del data
+        print(f"[v0] Seeded {rows} processed_interactions rows; latency {latency_ms} ms, {workers} workers, page {page}")
+        readers = (("fetch_all", lambda fmt: fetch_all("processed_interactions", "user_id,movie_id,value",
+                                                       fmt=fmt, page=page, workers=workers)),
+                   ("fetch_columns", lambda fmt: fetch_columns("processed_interactions", fmt=fmt,
+                                                               page=page, workers=workers)))
+        results = []
+        for label, fn in readers:
+            for fmt in ("json", "csv"):
+                before, wire = c.stats["recv_raw_bytes"], c.stats["recv_wire_bytes"]
+                t0, c0 = time.perf_counter(), time.process_time()
+                n = len(fn(fmt))
+                results.append((label, fmt, n, time.perf_counter() - t0, time.process_time() - c0,
+                                c.stats["recv_raw_bytes"] - before, c.stats["recv_wire_bytes"] - wire))
+    finally:
+        srv.terminate()
+        srv.wait()
+    print(f"{'reader':<14} {'fmt':<5} {'rows':>9} {'wall s':>7} {'client cpu s':>12} {'MiB':>6} {'gzip MiB':>8}")
+    for label, fmt, n, wall, cpu, nbytes, wbytes in results:
+        print(f"{label:<14} {fmt:<5} {n:>9} {wall:>7.2f} {cpu:>12.2f} {nbytes / 1048576:>6.1f} {wbytes / 1048576:>8.2f}")
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Benchmark JSON vs CSV table reads against fake_postgrest.")
+    ap.add_argument("--bench", action="store_true", help="run the benchmark")
+    ap.add_argument("--rows", type=int, default=200000)
+    ap.add_argument("--latency-ms", type=float, default=10)
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--page", type=int, default=PAGE)
+    ap.add_argument("--port", type=int, default=54329, help="port for the fake_postgrest subprocess")
+    args = ap.parse_args()
+    if not args.bench:
+        ap.print_help()
+        sys.exit(0)
+    _bench(args.rows, args.latency_ms, args.workers, args.page, args.port)
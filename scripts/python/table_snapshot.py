@@ -0,0 +1,149 @@
+"""
+Local snapshot of processed_interactions, refreshed incrementally.
+
+Each trainer run used to download all of processed_interactions. With a
+snapshot, the first run downloads it once, and later runs fetch only what is
+new and merge it in. The snapshot keeps a high-water mark on ts (the newest ts
+in the snapshot). A refresh reads rows with ts >= watermark and merges them
+last-write-wins on (user_id, movie_id), as rating_dedup does. Reading from the
+watermark inclusive picks up rows written in the same second as the last
+refresh. raw_movies and raw_links are kept the same way by catalog.py, keyed
+on the max movie_id.
+
+A watermark cannot see deleted rows, or rows ingested later with an older ts
+(MovieLens timestamps are rating times, not insert times). So after a refresh,
+the local row count is checked against the server's count=exact. A mismatch
+triggers a full refresh. Same-count edits still need one on demand: full=True, --full-refresh in the trainers, or
+SNAPSHOT_FULL_REFRESH=1. For the ts-filtered read, create the index in
+scripts/sql/015_add_interactions_ts_index.sql.
+
+Layout under scripts/tmp/snapshots/<sha256(SUPABASE_URL)[:12]>/:
+    processed_interactions.columns/        .npy columns + manifest (interactions_cache format)
+    processed_interactions.snapshot.json   watermark, row count, refreshed_at
+    raw_movies.catalog/                    catalog.py arrays for raw_movies + raw_links
+
+Usage:
+    inter = table_snapshot.interactions()        # ColumnTable: user_id, movie_id, value, ts
+
+Env:
+- SNAPSHOT_DIR            override the snapshot directory (default scripts/tmp/snapshots)
+- SNAPSHOT_FULL_REFRESH   1 to ignore existing snapshots and download everything
+"""
+
+import os
+import json
+import time
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+import column_table
+import interactions_cache
+import rating_dedup
+import table_reader
+from delta_store import scope
+
+STATE_DIR = Path(os.environ.get("SNAPSHOT_DIR") or "scripts/tmp/snapshots")
+FULL_REFRESH = os.environ.get("SNAPSHOT_FULL_REFRESH") == "1"
+
+INTERACTIONS_TS = column_table.INTERACTIONS + (("ts", "<i8", interactions_cache.ts_epoch),)
+
+def _dir() -> Path:
+    d = STATE_DIR / scope()
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+def _read_json(path: Path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _write_json(path: Path, obj):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def _iso(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+def _server_count_differs(table: str, local: int) -> bool:
+    n = table_reader.count(table)
+    if n is not None and n != local:
+        print(f"[v0] {table} snapshot: {local} rows locally but {n} on the server; doing a full refresh")
+        return True
+    return False
+
+def _concat(a, b):
+    if np is not None:
+        return np.concatenate((np.asarray(a), np.asarray(b)))
+    return array(a.typecode, a) + array(a.typecode, b)
+
+def _compress(col, keep: bytearray):
+    if np is not None:
+        return col[np.frombuffer(keep, dtype=bool)]
+    return array(col.typecode, (v for v, k in zip(col, keep) if k))
+
+def _merge(old: list, new: list):
+    """old + new columns (user_id, movie_id, value, ts), keeping the latest ts per key; new rows win ties."""
+    cols = [_concat(o, n) for o, n in zip(old, new)]
+    keep, removed = rating_dedup.latest_mask(cols[0], cols[1], cols[3])
+    if removed:
+        cols = [_compress(c, keep) for c in cols]
+    return cols, removed
+
+def _watermark(ts) -> int:
+    if not len(ts):
+        return None
+    wm = int(ts.max()) if np is not None else max(ts)
+    return None if wm == interactions_cache.TS_MISSING else wm
+
+def interactions(full: bool = None, table: str = "processed_interactions", verify: bool = True) -> column_table.ColumnTable:
+    """The table's (user_id, movie_id, value, ts) columns, refreshed from the server by ts watermark."""
+    d = _dir()
+    pseudo_csv = d / f"{table}.csv"          # never written; names the .columns directory
+    man_path = d / f"{table}.snapshot.json"
+    full = FULL_REFRESH if full is None else full
+    man = None if full else _read_json(man_path)
+    old = None
+    if man is not None and man.get("watermark") is not None:
+        try:
+            old = interactions_cache.load(pseudo_csv, build=False)
+        except FileNotFoundError:
+            old = None
+    if old is None or len(old) != man["rows"]:
+        if not full:
+            print(f"[v0] {table} snapshot: none usable, downloading the full table")
+        t = table_reader.fetch_columns(table, INTERACTIONS_TS)
+        cols, mode, changed = [t.user_id, t.movie_id, t.value, t.ts], "full", True
+    else:
+        since = man["watermark"]
+        t = table_reader.fetch_columns(table, INTERACTIONS_TS, params={"ts": f"gte.{_iso(since)}"})
+        old_cols = [old.user_id, old.movie_id, old.value, old.ts]
+        if len(t):
+            cols, replaced = _merge(old_cols, [t.user_id, t.movie_id, t.value, t.ts])
+            print(f"[v0] {table} snapshot: {len(t)} rows at or after {_iso(since)} "
+                  f"({len(t) - replaced} new, {replaced} already in the snapshot or updated)")
+        else:
+            cols, replaced = old_cols, 0
+            print(f"[v0] {table} snapshot: up to date at {_iso(since)}")
+        mode, changed = "incremental", len(t) > 0
+        if verify and _server_count_differs(table, len(cols[0])):
+            return interactions(full=True, table=table, verify=False)
+    if changed:
+        with interactions_cache.ColumnWriter(pseudo_csv) as w:
+            w.append_columns(*cols)
+        _write_json(man_path, {"table": table, "watermark": _watermark(cols[3]), "rows": len(cols[0]),
+                               "refreshed_at": _now(), "mode": mode})
+    return column_table.ColumnTable(dict(zip(("user_id", "movie_id", "value", "ts"), cols)),
+                                    source=f"snapshot:{mode}")
@@ -0,0 +1,48 @@
+"""
+Shared setup for the pipeline tests: puts scripts/python on sys.path and serves
+fake_postgrest on a free port with sb_rest pointed at it.
+
+Run from the repo root:
+    python -m unittest discover -s scripts/python/tests
+    python -m pytest scripts/python/tests
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import sb_rest
+import fake_postgrest
+
+class FakeSupabase:
+    """fake_postgrest in a background thread for the duration of a with-block."""
+
+    def __init__(self, **opts):
+        self.opts = opts
+
+    def __enter__(self):
+        self.server, self.url = fake_postgrest.serve_in_thread("127.0.0.1", **self.opts)
+        self._env = {k: os.environ.get(k) for k in ("SUPABASE_URL", "SUPABASE_SERVICE_ROLE_KEY")}
+        os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"] = self.url, "test"
+        self.client = sb_rest._client = sb_rest.RestClient(self.url, "test")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.client.close()
+        sb_rest._client = None
+        for k, v in self._env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        self.server.shutdown()
+        self.server.server_close()
+        return False
+
+    def seed(self, table: str, rows: list):
+        self.client.request("POST", f"/rest/v1/{table}", body=rows, headers={"Prefer": "return=minimal"})
+
+    def rows(self, table: str) -> list:
+        return [dict(r) for r in self.server.store.table(table).rows]
@@ -0,0 +1,106 @@
+import os
+import json
+import tempfile
+import functools
+import threading
+import unittest
+import http.server
+from pathlib import Path
+from unittest import mock
+
+import _support  # noqa: F401  (sys.path)
+
+import source_cache
+import ingest_checkpoint
+from upsert_pool import UpsertPool
+
+class Failing:
+    """post() that fails the batch starting at row fail_at once, then accepts everything."""
+
+    def __init__(self, fail_at: int = None):
+        self.fail_at = fail_at
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def __call__(self, table, rows):
+        with self._lock:
+            if self.fail_at is not None and rows[0] == self.fail_at:
+                self.fail_at = None
+                raise RuntimeError("HTTP 500 injected")
+            self.sent.extend(rows)
+
+class CheckpointResumeTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        (self.dir / "src").mkdir()
+        self._write_source("id\n" + "".join(f"{i}\n" for i in range(100)))
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(self.dir / "src"))
+        handler.log_message = lambda *a: None
+        self.http = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        self.addCleanup(self.http.server_close)
+        self.addCleanup(self.http.shutdown)
+        self.url = f"http://127.0.0.1:{self.http.server_address[1]}/ratings.csv"
+        cache = self.dir / "cache"
+        for p in (mock.patch.object(source_cache, "CACHE_DIR", cache),
+                  mock.patch.object(source_cache, "MANIFEST_PATH", cache / "manifest.json"),
+                  mock.patch.dict(os.environ, {"SUPABASE_URL": "http://db.test"})):
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _write_source(self, text: str):
+        path = self.dir / "src" / "ratings.csv"
+        path.write_text(text)
+        # The server answers If-Modified-Since by mtime; step it so a rewrite within a second still counts
+        self._mtime = getattr(self, "_mtime", path.stat().st_mtime) + 10
+        os.utime(path, (self._mtime, self._mtime))
+
+    def _rows(self):
+        return (int(r["id"]) for r in source_cache.iter_csv_rows(self.url))
+
+    def _run(self, post, resume: bool, in_flight: int = 4):
+        ckpt = ingest_checkpoint.Checkpoint("test_ingest", resume=resume, checkpoint_dir=self.dir / "ckpt")
+        rows = ckpt.skip("raw_ratings", self.url, self._rows())
+        with UpsertPool(post, max_in_flight=in_flight, on_commit=ckpt.on_commit) as pool:
+            pool.feed("raw_ratings", rows, batch_rows=10)
+        ckpt.finish("raw_ratings")
+        return ckpt
+
+    def _state(self):
+        with open(self.dir / "ckpt" / "test_ingest.json", encoding="utf-8") as f:
+            return json.load(f)["tables"]["raw_ratings"]
+
+    def test_resume_continues_after_the_last_batch_committed_in_order(self):
+        with self.assertRaises(RuntimeError):
+            self._run(Failing(fail_at=30), resume=False)
+        state = self._state()
+        # Batches after the failed one may have landed, but the offset stops before the gap
+        self.assertEqual((state["offset"], state["batch"], state["done"]), (30, 2, False))
+        post = Failing()
+        self._run(post, resume=True)
+        self.assertEqual(post.sent, list(range(30, 100)))
+        self.assertEqual((self._state()["offset"], self._state()["done"]), (100, True))
+
+    def test_changed_source_restarts_the_table(self):
+        with self.assertRaises(RuntimeError):
+            self._run(Failing(fail_at=50), resume=False, in_flight=1)
+        self._write_source("id\n" + "".join(f"{i}\n" for i in range(200, 260)))
+        post = Failing()
+        self._run(post, resume=True)
+        self.assertEqual(post.sent, list(range(200, 260)))
+
+    def test_other_target_or_no_resume_starts_over(self):
+        with self.assertRaises(RuntimeError):
+            self._run(Failing(fail_at=50), resume=False, in_flight=1)
+        with mock.patch.dict(os.environ, {"SUPABASE_URL": "http://other.test"}):
+            post = Failing()
+            self._run(post, resume=True)
+        self.assertEqual(post.sent, list(range(100)))
+        post = Failing()
+        self._run(post, resume=False)
+        self.assertEqual(post.sent, list(range(100)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import csv
+import random
+import tempfile
+import unittest
+from array import array
+from pathlib import Path
+from unittest import mock
+
+import _support  # noqa: F401  (sys.path)
+
+import rating_dedup
+import interactions_cache
+
+def _latest(tuples) -> dict:
+    # Brute force: last row with the greatest ts per key; a missing ts loses to any timestamp
+    out = {}
+    for t in tuples:
+        k, ts = (t[0], t[1]), interactions_cache.ts_epoch(t[3])
+        if k not in out or ts >= interactions_cache.ts_epoch(out[k][3]):
+            out[k] = t
+    return out
+
+def _tuples(n, seed):
+    rnd = random.Random(seed)
+    return [(rnd.randint(1, 25), rnd.randint(1, 25), float(i), rnd.choice(["", str(rnd.randint(1, 40))]))
+            for i in range(n)]
+
+class _Both:
+    """Runs each test with numpy (when installed) and with the stdlib fallback."""
+
+    def run_both(self, check):
+        with self.subTest(numpy=rating_dedup.np is not None):
+            check()
+        with self.subTest(numpy=False), mock.patch.object(rating_dedup, "np", None), \
+                mock.patch.object(interactions_cache, "np", None):
+            check()
+
+class LatestMaskTest(_Both, unittest.TestCase):
+    def test_winner_selection(self):
+        def check():
+            uids = array("q", [1, 1, 1, 2, 2, 3, 3])
+            mids = array("q", [5, 5, 5, 5, 5, 9, 9])
+            ts = array("q", [10, 30, 30, 7, interactions_cache.TS_MISSING, interactions_cache.TS_MISSING, interactions_cache.TS_MISSING])
+            keep, removed = rating_dedup.latest_mask(uids, mids, ts)
+            # tie on ts -> the later row; a missing ts loses; all missing -> the later row
+            self.assertEqual(list(keep), [0, 0, 1, 1, 0, 0, 1])
+            self.assertEqual(removed, 4)
+        self.run_both(check)
+
+    def test_dedup_rows_keeps_source_order(self):
+        def check():
+            rows = [{"user_id": u, "movie_id": m, "value": v, "ts": t} for u, m, v, t in _tuples(500, 1)]
+            got, removed = rating_dedup.dedup_rows(rows, quiet=True)
+            want = _latest([(r["user_id"], r["movie_id"], r["value"], r["ts"]) for r in rows])
+            self.assertEqual(len(got) + removed, len(rows))
+            self.assertEqual([(r["user_id"], r["movie_id"], r["value"], r["ts"]) for r in got],
+                             sorted(want.values(), key=lambda t: t[2]))
+        self.run_both(check)
+
+class StreamDedupTest(_Both, unittest.TestCase):
+    def test_latest_ts_wins_across_batches(self):
+        tuples = _tuples(2000, 2)
+
+        def check():
+            sd = rating_dedup.StreamDedup()
+            kept, reported, replaced = {}, 0, 0
+            for i in range(0, len(tuples), 61):
+                batch = tuples[i:i + 61]
+                keep, n = sd.keep(batch)
+                reported += n
+                for t, k in zip(batch, keep):
+                    if k:
+                        replaced += (t[0], t[1]) in kept
+                        kept[(t[0], t[1])] = t
+            self.assertEqual(kept, _latest(tuples))
+            self.assertEqual(reported, replaced)
+            self.assertEqual(sd.superseded, replaced)
+            self.assertEqual(sd.removed + len(kept) + replaced, len(tuples))
+        self.run_both(check)
+
+class DedupCsvTest(_Both, unittest.TestCase):
+    def test_rewrites_csv_and_columns(self):
+        tuples = _tuples(300, 3)
+
+        def check():
+            with tempfile.TemporaryDirectory() as d:
+                path = Path(d) / "interaction_log_processed.csv"
+                with interactions_cache.ColumnWriter(path) as cols, open(path, "w", newline="", encoding="utf-8") as f:
+                    w = csv.writer(f)
+                    w.writerow(["user_id", "movie_id", "value", "ts"])
+                    for t in tuples:
+                        w.writerow(t)
+                        cols.append(*t)
+                removed = rating_dedup.dedup_csv(path)
+                want = sorted(_latest(tuples).values(), key=lambda t: t[2])
+                self.assertEqual(removed, len(tuples) - len(want))
+                with open(path, newline="", encoding="utf-8") as f:
+                    rows = [(int(r["user_id"]), int(r["movie_id"]), float(r["value"]), r["ts"]) for r in csv.DictReader(f)]
+                self.assertEqual(rows, want)
+                c = interactions_cache.load(path)
+                self.assertEqual(c.source, "npy")
+                self.assertEqual([float(v) for v in c.value], [t[2] for t in want])
+        self.run_both(check)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import random
+import unittest
+
+from _support import FakeSupabase
+
+import table_reader
+
+def _interactions(n_users=60, per_user=40, seed=3):
+    rnd = random.Random(seed)
+    rows = [{"user_id": u, "movie_id": m, "value": rnd.choice([1.0, 2.5, 4.0, 5.0]), "ts": "2020-01-01T00:00:00Z"}
+            for u in range(1, n_users + 1) for m in rnd.sample(range(1, 400), per_user)]
+    rnd.shuffle(rows)          # insertion order must not leak into the result
+    return rows
+
+class ReadTest(unittest.TestCase):
+    # db_max_rows below the requested page forces the short-page handling as well
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = cls.enterClassContext(FakeSupabase(db_max_rows=150))
+        cls.rows = _interactions()
+        cls.fake.seed("processed_interactions", cls.rows)
+        cls.fake.seed("raw_movies", [{"movie_id": m, "title": f"Movie {m}", "genres": "x"} for m in range(399, 0, -1)])
+        cls.expected = sorted((r["user_id"], r["movie_id"], r["value"]) for r in cls.rows)
+
+    def _triples(self, rows):
+        return [(r["user_id"], r["movie_id"], r["value"]) for r in rows]
+
+    def test_keyset_scan_returns_every_row_in_key_order(self):
+        got = table_reader.fetch_all("processed_interactions", "user_id,movie_id,value", page=200, workers=3)
+        self.assertEqual(self._triples(got), self.expected)
+
+    def test_range_windows_return_every_row_in_key_order(self):
+        for count in ("exact", "planned"):
+            got = table_reader.fetch_all("processed_interactions", "user_id,movie_id,value", page=200, workers=3,
+                                         keyset=False, count=count)
+            self.assertEqual(self._triples(got), self.expected, count)
+
+    def test_csv_pages_match_json_pages(self):
+        as_json = table_reader.fetch_all("raw_movies", "movie_id,title", page=64, workers=2)
+        as_csv = table_reader.fetch_all("raw_movies", "movie_id,title", page=64, workers=2, fmt="csv")
+        self.assertEqual(as_csv, as_json)
+        self.assertEqual([r["movie_id"] for r in as_json], list(range(1, 400)))
+
+    def test_fetch_columns_matches_the_rows(self):
+        for fmt in ("csv", "json"):
+            t = table_reader.fetch_columns("processed_interactions", page=128, workers=4, fmt=fmt)
+            got = [(int(u), int(m), float(v)) for u, m, v in zip(t.user_id, t.movie_id, t.value)]
+            self.assertEqual(got, self.expected, fmt)
+
+    def test_count(self):
+        self.assertEqual(table_reader.count("processed_interactions"), len(self.rows))
+        self.assertEqual(table_reader.count("processed_interactions", {"user_id": "eq.1"}), 40)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import random
+import unittest
+from unittest import mock
+
+import _support  # noqa: F401  (sys.path)
+
+import topn
+
+def _brute(movie_id, score, tie, seen_by_user: dict, n: int) -> dict:
+    order = sorted(range(len(movie_id)), key=lambda i: (-score[i], tie[i]))
+    return {u: [(movie_id[i], score[i]) for i in order if movie_id[i] not in s][:n] for u, s in sorted(seen_by_user.items())}
+
+def _collect(batches) -> dict:
+    out = {}
+    for b in batches:
+        for uid, items in b.by_user():
+            out[uid] = items
+    return out
+
+class GlobalTopNTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(11)
+        self.mids = rnd.sample(range(1, 5000), 300)
+        # Coarse scores so ties are common; tie is a permutation unrelated to movie_id
+        self.scores = [rnd.choice([1.0, 2.0, 2.5, 3.0, 3.5, 4.0]) for _ in self.mids]
+        self.tie = rnd.sample(range(len(self.mids)), len(self.mids))
+        self.seen = {u: set(rnd.sample(self.mids, rnd.randint(0, 120))) for u in range(1, 150)}
+        self.seen[150] = set(self.mids)         # has seen every scored movie
+        self.seen[151] = {999999}               # has only seen unscored movies
+
+    def _check(self, n, batch):
+        want = _brute(self.mids, self.scores, self.tie, self.seen, n)
+        got = _collect(topn.global_top_n(self.mids, self.scores, topn.Seen.from_sets(self.seen), n=n, batch=batch, tie=self.tie))
+        self.assertEqual(got, want)
+        self.assertEqual(got[150], [])
+
+    def test_matches_a_full_sort(self):
+        for n, batch in ((20, 64), (1, 7), (300, 1000)):
+            self._check(n, batch)
+
+    def test_matches_a_full_sort_without_numpy(self):
+        with mock.patch.object(topn, "np", None):
+            self._check(20, 64)
+
+    def test_default_tie_is_movie_id(self):
+        want = _brute(self.mids, self.scores, self.mids, self.seen, 10)
+        got = _collect(topn.global_top_n(self.mids, self.scores, topn.Seen.from_sets(self.seen), n=10))
+        self.assertEqual(got, want)
+
+    def test_empty_catalog_still_yields_every_user(self):
+        got = _collect(topn.global_top_n([], [], topn.Seen.from_sets(self.seen), n=5, batch=40))
+        self.assertEqual(got, {u: [] for u in self.seen})
+
+class PersonalTopNTest(unittest.TestCase):
+    @unittest.skipIf(topn.np is None, "personal_top_n needs numpy")
+    def test_matches_a_full_sort_per_user(self):
+        np = topn.np
+        rnd = np.random.default_rng(5)
+        mids = list(range(10, 210))
+        seen = {u: set(rnd.choice(mids, size=rnd.integers(0, 60), replace=False).tolist()) for u in range(1, 40)}
+        seen[40] = set(mids)
+        users = sorted(seen)
+        mat = np.round(rnd.normal(3.0, 1.0, (len(users), len(mids))), 1)   # rounded, so rows have ties
+        got = _collect(topn.personal_top_n(lambda b0, b1: mat[b0:b1], mids, topn.Seen.from_sets(seen), n=15, batch=8))
+        want = {u: _brute(mids, mat[i].tolist(), mids, {u: seen[u]}, 15)[u] for i, u in enumerate(users)}
+        self.assertEqual(got, want)
+
+if __name__ == "__main__":
+    unittest.main()
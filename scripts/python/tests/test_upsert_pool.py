@@ -0,0 +1,103 @@
+import threading
+import unittest
+
+from _support import FakeSupabase
+
+from upsert_pool import BatchSizer, UpsertPool
+
+class TooLarge(Exception):
+    code = 413
+
+class Unavailable(Exception):
+    code = 503
+
+class Recorder:
+    """post() that accepts batches of at most max_rows and records what it accepted."""
+
+    def __init__(self, max_rows: int, error=TooLarge):
+        self.max_rows, self.error = max_rows, error
+        self.sent, self.attempts = [], []
+        self._lock = threading.Lock()
+
+    def __call__(self, table, rows):
+        with self._lock:
+            self.attempts.append(len(rows))
+            if len(rows) > self.max_rows:
+                raise self.error(f"HTTP {self.error.code} for {len(rows)} rows")
+            self.sent.append(list(rows))
+
+class BatchSizerTest(unittest.TestCase):
+    def test_budget_halves_on_backoff_and_grows_when_healthy(self):
+        sz = BatchSizer("t", target_bytes=64 << 10, min_bytes=1 << 10, step_bytes=4 << 10, initial_rows=50)
+        self.assertEqual(sz.rows, 50)                  # no byte estimate yet
+        sz.observe([{"user_id": 1, "movie_id": 2, "value": 3.5}] * 32)
+        before = sz.rows
+        sz.on_backoff()
+        self.assertEqual(sz.budget, 32 << 10)
+        self.assertLess(sz.rows, before)
+        sz.on_success(0.01)
+        self.assertEqual(sz.budget, 36 << 10)
+        sz.on_success(sz.healthy_seconds + 1)          # slow but successful: no growth
+        self.assertEqual(sz.budget, 36 << 10)
+
+    def test_budget_stays_above_the_floor(self):
+        sz = BatchSizer("t", target_bytes=8 << 10, min_bytes=2 << 10)
+        for _ in range(10):
+            sz.on_backoff()
+        self.assertEqual(sz.budget, 2 << 10)
+
+class SplitOn413Test(unittest.TestCase):
+    def _check_delivery(self, rec, rows, committed):
+        got = [r for b in rec.sent for r in b]
+        self.assertEqual(sorted(got), sorted(rows))    # each row exactly once
+        self.assertTrue(all(len(b) <= rec.max_rows for b in rec.sent))
+        self.assertEqual(committed, {"t": len(rows)})
+
+    def test_fixed_pool_splits_and_remembers_the_size_that_fit(self):
+        rec, rows = Recorder(max_rows=30), list(range(1000))
+        with UpsertPool(rec, max_in_flight=1) as pool:
+            pool.feed("t", rows, batch_rows=200)
+        self._check_delivery(rec, rows, pool.committed)
+        # 200 -> 100 -> 50 -> 25 once; later batches are pre-split to 25 without another 413
+        self.assertEqual(sum(1 for n in rec.attempts if n > 30), 3)
+
+    def test_adaptive_pool_splits_and_shrinks_its_sizer(self):
+        rec, rows = Recorder(max_rows=40), [{"id": i, "pad": "x" * 40} for i in range(2000)]
+        with UpsertPool(rec, max_in_flight=3, adaptive=True, initial_rows=400, target_bytes=64 << 10) as pool:
+            pool.feed("t", rows)
+        got = sorted(r["id"] for b in rec.sent for r in b)
+        self.assertEqual(got, list(range(2000)))
+        self.assertGreater(pool.sizers["t"].decreases, 0)
+        self.assertEqual(pool.committed, {"t": 2000})
+
+    def test_backoff_split_only_when_idempotent(self):
+        rows = list(range(100))
+        rec = Recorder(max_rows=30, error=Unavailable)
+        with self.assertRaises(Unavailable):
+            with UpsertPool(rec, max_in_flight=1, adaptive=True, initial_rows=100) as pool:
+                pool.feed("t", rows)
+        rec = Recorder(max_rows=30, error=Unavailable)
+        with UpsertPool(rec, max_in_flight=1, adaptive=True, initial_rows=100, idempotent=True) as pool:
+            pool.feed("t", rows)
+        self.assertEqual(sorted(r for b in rec.sent for r in b), rows)
+
+    def test_on_commit_fires_in_submission_order(self):
+        seen = []
+        rec = Recorder(max_rows=10)
+        with UpsertPool(rec, max_in_flight=4, on_commit=lambda t, seq, n: seen.append(seq)) as pool:
+            pool.feed("t", list(range(500)), batch_rows=25)
+        self.assertEqual(seen, list(range(20)))
+
+    def test_fake_postgrest_413(self):
+        with FakeSupabase(max_rows=50) as fake:
+            def post(table, batch):
+                fake.client.request("POST", f"/rest/v1/{table}", body=batch, params={"on_conflict": "movie_id"},
+                                    headers={"Prefer": "resolution=merge-duplicates,return=minimal"})
+            rows = [{"movie_id": m, "title": f"Movie {m}", "genres": "x"} for m in range(1, 601)]
+            with UpsertPool(post, max_in_flight=2, adaptive=True, initial_rows=300, idempotent=True) as pool:
+                pool.feed("raw_movies", rows)
+            self.assertEqual(sorted(r["movie_id"] for r in fake.rows("raw_movies")), list(range(1, 601)))
+            self.assertGreater(pool.sizers["raw_movies"].decreases, 0)     # the RestError 413s were split
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+"""
+Concurrent batch upserts for the Supabase REST scripts.
+
+UpsertPool keeps up to N batches in flight on a thread pool, with an optional
+per-table cap. It preserves the split-on-413 behavior of the old sequential
+loops: an oversized batch is halved and retried, and later batches for that
+table are pre-split to the size that worked. Completions are tracked in
+submission order per table, so on_commit(table, seq, rows) only fires once
+every earlier batch for that table has been acknowledged.
+
+With adaptive=True, feed() cuts batches with a per-table BatchSizer instead of a
+fixed row count. The sizer targets a payload size in bytes and adjusts it AIMD
+style: the byte budget grows additively while requests stay fast and halves
+on 413, 5xx or timeouts. Row count follows from the observed bytes per row, so
+heavy recommendation rows and light rating rows each settle on their own size.
+A 5xx or timeout may arrive after the server applied the batch, so the failed
+batch is only split and resent when the caller passes idempotent=True (its post
+upserts on a unique key); otherwise the error is raised and only later batches
+shrink.
+
+Usage:
+    with UpsertPool(post, max_in_flight=4, table_limits={"raw_movies": 2}) as pool:
+        for batch in batches:
+            pool.submit("raw_ratings", batch)
+    # leaving the block waits for every batch and re-raises the first failure
+
+Env:
+- UPSERT_CONCURRENCY      default max_in_flight (default 4)
+- UPSERT_TARGET_BYTES     starting payload budget per batch (default 1 MiB)
+- UPSERT_MAX_BYTES        ceiling for the budget (default 8 MiB)
+- UPSERT_HEALTHY_SECONDS  a batch faster than this grows the budget (default 2.0)
+"""
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CONCURRENCY = int(os.environ.get("UPSERT_CONCURRENCY") or 4)
+TARGET_BYTES = int(os.environ.get("UPSERT_TARGET_BYTES") or 1 << 20)
+MAX_BYTES = int(os.environ.get("UPSERT_MAX_BYTES") or 8 << 20)
+HEALTHY_SECONDS = float(os.environ.get("UPSERT_HEALTHY_SECONDS") or 2.0)
+
+_TOO_LARGE_MARKERS = ("HTTP 413", "Payload too large", "Request body too large", "row is too large")
+
+def is_payload_too_large(exc: BaseException) -> bool:
+    if getattr(exc, "code", None) == 413 or getattr(exc, "status_code", None) == 413:
+        return True
+    msg = str(exc)
+    return any(m in msg for m in _TOO_LARGE_MARKERS)
+
+def is_backoff_signal(exc: BaseException) -> bool:
+    """Server overloaded or slow: 5xx status, or a transport timeout."""
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int) and 500 <= code < 600:
+        return True
+    return isinstance(exc, TimeoutError) or "timed out" in str(exc)
+
+def _row_bytes(rows: list) -> float:
+    # Encode an evenly spaced sample instead of the whole batch; the post callable does the real encoding.
+    step = max(1, len(rows) // 16)
+    sample = rows[::step][:16]
+    return (len(json.dumps(sample)) - 1) / len(sample)
+
+class BatchSizer:
+    """AIMD payload budget for one table, expressed in bytes and converted to rows."""
+
+    def __init__(self, table: str, target_bytes: int = TARGET_BYTES, max_bytes: int = MAX_BYTES,
+                 min_bytes: int = 16 << 10, step_bytes: int = None, healthy_seconds: float = HEALTHY_SECONDS,
+                 initial_rows: int = 500, min_rows: int = 1, max_rows: int = 100000):
+        self.table = table
+        self.budget = float(target_bytes)
+        self.max_bytes, self.min_bytes = max_bytes, min_bytes
+        self.step = float(step_bytes or max(min_bytes, target_bytes // 8))
+        self.healthy_seconds = healthy_seconds
+        self.min_rows, self.max_rows = min_rows, max_rows
+        self.bytes_per_row = None           # EWMA of encoded JSON bytes per row
+        self._initial_rows = initial_rows
+        self._lock = threading.Lock()
+        self.increases = self.decreases = 0
+
+    @property
+    def rows(self) -> int:
+        with self._lock:
+            if not self.bytes_per_row:
+                return max(self.min_rows, min(self.max_rows, self._initial_rows))
+            return max(self.min_rows, min(self.max_rows, int(self.budget / self.bytes_per_row)))
+
+    def observe(self, rows: list):
+        bpr = _row_bytes(rows)
+        with self._lock:
+            self.bytes_per_row = bpr if self.bytes_per_row is None else 0.8 * self.bytes_per_row + 0.2 * bpr
+
+    def on_success(self, seconds: float):
+        with self._lock:
+            if seconds <= self.healthy_seconds and self.budget < self.max_bytes:
+                self.budget = min(self.max_bytes, self.budget + self.step)
+                self.increases += 1
+
+    def on_backoff(self):
+        with self._lock:
+            self.budget = max(self.min_bytes, self.budget / 2)
+            self.decreases += 1
+
+    def log_settled(self):
+        bpr = self.bytes_per_row or 0.0
+        print(f"[v0] {self.table} batch size settled at {self.rows} rows (~{self.budget / 1024:.0f} KiB budget, "
+              f"{bpr:.0f} B/row; +{self.increases} / -{self.decreases})")
+
+class UpsertPool:
+    def __init__(self, post, max_in_flight: int = DEFAULT_CONCURRENCY, table_limits: dict = None,
+                 is_too_large=is_payload_too_large, min_rows: int = 1, on_commit=None,
+                 adaptive: bool = False, initial_rows: int = 500, target_bytes: int = TARGET_BYTES,
+                 idempotent: bool = False):
+        self.post = post                    # post(table, rows) -> None, raises on failure
+        self.idempotent = idempotent        # post upserts, so a batch may be resent after a 5xx/timeout
+        self.max_in_flight = max(1, max_in_flight)
+        self.table_limits = dict(table_limits or {})
+        self.is_too_large = is_too_large
+        self.min_rows = max(1, min_rows)
+        self.on_commit = on_commit
+        self.adaptive = adaptive
+        self._sizer_args = {"initial_rows": initial_rows, "target_bytes": target_bytes, "min_rows": self.min_rows}
+        self.sizers = {}                    # table -> BatchSizer (adaptive pools only)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._table_slots = {}
+        self._lock = threading.Lock()
+        self._max_rows = {}                 # table -> largest batch known to fit after a split
+        self._next_seq = {}                 # table -> next sequence number to hand out
+        self._next_commit = {}              # table -> lowest sequence number not yet committed
+        self._done = {}                     # table -> {seq: rows} acknowledged out of order
+        self._futures = []
+        self._error = None
+        self.committed = {}                 # table -> rows acknowledged in order
+        self._ex = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="upsert")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.drain()
+        else:
+            self._ex.shutdown(wait=True, cancel_futures=True)
+        return False
+
+    def _table_sem(self, table: str):
+        with self._lock:
+            sem = self._table_slots.get(table)
+            if sem is None:
+                sem = threading.BoundedSemaphore(max(1, min(self.table_limits.get(table, self.max_in_flight), self.max_in_flight)))
+                self._table_slots[table] = sem
+            return sem
+
+    def sizer(self, table: str) -> BatchSizer:
+        with self._lock:
+            sz = self.sizers.get(table)
+            if sz is None:
+                sz = self.sizers[table] = BatchSizer(table, **self._sizer_args)
+            return sz
+
+    def feed(self, table: str, rows, batch_rows: int = None) -> int:
+        """Cut rows (any iterable) into batches and submit them. Adaptive pools size each batch from the
+        table's BatchSizer; otherwise batch_rows is used. Returns the number of rows queued."""
+        if not self.adaptive and not batch_rows:
+            raise ValueError("feed() needs batch_rows on a non-adaptive pool")
+        sizer = self.sizer(table) if self.adaptive else None
+        n, batch = 0, []
+        limit = sizer.rows if sizer else batch_rows
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= limit:
+                self.submit(table, batch); n += len(batch); batch = []
+                limit = sizer.rows if sizer else batch_rows
+        if batch:
+            self.submit(table, batch); n += len(batch)
+        return n
+
+    def submit(self, table: str, rows: list) -> int:
+        """Queue one batch; blocks while the pool or the table is at its in-flight limit."""
+        if self._error is not None:
+            raise self._error
+        if not rows:
+            return -1
+        table_sem = self._table_sem(table)
+        table_sem.acquire()
+        self._slots.acquire()
+        with self._lock:
+            seq = self._next_seq.get(table, 0)
+            self._next_seq[table] = seq + 1
+        fut = self._ex.submit(self._run, table, seq, rows)
+        fut.add_done_callback(lambda _f: (self._slots.release(), table_sem.release()))
+        self._futures.append(fut)
+        return seq
+
+    def _run(self, table: str, seq: int, rows: list):
+        try:
+            self._send(table, rows)
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            raise
+        self._mark_done(table, seq, len(rows))
+
+    def _send(self, table: str, rows: list):
+        limit = self._max_rows.get(table)
+        if limit and len(rows) > limit:
+            for i in range(0, len(rows), limit):
+                self._send(table, rows[i:i+limit])
+            return
+        sizer = self.sizer(table) if self.adaptive else None
+        if sizer:
+            sizer.observe(rows)
+        t0 = time.monotonic()
+        try:
+            self.post(table, rows)
+            if sizer:
+                sizer.on_success(time.monotonic() - t0)
+        except Exception as e:
+            too_large = self.is_too_large(e)
+            if sizer and (too_large or is_backoff_signal(e)):
+                sizer.on_backoff()
+            if not (too_large or (sizer and self.idempotent and is_backoff_signal(e))) or len(rows) <= self.min_rows:
+                raise
+            half = max(self.min_rows, len(rows) // 2)
+            if not sizer:
+                # Fixed-size pools remember the size that fit; adaptive pools let the sizer regrow.
+                with self._lock:
+                    if self._max_rows.get(table, len(rows)) > half:
+                        self._max_rows[table] = half
+            print(f"[v0] {table} reduce batch {len(rows)} → {half} due to: {str(e)[:140]}...")
+            self._send(table, rows[:half])
+            self._send(table, rows[half:])
+
+    def _mark_done(self, table: str, seq: int, n: int):
+        with self._lock:
+            done = self._done.setdefault(table, {})
+            done[seq] = n
+            nxt = self._next_commit.get(table, 0)
+            ready = []
+            while nxt in done:
+                ready.append((nxt, done.pop(nxt)))
+                nxt += 1
+            self._next_commit[table] = nxt
+            for s, k in ready:
+                self.committed[table] = self.committed.get(table, 0) + k
+                if self.on_commit:
+                    self.on_commit(table, s, k)
+
+    def wait(self):
+        """Wait for the batches submitted so far without closing the pool; re-raises the first failure."""
+        for fut in list(self._futures):
+            fut.exception()
+        if self._error is not None:
+            raise self._error
+
+    def drain(self) -> dict:
+        """Wait for every submitted batch; re-raises the first failure. Returns rows committed per table."""
+        try:
+            for fut in self._futures:
+                fut.exception()
+        finally:
+            self._ex.shutdown(wait=True)
+        if self._error is not None:
+            raise self._error
+        self._futures = []
+        for sz in self.sizers.values():
+            sz.log_settled()
+        return dict(self.committed)
@@ -0,0 +1,45 @@
+-- Server-side derivation of processed_interactions from raw_ratings.
+-- Lets the ingest scripts upload each rating once (raw_ratings) and fill
+-- processed_interactions with one set-based statement per user-id range,
+-- called over PostgREST RPC: POST /rest/v1/rpc/derive_processed_interactions
+--   {"p_user_min": 1, "p_user_max": 20000}   (nulls = whole table)
+-- Requires the unique index from 013_add_unique_indexes.sql. Safe to re-run:
+-- rows already up to date are not rewritten, so repeated calls are idempotent.
+
+create or replace function public.derive_processed_interactions(
+  p_user_min bigint default null,
+  p_user_max bigint default null
+)
+returns bigint
+language plpgsql
+set search_path = public
+as $$
+declare
+  affected bigint;
+begin
+  insert into public.processed_interactions (user_id, movie_id, value, ts)
+  select distinct on (r.user_id, r.movie_id)
+         r.user_id, r.movie_id, r.rating, r.ts
+  from public.raw_ratings r
+  where r.user_id is not null
+    and r.movie_id is not null
+    and r.rating is not null
+    and r.ts is not null
+    and (p_user_min is null or r.user_id >= p_user_min)
+    and (p_user_max is null or r.user_id <= p_user_max)
+  order by r.user_id, r.movie_id, r.ts desc
+  on conflict (user_id, movie_id) do update
+    set value = excluded.value,
+        ts = excluded.ts
+    where (processed_interactions.value, processed_interactions.ts)
+          is distinct from (excluded.value, excluded.ts);
+  get diagnostics affected = row_count;
+  return affected;
+end;
+$$;
+
+revoke all on function public.derive_processed_interactions(bigint, bigint) from public, anon, authenticated;
+grant execute on function public.derive_processed_interactions(bigint, bigint) to service_role;
+
+-- Make the function visible to PostgREST without a restart
+notify pgrst, 'reload schema';
@@ -0,0 +1,5 @@
+-- Index for incremental snapshot refreshes (scripts/python/table_snapshot.py):
+-- the trainers read processed_interactions rows with ts >= <watermark>, which
+-- otherwise scans the whole table. Safe to run multiple times.
+
+create index if not exists processed_interactions_ts_idx on public.processed_interactions (ts);
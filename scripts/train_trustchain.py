@@ -2,6 +2,7 @@
 
 import csv
 import os
+import sys
 from collections import defaultdict
 from typing import Dict, List, Tuple
 
@@ -10,6 +11,29 @@ try:
 except Exception:
     np = None
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "python"))
+try:
+    import interaction_matrix
+except Exception:
+    interaction_matrix = None
+
+def read_matrix(csv_path: str):
+    # Integer-id CSVs with a value column (interaction_log_processed.csv) load into a sparse user x item
+    # matrix, from the .npy column cache when the pipeline wrote one; the cache is never written for other
+    # CSVs. None without a value column (every interaction counts 1.0, see read_interactions), for string
+    # ids or without numpy
+    if interaction_matrix is None:
+        return None
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f), [])
+    if "value" not in header:
+        return None
+    try:
+        mat = interaction_matrix.from_csv(csv_path, build=False, default_value=1.0)
+    except Exception:
+        return None
+    return mat if mat.nnz else None
+
 def read_interactions(csv_path: str) -> Dict[str, List[Tuple[str, float]]]:
     sessions: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
     with open(csv_path, newline="", encoding="utf-8") as f:
@@ -34,14 +58,27 @@ def train_simple_popularity(sessions: Dict[str, List[Tuple[str, float]]]):
             pop[k] = (pop[k] / denom) if denom else 0.0
     return pop
 
+def matrix_popularity(mat) -> Dict[str, float]:
+    # Column sums of the user x item matrix, normalized like train_simple_popularity
+    pop = mat.col_sums()
+    denom = pop.max() if pop.size > 0 else 1.0
+    if denom:
+        pop = pop / denom
+    return dict(zip((str(i) for i in mat.col_ids.tolist()), pop.tolist()))
+
 def main():
     csv_path = os.environ.get("INTERACTIONS_CSV", "interactions.csv")
     if not os.path.exists(csv_path):
         print("[v0] CSV not found:", csv_path)
         return
-    sessions = read_interactions(csv_path)
-    print("[v0] Users:", len(sessions))
-    pop = train_simple_popularity(sessions)
+    mat = read_matrix(csv_path)
+    if mat is not None:
+        print("[v0] Users:", mat.shape[0])
+        pop = matrix_popularity(mat)
+    else:
+        sessions = read_interactions(csv_path)
+        print("[v0] Users:", len(sessions))
+        pop = train_simple_popularity(sessions)
     top = sorted(pop.items(), key=lambda x: x[1], reverse=True)[:10]
     print("[v0] Top-10 items (popularity):")
     for iid, score in top: